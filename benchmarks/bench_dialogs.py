@@ -0,0 +1,79 @@
+"""
+Time to dialog for the configuration window: parsing the .ui on every open
+(what the kit used to do), the form cached by forms.py (compiled or parsed
+once) and re-opening the ConfigWindow that MainWindow keeps alive.
+
+    python forms.py                      # compile the forms first
+    python -m benchmarks.bench_dialogs --repeat 20
+
+Runs on the offscreen Qt platform unless QT_QPA_PLATFORM says otherwise.
+"""
+
+import os
+import statistics
+from time import perf_counter
+from argparse import ArgumentParser
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import uic
+from PyQt5.QtWidgets import QApplication, QDialog
+
+import forms
+import main as kit
+
+
+def measure(open_dialog, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = perf_counter()
+        dialog = open_dialog()
+        QApplication.processEvents()
+        timings.append(perf_counter() - started)
+        dialog.hide()
+    return timings
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    window = kit.MainWindow()
+
+    def load_ui():
+        dialog = QDialog(window)
+        uic.loadUi(forms.ui_file('conf_window'), dialog)
+        dialog.show()
+        return dialog
+
+    def new_config_window():
+        return kit.ConfigWindow(window)
+
+    def reused_config_window():
+        if window.config_window is None:
+            window.config_window = kit.ConfigWindow(window)
+        else:
+            window.config_window.load_configurations()
+            window.config_window.show()
+        return window.config_window
+
+    source = 'compiled' if forms.is_compiled('conf_window') else 'parsed once'
+    scenarios = [
+            ('uic.loadUi on every open', load_ui),
+            (f'ConfigWindow, form {source}', new_config_window),
+            ('ConfigWindow kept alive', reused_config_window),
+        ]
+
+    print(f"{'scenario':<36}{'median ms':>12}{'best ms':>10}")
+    for name, open_dialog in scenarios:
+        timings = measure(open_dialog, args.repeat)
+        print(f"{name:<36}{statistics.median(timings) * 1000:>12.1f}{min(timings) * 1000:>10.1f}")
+
+    window.close()
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
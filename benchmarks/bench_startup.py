@@ -0,0 +1,105 @@
+"""
+Cold start cost of the kit: `python -X importtime` of the entry modules and
+the time it takes main.py to put its window on screen.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --module utils --top 15
+
+Each measurement runs in a fresh interpreter. Modules that must stay out of
+the startup path (boto3, botocore, pika) are listed when they show up.
+"""
+
+import os
+import sys
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ['main', 'utils']
+DEFERRED_MODULES = ('boto3', 'botocore', 'pika', 's3transfer')
+
+FIRST_WINDOW = r'''
+from time import perf_counter
+started = perf_counter()
+
+from PyQt5.QtCore import QTimer
+import main
+
+app = main.QApplication([])
+main.qdarktheme.setup_theme(main.C.get_theme())
+window = main.MainWindow()
+
+def shown():
+    print(perf_counter() - started)
+    app.quit()
+
+QTimer.singleShot(0, shown)
+app.exec_()
+'''
+
+
+def environment():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return env
+
+
+def import_times(module):
+    """ [(cumulative_us, self_us, name)] of every module imported by `import module` """
+
+    result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=BASE_DIR, env=environment(), capture_output=True, text=True
+        )
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    if result.returncode:
+        print(result.stderr.splitlines()[-1] if result.stderr else f"import {module} failed")
+    return timings
+
+
+def first_window_time():
+    result = subprocess.run(
+            [sys.executable, '-c', FIRST_WINDOW],
+            cwd=BASE_DIR, env=environment(), capture_output=True, text=True
+        )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', action='append', default=[], help="Module to import, repeatable")
+    parser.add_argument('--top', type=int, default=10, help="Slowest imports listed per module")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of the time-to-first-window measurement")
+    args = parser.parse_args()
+
+    for module in args.module or DEFAULT_MODULES:
+        timings = import_times(module)
+        if not timings:
+            continue
+
+        total = next((cumulative for cumulative, _, name in timings if name.strip() == module), 0)
+        print(f"\nimport {module}: {total / 1000:.1f} ms")
+        for cumulative, self_us, name in sorted(timings, reverse=True)[1:args.top + 1]:
+            print(f"  {cumulative / 1000:>8.1f} ms  {self_us / 1000:>7.1f} ms self  {name.strip()}")
+
+        loaded = sorted({name.strip() for *_, name in timings if name.strip().split('.')[0] in DEFERRED_MODULES})
+        if loaded:
+            print(f"  !! loaded at import time: {', '.join(loaded)}")
+
+    if 'main' in (args.module or DEFAULT_MODULES):
+        runs = [first_window_time() for _ in range(args.repeat)]
+        print(f"\ntime to first window: median {statistics.median(runs) * 1000:.0f} ms, "
+              f"best {min(runs) * 1000:.0f} ms over {args.repeat} runs")
+
+
+if __name__ == '__main__':
+    main()
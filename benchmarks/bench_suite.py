@@ -0,0 +1,356 @@
+"""
+Throughput and latency of the upload and publish paths, offline: a single
+file, many small files and a single huge file go through the in-process S3
+and AMQP stand-ins and the results are written as JSON, so that runs can be
+compared across commits.
+
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --scenario small --target publish --compare benchmarks/results/abc1234.json
+
+Targets:
+    upload            utils.AWS.upload, one file after another
+    publish           utils.RabbitMQ.publish, one confirmed message per file
+    pipeline          pipeline.Pipeline with both of the above, what the GUI runs
+    publisher_script  publisher_script.py in a scratch pwc checkout, wall time
+                      per run including the interpreter start and imports
+
+Latencies are per file (per run for publisher_script), in milliseconds.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from argparse import ArgumentParser
+
+import utils
+import outbox
+import multipart
+import hashcache
+import pipeline
+from benchmarks.fake_s3 import FakeS3
+from benchmarks.fake_amqp import FakeAMQP
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BASE_DIR, 'benchmarks', 'results')
+
+KB = 1024
+MB = utils.MB
+
+BUCKET_NAME = 'benchmark'
+QUEUE_NAME = 'benchmark'
+DB_NAME = 'benchmark'
+
+# what publisher_script.py imports from the pwc repo
+PWC_CONFIG = '''
+BUCKET_NAME = {bucket_name!r}
+AWS_URL = {endpoint_url!r}
+AWS_ACCESS_KEY_ID = 'fake'
+AWS_SECRET_ACCESS_KEY = 'fake'
+RABBITMQ_HOST = {host!r}
+RABBITMQ_PORT = {port!r}
+RABBITMQ_VIRTUAL_HOST = '/'
+RABBITMQ_USERNAME = 'guest'
+RABBITMQ_PASSWORD = 'guest'
+MONGO_DB = {db_name!r}
+'''
+PWC_CONSTANTS = 'RABBITMQ_QUEUE_NAME = {queue_name!r}\n'
+PUBLISHER_FILES = ('publisher_script.py', 'hashcache.py', 'pipeline.py', 'tracing.py', 'outbox.py',
+                   'multipart.py', 'watcher.py', 'loadgen.py', 'replies.py',
+                   'compression.py')
+
+
+class Scenario:
+    """ `runs` batches of `files` files of `size` bytes each """
+
+    def __init__(self, name, files, size, runs):
+        self.name = name
+        self.files = files
+        self.size = size
+        self.runs = runs
+
+    def create(self, directory):
+        """ Writes the files of one batch into a directory of their own, returns it and the paths """
+
+        batch_dir = os.path.join(directory, self.name)
+        os.makedirs(batch_dir)
+
+        block = os.urandom(min(self.size, MB))
+        paths = []
+        for index in range(self.files):
+            path = os.path.join(batch_dir, f'{self.name}_{index:05d}.bin')
+            with open(path, 'wb') as file:
+                remaining = self.size
+                while remaining:
+                    remaining -= file.write(block[:remaining])
+            paths.append(path)
+
+        return batch_dir, paths
+
+
+def percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def metrics(latencies, seconds, files, size, messages):
+    """ The JSON record of a target: throughput over `seconds` and the latency percentiles """
+
+    seconds = seconds or 1e-9
+    return dict(
+            files = files,
+            bytes = files * size,
+            seconds = round(seconds, 4),
+            files_per_sec = round(files / seconds, 2),
+            mb_per_sec = round(files * size / MB / seconds, 2),
+            msgs_per_sec = round(messages / seconds, 2),
+            p50_ms = round(percentile(latencies, 50) * 1000, 2),
+            p95_ms = round(percentile(latencies, 95) * 1000, 2),
+            p99_ms = round(percentile(latencies, 99) * 1000, 2),
+        )
+
+
+def message_for(path):
+    return dict(
+            file_name = os.path.basename(path), file_type = 'benchmark',
+            bucket_name = BUCKET_NAME, folder_name = 'benchmark'
+        )
+
+
+def bench_upload(scenario, batch_dir, paths, stand_ins):
+    aws = utils.AWS(stand_ins.s3.aws_config(BUCKET_NAME), 'benchmark')
+    aws.get_connection()
+
+    latencies = []
+    for _ in range(scenario.runs):
+        for path in paths:
+            started = time.perf_counter()
+            aws.upload(path, force=True)
+            latencies.append(time.perf_counter() - started)
+
+    return metrics(latencies, sum(latencies), len(latencies), scenario.size, 0)
+
+
+def bench_publish(scenario, batch_dir, paths, stand_ins):
+    rmq = utils.RabbitMQ(stand_ins.amqp.rabbit_config(), DB_NAME, QUEUE_NAME)
+    with rmq:
+        latencies = []
+        for _ in range(scenario.runs):
+            for path in paths:
+                message = message_for(path)
+                started = time.perf_counter()
+                rmq.publish(message)
+                latencies.append(time.perf_counter() - started)
+
+    # only the messages go through the broker, the files stay out of the byte count
+    return metrics(latencies, sum(latencies), len(latencies), 0, len(latencies))
+
+
+def bench_pipeline(scenario, batch_dir, paths, stand_ins):
+    aws = utils.AWS(stand_ins.s3.aws_config(BUCKET_NAME), 'benchmark')
+    rmq = utils.RabbitMQ(stand_ins.amqp.rabbit_config(), DB_NAME, QUEUE_NAME)
+
+    def upload(job):
+        return aws.upload(job.local_file_path, force=True)
+
+    def publish(job):
+        rmq.publish(job.message)
+
+    latencies, seconds = [], 0.0
+    with rmq:
+        for _ in range(scenario.runs):
+            stats = pipeline.Pipeline(upload, publish).run(
+                    [pipeline.PipelineJob(path, message_for(path)) for path in paths]
+                )
+            failed = next((job for job in stats.jobs if not job.ok), None)
+            if failed:
+                raise failed.error
+
+            seconds += stats.wall_time
+            latencies.extend(job.upload_time + job.queue_time + job.publish_time for job in stats.jobs)
+
+    return metrics(latencies, seconds, len(latencies), scenario.size, len(latencies))
+
+
+def pwc_checkout(directory, s3, amqp):
+    """ A scratch directory laid out like the pwc repo publisher_script.py is copied into """
+
+    pwc_dir = os.path.join(directory, 'pwc')
+    for package, name, source in (
+            ('config', 'config.py', PWC_CONFIG.format(
+                bucket_name=BUCKET_NAME, endpoint_url=s3.endpoint_url,
+                host=amqp.host, port=amqp.port, db_name=DB_NAME
+            )),
+            ('constants', 'constant.py', PWC_CONSTANTS.format(queue_name=QUEUE_NAME))):
+        os.makedirs(os.path.join(pwc_dir, package))
+        open(os.path.join(pwc_dir, package, '__init__.py'), 'w').close()
+        with open(os.path.join(pwc_dir, package, name), 'w') as file:
+            file.write(source)
+
+    for name in PUBLISHER_FILES:
+        shutil.copy(os.path.join(BASE_DIR, name), pwc_dir)
+
+    return pwc_dir
+
+
+def bench_publisher_script(scenario, batch_dir, paths, stand_ins):
+    pwc_dir = stand_ins.pwc_dir
+
+    # HOME keeps the script's upload cache out of the real one
+    env = dict(os.environ, HOME=os.path.dirname(pwc_dir))
+    command = [
+            sys.executable, 'publisher_script.py',
+            '-T', 'benchmark', '-F', 'benchmark', '--force-upload', '--silent', batch_dir
+        ]
+
+    latencies = []
+    for _ in range(scenario.runs):
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=pwc_dir, env=env, capture_output=True, text=True)
+        latencies.append(time.perf_counter() - started)
+
+        if result.returncode:
+            output = (result.stderr or result.stdout).strip().splitlines()
+            raise RuntimeError(output[-1] if output else f"exit status {result.returncode}")
+
+    files = len(paths) * scenario.runs
+    return metrics(latencies, sum(latencies), files, scenario.size, files)
+
+
+TARGETS = {
+        'upload': bench_upload,
+        'publish': bench_publish,
+        'pipeline': bench_pipeline,
+        'publisher_script': bench_publisher_script,
+    }
+
+
+class StandIns:
+    """ The fake servers every target runs against and the pwc checkout publisher_script.py runs from """
+
+    def __init__(self, s3, amqp, pwc_dir):
+        self.s3 = s3
+        self.amqp = amqp
+        self.pwc_dir = pwc_dir
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True
+            ).stdout.strip()
+        dirty = bool(subprocess.run(
+                ['git', 'status', '--porcelain', '--untracked-files=no'],
+                cwd=BASE_DIR, capture_output=True, text=True
+            ).stdout.strip())
+    except OSError:
+        return None, None
+    return commit or None, dirty
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as file:
+        baseline = json.load(file)
+
+    print(f"\ncompared with {baseline.get('commit') or baseline_file}")
+    print(f"{'scenario':<10}{'target':<18}{'metric':<15}{'before':>12}{'after':>12}{'change':>9}")
+
+    for scenario, targets in results['results'].items():
+        for target, record in targets.items():
+            before = baseline.get('results', {}).get(scenario, {}).get(target)
+            if not before or 'error' in record or 'error' in before:
+                continue
+
+            for metric in ('files_per_sec', 'mb_per_sec', 'msgs_per_sec', 'p95_ms'):
+                old, new = before.get(metric), record.get(metric)
+                if not old or not new:
+                    continue
+                print(f"{scenario:<10}{target:<18}{metric:<15}{old:>12.2f}{new:>12.2f}"
+                      f"{(new - old) * 100 / old:>+8.1f}%")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', default=[], help="single, small or huge, repeatable")
+    parser.add_argument('--target', action='append', default=[], help=f"One of {', '.join(TARGETS)}, repeatable")
+    parser.add_argument('--single-mb', type=int, default=1, help="Size of the file of the single file scenario")
+    parser.add_argument('--single-runs', type=int, default=20, help="Times the single file is sent")
+    parser.add_argument('--small-files', type=int, default=500, help="Number of files of the many small files scenario")
+    parser.add_argument('--small-kb', type=int, default=4, help="Size of every small file")
+    parser.add_argument('--huge-mb', type=int, default=256, help="Size of the file of the huge file scenario")
+    parser.add_argument('--output', help="Results file, benchmarks/results/<commit>.json by default")
+    parser.add_argument('--compare', help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    scenarios = [
+            Scenario('single', 1, args.single_mb * MB, args.single_runs),
+            Scenario('small', args.small_files, args.small_kb * KB, 1),
+            Scenario('huge', 1, args.huge_mb * MB, 1),
+        ]
+    scenarios = [scenario for scenario in scenarios if scenario.name in (args.scenario or [s.name for s in scenarios])]
+    targets = [target for target in TARGETS if target in (args.target or TARGETS)]
+
+    commit, dirty = git_commit()
+    results = dict(
+            commit = commit,
+            dirty = dirty,
+            created = datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            python = platform.python_version(),
+            platform = platform.platform(),
+            scenarios = {scenario.name: vars(scenario) for scenario in scenarios},
+            results = {},
+        )
+
+    print(f"{'scenario':<10}{'target':<18}{'files/s':>10}{'MB/s':>10}{'msgs/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeS3(store=False) as s3, FakeAMQP(store=False) as amqp:
+
+        # forced uploads still record their hashes and checkpoint their parts and
+        # every message goes through the outbox, keep them out of the real ones
+        utils._upload_cache = hashcache.UploadCache(os.path.join(directory, 'upload_cache.json'))
+        utils._outbox = outbox.Outbox(os.path.join(directory, 'outbox.sqlite3'))
+        utils._multipart_checkpoints = multipart.CheckpointStore(os.path.join(directory, 'multipart'))
+        stand_ins = StandIns(s3, amqp, pwc_checkout(directory, s3, amqp))
+
+        for scenario in scenarios:
+            batch_dir, paths = scenario.create(directory)
+            results['results'][scenario.name] = {}
+
+            for target in targets:
+                try:
+                    record = TARGETS[target](scenario, batch_dir, paths, stand_ins)
+                except Exception as e:
+                    record = dict(error=f'{type(e).__name__}: {e}')
+                    print(f"{scenario.name:<10}{target:<18}failed, {record['error']}")
+                else:
+                    print(f"{scenario.name:<10}{target:<18}{record['files_per_sec']:>10.2f}"
+                          f"{record['mb_per_sec']:>10.2f}{record['msgs_per_sec']:>10.2f}"
+                          f"{record['p50_ms']:>10.2f}{record['p95_ms']:>10.2f}{record['p99_ms']:>10.2f}")
+
+                results['results'][scenario.name][target] = record
+
+            shutil.rmtree(batch_dir)
+
+        utils.close_rabbit_connections()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'local')[:7]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Upload throughput of `utils.AWS.upload` for different `upload` settings,
+against the in-process S3 stand-in.
+
+    python -m benchmarks.bench_transfer --size 512 \
+        --setting 8:8:10:threads --setting 64:64:16:threads --setting 8:8:1:serial
+
+Every setting is `threshold_mb:chunksize_mb:max_concurrency:threads|serial`.
+"""
+
+import os
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import utils
+from benchmarks.fake_s3 import FakeS3
+
+DEFAULT_SETTINGS = ['8:8:10:threads', '16:16:10:threads', '64:64:16:threads', '8:8:1:serial']
+
+
+def parse_setting(setting):
+    threshold, chunksize, concurrency, threads = setting.split(':')
+    return dict(
+            multipart_threshold = int(threshold),
+            multipart_chunksize = int(chunksize),
+            max_concurrency = int(concurrency),
+            use_threads = threads != 'serial'
+        )
+
+
+def make_file(directory, size_mb):
+    path = os.path.join(directory, f'benchmark_{size_mb}mb.bin')
+    block = os.urandom(utils.MB)
+    with open(path, 'wb') as file:
+        for _ in range(size_mb):
+            file.write(block)
+    return path
+
+
+def bench(s3, path, upload_config, repeat):
+    aws = utils.AWS(s3.aws_config(), 'benchmark', upload_config)
+    aws.upload(path, force=True)  # warm up the client and the connection pool
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        aws.upload(path, force=True)
+        timings.append(time.perf_counter() - started)
+
+    return min(timings)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help="File size in MB")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per setting, the best one is reported")
+    parser.add_argument('--setting', action='append', default=[], help="threshold:chunksize:concurrency:threads|serial")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, FakeS3(store=False) as s3:
+        path = make_file(directory, args.size)
+
+        print(f"{'setting':<24}{'seconds':>10}{'MB/s':>10}")
+        for setting in args.setting or DEFAULT_SETTINGS:
+            seconds = bench(s3, path, parse_setting(setting), args.repeat)
+            print(f"{setting:<24}{seconds:>10.3f}{args.size / seconds:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+In-process stand-in for the part of AMQP 0-9-1 the kit speaks: connection
+and channel handshakes, queue declares, publisher confirms, basic.publish
+and basic.consume. Frames are encoded and decoded with pika's own codecs,
+so pika clients talk to it exactly like they would to RabbitMQ.
+
+    with FakeAMQP() as amqp:
+        rmq = utils.RabbitMQ(amqp.rabbit_config(), 'db', 'queue')
+
+Confirms are sent once per read from the socket, acking everything received
+so far with `multiple`, the way RabbitMQ batches them under load. They are
+sent `confirm_delay` seconds late, like a broker writing to disk, and the
+messages `nack` returns True for are nacked. With `store=False` only the
+message counts are kept. Messages for a queue with
+consumers go to them in turn instead of being kept, acks are not awaited.
+"""
+
+import struct
+import itertools
+import threading
+import socketserver
+
+from pika import frame, spec
+
+READ_SIZE = 64 * 1024
+
+# type, channel and size of every frame, followed by the payload and a frame end octet
+FRAME_HEADER = struct.Struct('>BHL')
+FRAME_MAX = 128 * 1024
+
+# pika only puts a channel in confirm mode when the server announces both
+CAPABILITIES = {'publisher_confirms': True, 'basic.nack': True}
+
+
+class Message:
+    __slots__ = ('exchange', 'routing_key', 'properties', 'body', 'size')
+
+    def __init__(self, exchange, routing_key):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = None
+        self.body = []
+        self.size = 0
+
+
+class FakeAMQPHandler(socketserver.BaseRequestHandler):
+
+    @property
+    def amqp(self):
+        return self.server.fake_amqp
+
+    def setup(self):
+        self.closed = False
+        self.confirming = set()
+        self.delivery_tags = {}
+        self.unacked = {}
+        self.incoming = {}
+
+        # deliveries to the consumers of this connection come from the threads of the publishers
+        self.send_lock = threading.Lock()
+        self.consumed_tags = {}
+
+    def finish(self):
+        self.amqp.cancel(self)
+
+    def send(self, *frames):
+        with self.send_lock:
+            self.request.sendall(b''.join(item.marshal() for item in frames))
+
+    def send_delivery(self, channel, consumer_tag, message):
+        body = message.body if isinstance(message.body, bytes) else b''.join(message.body)
+        size = FRAME_MAX - FRAME_HEADER.size - 1
+
+        with self.send_lock:
+            self.consumed_tags[channel] = self.consumed_tags.get(channel, 0) + 1
+            frames = [
+                    frame.Method(channel, spec.Basic.Deliver(
+                        consumer_tag=consumer_tag, delivery_tag=self.consumed_tags[channel],
+                        redelivered=False, exchange=message.exchange, routing_key=message.routing_key
+                    )),
+                    frame.Header(channel, len(body), message.properties or spec.BasicProperties()),
+                    *(frame.Body(channel, body[offset:offset + size]) for offset in range(0, len(body), size))
+                ]
+            self.request.sendall(b''.join(item.marshal() for item in frames))
+
+    def frames(self, data):
+        """ Splits `data` into whole frames, returns them and the bytes left over """
+
+        frames, offset = [], 0
+        while True:
+            if data[offset:offset + 4] == b'AMQP':
+                consumed, decoded = frame.decode_frame(data[offset:offset + 8])
+            elif len(data) - offset >= FRAME_HEADER.size:
+                size = FRAME_HEADER.unpack_from(data, offset)[2]
+                end = offset + FRAME_HEADER.size + size + 1
+                consumed, decoded = frame.decode_frame(data[offset:end]) if end <= len(data) else (0, None)
+            else:
+                consumed, decoded = 0, None
+
+            if decoded is None:
+                return frames, data[offset:]
+            frames.append(decoded)
+            offset += consumed
+
+    def handle(self):
+        pending = b''
+        while not self.closed:
+            chunk = self.request.recv(READ_SIZE)
+            if not chunk:
+                return
+
+            frames, pending = self.frames(pending + chunk)
+            for item in frames:
+                self.dispatch(item)
+
+            confirms = self.confirms()
+            if confirms and self.amqp.confirm_delay:
+                timer = threading.Timer(self.amqp.confirm_delay, self.send_confirms, confirms)
+                timer.daemon = True
+                timer.start()
+            elif confirms:
+                self.send_confirms(*confirms)
+
+    def confirms(self):
+        """ One ack per channel for everything this read completed, the nacked messages between them """
+
+        confirms = []
+        for channel, tags in self.unacked.items():
+            acked = None
+            for tag, ok in tags:
+                if ok:
+                    acked = tag
+                    continue
+                if acked is not None:
+                    confirms.append(frame.Method(channel, spec.Basic.Ack(delivery_tag=acked, multiple=True)))
+                    acked = None
+                confirms.append(frame.Method(channel, spec.Basic.Nack(delivery_tag=tag, multiple=False)))
+            if acked is not None:
+                confirms.append(frame.Method(channel, spec.Basic.Ack(delivery_tag=acked, multiple=True)))
+        self.unacked.clear()
+        return confirms
+
+    def send_confirms(self, *confirms):
+        if not self.closed:
+            try:
+                self.send(*confirms)
+            except OSError:
+                pass
+
+    def dispatch(self, item):
+        if isinstance(item, frame.ProtocolHeader):
+            return self.send(frame.Method(0, spec.Connection.Start(
+                    server_properties={'product': 'FakeAMQP', 'capabilities': CAPABILITIES}
+                )))
+
+        if isinstance(item, frame.Heartbeat):
+            return
+
+        channel = item.channel_number
+
+        if isinstance(item, frame.Header):
+            message = self.incoming[channel]
+            message.properties = item.properties
+            message.size = item.body_size
+            if not item.body_size:
+                self.complete(channel)
+            return
+
+        if isinstance(item, frame.Body):
+            message = self.incoming[channel]
+            message.body.append(item.fragment)
+            message.size -= len(item.fragment)
+            if message.size <= 0:
+                self.complete(channel)
+            return
+
+        method = item.method
+        reply = None
+
+        if isinstance(method, spec.Basic.Publish):
+            self.incoming[channel] = Message(method.exchange, method.routing_key)
+        elif isinstance(method, spec.Connection.StartOk):
+            # heartbeat 0: the benchmarks are short and pika then never times us out
+            reply = spec.Connection.Tune(channel_max=2047, frame_max=FRAME_MAX, heartbeat=0)
+        elif isinstance(method, spec.Connection.TuneOk):
+            pass
+        elif isinstance(method, spec.Connection.Open):
+            reply = spec.Connection.OpenOk()
+        elif isinstance(method, spec.Connection.Close):
+            self.send(frame.Method(0, spec.Connection.CloseOk()))
+            self.closed = True
+        elif isinstance(method, spec.Channel.Open):
+            self.delivery_tags[channel] = 0
+            reply = spec.Channel.OpenOk()
+        elif isinstance(method, spec.Channel.Close):
+            self.confirming.discard(channel)
+            self.unacked.pop(channel, None)
+            self.amqp.cancel(self, channel)
+            reply = spec.Channel.CloseOk()
+        elif isinstance(method, spec.Confirm.Select):
+            self.confirming.add(channel)
+            reply = None if method.nowait else spec.Confirm.SelectOk()
+        elif isinstance(method, spec.Queue.Declare):
+            queue_name = method.queue or self.amqp.generated_name()
+            queue = self.amqp.declare(queue_name)
+            reply = None if method.nowait else spec.Queue.DeclareOk(
+                    queue=queue_name, message_count=len(queue), consumer_count=0
+                )
+        elif isinstance(method, spec.Basic.Qos):
+            reply = spec.Basic.QosOk()
+        elif isinstance(method, spec.Basic.Consume):
+            consumer_tag = method.consumer_tag or self.amqp.generated_name('ctag')
+            if not method.nowait:
+                self.send(frame.Method(channel, spec.Basic.ConsumeOk(consumer_tag=consumer_tag)))
+            self.amqp.consume(method.queue, self, channel, consumer_tag)
+        elif isinstance(method, spec.Basic.Cancel):
+            self.amqp.cancel(self, channel, method.consumer_tag)
+            reply = None if method.nowait else spec.Basic.CancelOk(consumer_tag=method.consumer_tag)
+        elif isinstance(method, (spec.Basic.Ack, spec.Basic.Nack, spec.Basic.Reject)):
+            pass
+        else:
+            reply = spec.Connection.Close(
+                    reply_code=540, reply_text=f'NOT_IMPLEMENTED - {method.NAME}',
+                    class_id=method.INDEX >> 16, method_id=method.INDEX & 0xFFFF
+                )
+
+        if reply is not None:
+            self.send(frame.Method(channel, reply))
+
+    def complete(self, channel):
+        message = self.incoming.pop(channel)
+        acked = not (self.amqp.nack and self.amqp.nack(b''.join(message.body)))
+        if acked:
+            self.amqp.deliver(message)
+
+        if channel in self.confirming:
+            self.delivery_tags[channel] += 1
+            self.unacked.setdefault(channel, []).append((self.delivery_tags[channel], acked))
+
+
+class FakeAMQP:
+
+    def __init__(self, store=True, host='127.0.0.1', port=0, confirm_delay=0, nack=None):
+        self.store = store
+        self.confirm_delay = confirm_delay
+        self.nack = nack
+        self.queues = {}
+        self.published = 0
+        self.published_bytes = 0
+        self.lock = threading.Lock()
+
+        self.server = socketserver.ThreadingTCPServer((host, port), FakeAMQPHandler)
+        self.server.daemon_threads = True
+        self.server.fake_amqp = self
+        self.host, self.port = self.server.server_address
+
+        # queue name: [(handler, channel, consumer tag)], served in turn
+        self.consumers = {}
+        self.names = itertools.count(1)
+
+    def generated_name(self, prefix='amq.gen'):
+        return f'{prefix}-{next(self.names)}'
+
+    def declare(self, queue_name):
+        with self.lock:
+            return self.queues.setdefault(queue_name, [])
+
+    def consume(self, queue_name, handler, channel, consumer_tag):
+        with self.lock:
+            self.consumers.setdefault(queue_name, []).append((handler, channel, consumer_tag))
+            # what was published before the consumer came goes to it first
+            backlog = self.queues.get(queue_name) or []
+            self.queues[queue_name] = []
+
+        for message in backlog:
+            handler.send_delivery(channel, consumer_tag, message)
+
+    def cancel(self, handler, channel=None, consumer_tag=None):
+        with self.lock:
+            for queue_name, consumers in self.consumers.items():
+                consumers[:] = [
+                        consumer for consumer in consumers
+                        if consumer[0] is not handler
+                        or (channel is not None and consumer[1] != channel)
+                        or (consumer_tag is not None and consumer[2] != consumer_tag)
+                    ]
+
+    def deliver(self, message):
+        body = b''.join(message.body)
+        with self.lock:
+            self.published += 1
+            self.published_bytes += len(body)
+
+            consumers = self.consumers.get(message.routing_key)
+            if consumers:
+                consumer = consumers.pop(0)
+                consumers.append(consumer)
+            elif self.store:
+                message.body = body
+                # the default exchange routes straight to the queue of the same name
+                self.queues.setdefault(message.routing_key, []).append(message)
+                return
+            else:
+                return
+
+        message.body = body
+        handler, channel, consumer_tag = consumer
+        try:
+            handler.send_delivery(channel, consumer_tag, message)
+        except OSError:
+            # the consumer went away in the meantime
+            self.cancel(handler)
+
+    def rabbit_config(self):
+        """ A `rabbit` config section, as read by `config.Conf`, pointing at this server """
+
+        return dict(
+                server = dict(host=self.host, port=self.port, virtual_host='/'),
+                credentials = dict(username='guest', password='guest')
+            )
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
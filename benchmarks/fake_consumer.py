@@ -0,0 +1,111 @@
+"""
+Stand-in for the ingestion consumer downstream of the kit: takes the
+messages off a queue and answers the ones carrying a correlation_id and a
+reply_to the way replies.py expects, 'consumed' when it picks one up and
+'completed' (or 'failed') once its pretend work is done.
+
+    with FakeAMQP() as amqp, FakeConsumer(amqp.rabbit_config(), 'queue', work=0.05):
+        ...
+
+or against a real broker, replying to whatever is published meanwhile:
+
+    python -m benchmarks.fake_consumer --host localhost --port 5672 --queue ingest --work 0.2
+"""
+
+import json
+import random
+import threading
+from time import sleep
+from argparse import ArgumentParser
+
+import pika
+
+
+class FakeConsumer:
+
+    def __init__(self, rabbit_config, queue_name, work=0.0, jitter=0.0, fail_every=0):
+        server, credentials = rabbit_config['server'], rabbit_config['credentials']
+        self.parameters = pika.ConnectionParameters(
+                host=server['host'], port=int(server['port']), virtual_host=server['virtual_host'],
+                credentials=pika.PlainCredentials(credentials['username'], credentials['password'])
+            )
+        self.queue_name = queue_name
+        self.work = work
+        self.jitter = jitter
+        self.fail_every = fail_every
+
+        self.consumed = 0
+        self.stopping = threading.Event()
+        self.ready = threading.Event()
+        self.thread = None
+
+    def run(self):
+        connection = pika.BlockingConnection(self.parameters)
+        channel = connection.channel()
+        channel.queue_declare(queue=self.queue_name, durable=True)
+        channel.basic_consume(queue=self.queue_name, on_message_callback=self.on_message)
+        self.ready.set()
+
+        try:
+            while not self.stopping.is_set():
+                connection.process_data_events(time_limit=0.1)
+        finally:
+            connection.close()
+
+    def reply(self, channel, properties, status, **fields):
+        channel.basic_publish(
+                exchange='', routing_key=properties.reply_to,
+                properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+                body=json.dumps(dict(status=status, **fields))
+            )
+
+    def on_message(self, channel, method, properties, body):
+        self.consumed += 1
+        replying = properties.reply_to and properties.correlation_id
+
+        if replying:
+            self.reply(channel, properties, 'consumed')
+
+        sleep(max(0.0, self.work + random.uniform(-self.jitter, self.jitter)))
+
+        if replying:
+            if self.fail_every and not self.consumed % self.fail_every:
+                self.reply(channel, properties, 'failed', error='stand-in failure')
+            else:
+                self.reply(channel, properties, 'completed')
+
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait(10)
+        return self
+
+    def __exit__(self, *_):
+        self.stopping.set()
+        self.thread.join(timeout=5)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Consume a queue and reply to the kit's tracked messages")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5672)
+    parser.add_argument('--virtual-host', default='/')
+    parser.add_argument('--username', default='guest')
+    parser.add_argument('--password', default='guest')
+    parser.add_argument('--queue', required=True)
+    parser.add_argument('--work', type=float, default=0.1, help="Seconds every message takes")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many seconds more or less")
+    parser.add_argument('--fail-every', type=int, default=0, help="Fail every Nth message")
+    args = parser.parse_args()
+
+    config = dict(
+            server=dict(host=args.host, port=args.port, virtual_host=args.virtual_host),
+            credentials=dict(username=args.username, password=args.password)
+        )
+    consumer = FakeConsumer(config, args.queue, args.work, args.jitter, args.fail_every)
+    try:
+        consumer.run()
+    except KeyboardInterrupt:
+        print(f"{consumer.consumed} message(s) consumed")
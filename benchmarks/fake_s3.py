@@ -0,0 +1,278 @@
+"""
+In-process stand-in for the few S3 calls the kit makes (put object,
+multipart uploads and their listing, head/get object, head bucket, list
+objects and list buckets), good
+enough to point boto3 at through `endpoint_url` when there is no MinIO around.
+
+    with FakeS3() as s3:
+        aws = utils.AWS(dict(endpoint_url=s3.endpoint_url, ...), 'folder')
+
+Buckets are created on first write. With `store=False` the object bodies
+are read and thrown away so that huge uploads do not fill the memory.
+"""
+
+import uuid
+import hashlib
+import threading
+from time import time, gmtime, strftime
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_SIZE = 1024 * 1024
+
+
+class S3Object:
+    __slots__ = ('body', 'size', 'etag', 'metadata', 'headers', 'modified')
+
+    def __init__(self, body, size, etag, metadata, headers):
+        self.body = body
+        self.size = size
+        self.etag = etag
+        self.metadata = metadata
+        self.headers = headers
+        self.modified = formatdate(usegmt=True)
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        ...
+
+    @property
+    def s3(self):
+        return self.server.fake_s3
+
+    def parse_target(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        return bucket, key, parse_qs(parts.query, keep_blank_values=True)
+
+    def read_body(self):
+        remaining = int(self.headers.get('Content-Length') or 0)
+        digest, chunks, size = hashlib.md5(), [], 0
+
+        while remaining:
+            chunk = self.rfile.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            size += len(chunk)
+            digest.update(chunk)
+            if self.s3.store:
+                chunks.append(chunk)
+
+        return b''.join(chunks), size, digest.hexdigest()
+
+    def reply(self, status=200, body=b'', headers=None):
+        if isinstance(body, str):
+            body = ('<?xml version="1.0" encoding="UTF-8"?>\n' + body).encode()
+
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def not_found(self, code='NoSuchKey'):
+        self.reply(404, f'<Error><Code>{code}</Code><Message>{self.path}</Message></Error>')
+
+    def object_headers(self, obj):
+        headers = {'ETag': f'"{obj.etag}"', 'Last-Modified': obj.modified}
+        headers.update(obj.headers)
+        headers.update({f'x-amz-meta-{name}': value for name, value in obj.metadata.items()})
+        return headers
+
+    def do_GET(self):
+        bucket, key, query = self.parse_target()
+
+        if not bucket:
+            buckets = ''.join(
+                    f'<Bucket><Name>{name}</Name><CreationDate>2023-01-01T00:00:00.000Z</CreationDate></Bucket>'
+                    for name in sorted(self.s3.buckets)
+                )
+            return self.reply(body=(
+                    '<ListAllMyBucketsResult><Owner><ID>fake</ID><DisplayName>fake</DisplayName></Owner>'
+                    f'<Buckets>{buckets}</Buckets></ListAllMyBucketsResult>'
+                ))
+
+        if 'uploads' in query:
+            return self.list_uploads(bucket, query.get('prefix', [''])[0])
+
+        if 'uploadId' in query:
+            return self.list_parts(bucket, key, query['uploadId'][0])
+
+        if not key:
+            return self.list_objects(bucket, query)
+
+        obj = self.s3.buckets.get(bucket, {}).get(key)
+        if obj is None:
+            return self.not_found()
+
+        headers = self.object_headers(obj)
+        headers['Content-Type'] = 'binary/octet-stream'
+        self.reply(body=obj.body, headers=headers)
+
+    def list_uploads(self, bucket, prefix):
+        uploads = ''.join(
+                f'<Upload><Key>{escape(upload["key"])}</Key><UploadId>{upload_id}</UploadId>'
+                f'<Initiated>{strftime("%Y-%m-%dT%H:%M:%S.000Z", gmtime(upload["initiated"]))}</Initiated></Upload>'
+                for upload_id, upload in list(self.s3.uploads.items())
+                if upload['bucket'] == bucket and upload['key'].startswith(prefix)
+            )
+        self.reply(body=(
+                f'<ListMultipartUploadsResult><Bucket>{bucket}</Bucket><Prefix>{escape(prefix)}</Prefix>'
+                f'<IsTruncated>false</IsTruncated>{uploads}</ListMultipartUploadsResult>'
+            ))
+
+    def list_objects(self, bucket, query):
+        if bucket not in self.s3.buckets:
+            return self.not_found('NoSuchBucket')
+
+        prefix = query.get('prefix', [''])[0]
+        max_keys = int(query.get('max-keys', ['1000'])[0])
+        keys = sorted(key for key in list(self.s3.buckets[bucket]) if key.startswith(prefix))
+
+        contents = ''.join(
+                f'<Contents><Key>{escape(key)}</Key><ETag>"{self.s3.buckets[bucket][key].etag}"</ETag>'
+                f'<Size>{self.s3.buckets[bucket][key].size}</Size></Contents>'
+                for key in keys[:max_keys]
+            )
+        self.reply(body=(
+                f'<ListBucketResult><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>'
+                f'<KeyCount>{min(len(keys), max_keys)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+                f'<IsTruncated>{"true" if len(keys) > max_keys else "false"}</IsTruncated>{contents}</ListBucketResult>'
+            ))
+
+    def list_parts(self, bucket, key, upload_id):
+        upload = self.s3.uploads.get(upload_id)
+        if upload is None:
+            return self.not_found('NoSuchUpload')
+
+        parts = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>"{etag}"</ETag><Size>{size}</Size></Part>'
+                for number, (_, size, etag) in sorted(upload['parts'].items())
+            )
+        self.reply(body=(
+                f'<ListPartsResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>'
+                f'<IsTruncated>false</IsTruncated>{parts}</ListPartsResult>'
+            ))
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse_target()
+
+        if not key:
+            return self.reply(200 if bucket in self.s3.buckets else 404)
+
+        obj = self.s3.buckets.get(bucket, {}).get(key)
+        if obj is None:
+            return self.reply(404)
+
+        self.send_response(200)
+        for name, value in self.object_headers(obj).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(obj.size))
+        self.end_headers()
+
+    def do_PUT(self):
+        bucket, key, query = self.parse_target()
+        body, size, etag = self.read_body()
+
+        if not key:
+            self.s3.buckets.setdefault(bucket, {})
+            return self.reply()
+
+        if 'uploadId' in query:
+            upload = self.s3.uploads.get(query['uploadId'][0])
+            if upload is None:
+                return self.not_found('NoSuchUpload')
+            upload['parts'][int(query['partNumber'][0])] = (body, size, etag)
+            return self.reply(headers={'ETag': f'"{etag}"'})
+
+        self.s3.put(bucket, key, body, size, etag, self.headers)
+        self.reply(headers={'ETag': f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self.parse_target()
+        self.read_body()
+
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.s3.uploads[upload_id] = dict(bucket=bucket, key=key, headers=self.headers, parts={}, initiated=time())
+            return self.reply(body=(
+                    f'<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>'
+                    f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+                ))
+
+        if 'uploadId' in query:
+            upload = self.s3.uploads.pop(query['uploadId'][0], None)
+            if upload is None:
+                return self.not_found('NoSuchUpload')
+
+            parts = [upload['parts'][number] for number in sorted(upload['parts'])]
+            digest = hashlib.md5(b''.join(bytes.fromhex(part[2]) for part in parts))
+            etag = f'{digest.hexdigest()}-{len(parts)}'
+            self.s3.put(
+                    bucket, key, b''.join(part[0] for part in parts),
+                    sum(part[1] for part in parts), etag, upload['headers']
+                )
+            return self.reply(body=(
+                    f'<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>'
+                    f'<ETag>"{etag}"</ETag></CompleteMultipartUploadResult>'
+                ))
+
+        self.reply(400, '<Error><Code>InvalidRequest</Code></Error>')
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse_target()
+
+        if 'uploadId' in query:
+            self.s3.uploads.pop(query['uploadId'][0], None)
+        else:
+            self.s3.buckets.get(bucket, {}).pop(key, None)
+        self.reply(204)
+
+
+class FakeS3:
+
+    def __init__(self, store=True, host='127.0.0.1', port=0):
+        self.store = store
+        self.buckets = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), FakeS3Handler)
+        self.server.daemon_threads = True
+        self.server.fake_s3 = self
+        self.endpoint_url = 'http://%s:%d' % self.server.server_address
+
+    def put(self, bucket, key, body, size, etag, headers):
+        metadata = {
+                name[len('x-amz-meta-'):].lower(): value for name, value in headers.items()
+                if name.lower().startswith('x-amz-meta-')
+            }
+        extra = {name: headers[name] for name in ('Content-Encoding',) if headers.get(name)}
+
+        with self.lock:
+            self.buckets.setdefault(bucket, {})[key] = S3Object(body, size, etag, metadata, extra)
+
+    def aws_config(self, bucket_name='benchmark'):
+        """ An `aws` config section, as read by `config.Conf`, pointing at this server """
+
+        return dict(
+                bucket_name = bucket_name,
+                endpoint_url = self.endpoint_url,
+                credentials = dict(aws_access_key_id='fake', aws_secret_access_key='fake')
+            )
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,303 @@
+"""
+Headless mode of the kit, `python main.py --cli ...`.
+
+Uploads and publishes with the presets of ~/.config/ctadel/config.yaml, the
+ones the GUI edits, picked by their display name, through the same
+utils.AWS / utils.RabbitMQ code the GUI uses. main.py hands over to this
+module before it imports PyQt5, nothing here loads Qt.
+
+    python main.py --cli run report.csv -C "Reload" -T "Daily sales" -Q "Staging"
+    python main.py --cli run report.csv -Q "Staging" -Q "Audit"
+    python main.py --cli run report.csv --track-replies --reply-timeout 30
+    python main.py --cli presets
+    python main.py --cli flush-outbox
+"""
+
+import os
+import sys
+import json
+import itertools
+from argparse import ArgumentParser
+
+import utils
+import tracing
+import pipeline
+import replies
+import compression
+from config import C
+
+
+def setup_parser(parser:ArgumentParser):
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Upload the files and publish their messages")
+    run.add_argument('files', nargs='+', help="Files to upload and publish")
+
+    run.add_argument(
+            '-C', '--company', default=None,
+            help="Display name of the company preset, the first one by default"
+        )
+    run.add_argument(
+            '-T', '--file-type', default=None,
+            help="Display name of the file type preset, the first one by default"
+        )
+    run.add_argument(
+            '-D', '--data-type', default=None,
+            help="Display name of the data type preset, the first one by default"
+        )
+    run.add_argument(
+            '-SF', '--file-sub-type', default=None,
+            help="Display name of the file sub type preset, the first one by default"
+        )
+    run.add_argument(
+            '-Q', '--queue', action='append', default=None,
+            help="Display name of a rabbit queue preset to publish to, repeat it to publish "
+                 "to several queues at once. The first preset by default"
+        )
+    run.add_argument(
+            '-L', '--load-id', type=int, default=1,
+            help="The load_id value for the message"
+        )
+    run.add_argument(
+            '-B', '--bucket-name', default=None,
+            help="Bucket to upload to, the configured one by default"
+        )
+    run.add_argument(
+            '-F', '--folder-name', default=None,
+            help="Folder of the bucket to upload to, the configured one by default"
+        )
+    run.add_argument(
+            '-OF', '--original-file-name', default='',
+            help="The original_file_name value for the message"
+        )
+    run.add_argument(
+            '--force-upload', action='store_true', default=False,
+            help="Upload the files even if the bucket already holds the same content"
+        )
+    run.add_argument(
+            '--track-replies', action='store_true', default=False,
+            help="Ask the consumer to reply and report the round trip latency of every "
+                 "message, on by default with track_replies in the rabbit config"
+        )
+    run.add_argument(
+            '--reply-timeout', type=float, default=None,
+            help="Seconds to wait for the replies after publishing, reply_timeout "
+                 "of the rabbit config by default"
+        )
+    run.add_argument(
+            '--json', action='store_true', default=False,
+            help="Print one JSON line per file instead of the readable report"
+        )
+
+    commands.add_parser('presets', help="List the presets of the config file")
+    commands.add_parser('flush-outbox', help="Publish the messages the broker did not confirm yet")
+
+    return parser
+
+
+def select(presets, display_name, what):
+    """ Value of the preset named `display_name`, of the first preset when it is None """
+
+    if display_name is None:
+        return presets[0][1] if presets else ''
+
+    for name, value in presets:
+        if name == display_name:
+            return value
+    for name, value in presets:
+        if name.casefold() == display_name.casefold():
+            return value
+
+    names = ', '.join(repr(name) for name, _ in presets) or 'none configured'
+    raise ValueError(f"No {what} preset named {display_name!r} ({names})")
+
+
+def list_presets():
+    for title, presets in (('Companies', C.get_company_names()), ('File types', C.get_file_types()),
+            ('Data types', C.get_datatypes()), ('File sub types', C.get_filesubtypes()),
+            ('Rabbit queues', C.get_rabbit_queues())):
+        print(f"{title}:")
+        for name, value in presets:
+            print(f"    {name:<30} {value}")
+    return 0
+
+
+def flush_outbox():
+    rmq = utils.RabbitMQ(C.get_rabbit_information(), C.get_db_name(), None)
+    published, pending = rmq.flush_outbox()
+    print(f"📤 {published} message(s) published from the outbox, {pending} still pending")
+    return 0 if not pending else 2
+
+
+def run(args):
+    invalid = [path for path in args.files if not os.path.isfile(path)]
+    for path in invalid:
+        print(f"❌ INVALID FILE PATH: {path}", file=sys.stderr)
+    if invalid:
+        return 1
+
+    run_id = tracing.new_run_id()
+    setup = tracing.Trace('setup')
+
+    with setup.span('config'):
+        aws_config = dict(C.get_aws_information())
+        if args.bucket_name is not None:
+            aws_config['bucket_name'] = args.bucket_name
+        folder_name = C.get_folder_name() if args.folder_name is None else args.folder_name
+
+        fields = dict(
+                company_name = select(C.get_company_names(), args.company, 'company'),
+                file_type = select(C.get_file_types(), args.file_type, 'file type'),
+                data_type = select(C.get_datatypes(), args.data_type, 'data type'),
+                load_id = args.load_id,
+                file_sub_type = select(C.get_filesubtypes(), args.file_sub_type, 'file sub type'),
+                bucket_name = aws_config['bucket_name'],
+                folder_name = folder_name,
+                original_file_name = args.original_file_name,
+            )
+        rabbit_config, profiles = C.get_rabbit_information(), C.get_rabbit_profiles()
+        targets = []
+        for display_name in args.queue or [None]:
+            value = select(C.get_rabbit_queues(), display_name, 'rabbit queue')
+            targets.append((display_name or value, *utils.rabbit_target(rabbit_config, profiles, value)))
+
+        track_replies = args.track_replies or rabbit_config['track_replies']
+        reply_timeout = float(rabbit_config['reply_timeout'] if args.reply_timeout is None else args.reply_timeout)
+
+    jobs = [
+            pipeline.PipelineJob(path, dict(file_name=os.path.basename(path), **fields))
+            for path in args.files
+        ]
+    if track_replies:
+        for job in jobs:
+            job.message.update(replies.new_reply_fields(utils.reply_queue()))
+
+    with tracing.activate(setup):
+        aws = utils.AWS(aws_config, folder_name, C.get_upload_config())
+        aws.get_connection()
+        rmq = utils.FanOut(targets, C.get_db_name())
+
+        if track_replies:
+            with tracing.span('replies'):
+                for _, config, _ in targets:
+                    utils.listen_for_replies(config)
+
+        try:
+            aws.abort_abandoned_uploads()
+        except Exception:
+            pass
+
+        if rmq.pending():
+            with tracing.span('outbox_flush'):
+                published, pending = rmq.flush_outbox()
+            if not args.json:
+                print(f"📤 {published} message(s) published from the outbox, {pending} still pending")
+
+    def upload(job):
+        encoding = aws.encoding_for(job.message, job.local_file_path)
+        uploaded = aws.upload(job.local_file_path, force=args.force_upload, encoding=encoding)
+        compression.mark_message(job.message, encoding)
+        return uploaded
+
+    def publish(job):
+        correlation_id = job.message.get('correlation_id')
+        if correlation_id:
+            utils.reply_tracker().published(correlation_id, job.local_file_path)
+        rmq.publish(job.message)
+
+    done = itertools.count(1)
+
+    def report(job):
+        utils.run_log().write(job.trace.as_record(
+                run=run_id, source='cli', ok=job.ok, uploaded=job.uploaded,
+                stage=job.stage, error=str(job.error) if job.error else None
+            ))
+        replicas_failed = utils.replica_failures(job.trace)
+
+        if args.json:
+            print(json.dumps(dict(
+                    file=job.local_file_path, ok=job.ok, uploaded=job.uploaded, stage=job.stage,
+                    error=str(job.error) if job.error else None, message=job.message,
+                    replicas_failed=replicas_failed,
+                    confirm_ms={
+                        name: round(latency * 1000, 3)
+                        for name, latency in job.trace.durations('confirm:').items()
+                    }
+                )), flush=True)
+            return
+
+        prefix = f"[{next(done)}/{len(jobs)}] {job.local_file_path}"
+        if job.stage == 'upload':
+            print(f"❌ {prefix} Error in Upload: {job.error}")
+        elif job.stage == 'publish':
+            print(f"❌ {prefix} uploaded to {aws.bucket_name}, error in rabbitmq: {job.error} "
+                  f"(kept in the outbox, published on the next run)")
+        else:
+            action = 'uploaded to' if job.uploaded else 'unchanged in'
+            # every queue with the time its broker took to confirm
+            queues = ', '.join(
+                    f"{name} ({tracing.format_duration(latency)})"
+                    for name, latency in job.trace.durations('confirm:').items()
+                )
+            print(f"✅ {prefix} {action} {aws.bucket_name} and published to {queues}")
+
+        for name, error in replicas_failed.items():
+            print(f"⚠ {prefix} not copied to the replica {name}: {error}")
+
+    try:
+        stats = pipeline.Pipeline(upload, publish, on_result=report).run(jobs)
+    finally:
+        rmq.close()
+    utils.run_log().write(setup.as_record(
+            run=run_id, source='cli', ok=not stats.failures, files=len(jobs),
+            failures=stats.failures, wall_ms=round(stats.wall_time * 1000, 3)
+        ))
+
+    if not args.json:
+        print(f"{len(jobs) - stats.failures}/{len(jobs)} files published, {stats.failures} failed "
+              f"({stats.summary()})")
+
+    correlation_ids = [job.message['correlation_id'] for job in jobs if job.ok and track_replies]
+    if correlation_ids:
+        report_replies(correlation_ids, reply_timeout, args.json)
+
+    return 2 if stats.failures else 0
+
+
+def report_replies(correlation_ids, timeout, as_json):
+    tracker = utils.reply_tracker()
+    if not as_json:
+        print(f"📨 Waiting up to {tracing.format_duration(timeout)} for the consumer's replies")
+    tracker.wait(correlation_ids, timeout)
+    results = tracker.collect(correlation_ids)
+
+    if not as_json:
+        print('\n'.join(replies.report(results)))
+        return
+
+    for correlation_id, result in zip(correlation_ids, results):
+        print(json.dumps(dict(
+                file=result.name, correlation_id=correlation_id, status=result.status, error=result.error,
+                consume_ms=None if result.consume_latency is None else round(result.consume_latency * 1000, 3),
+                completion_ms=None if result.completion_latency is None else round(result.completion_latency * 1000, 3)
+            )), flush=True)
+
+
+def main(argv=None):
+    parser = setup_parser(ArgumentParser(
+            prog="main.py --cli",
+            description="Upload and publish with the presets of the PWC Message Kit, without the GUI"
+        ))
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'presets':
+            return list_presets()
+        if args.command == 'flush-outbox':
+            return flush_outbox()
+        return run(args)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    finally:
+        utils.close_rabbit_connections()
@@ -0,0 +1,150 @@
+"""
+Compression of the uploaded files on the fly, chosen per file type.
+
+The rules of the 'compression' setting of the upload section are tried in
+order, the first one matching the file's file_type and/or name pattern
+gives its codec:
+
+    compression:
+      - file_type: daily_sales
+        codec: zstd
+      - pattern: '*.csv'
+        codec: gzip
+
+The file is compressed while it is read for the upload, part by part, and
+never written compressed to disk. The object is stored under the file name
+plus the codec's suffix with the matching Content-Encoding, and the message
+published for it names that object and carries the codec as 'compression'.
+
+    codec = codec_for(rules, message['file_type'], path)
+    for part, raw_bytes in chunks(path, codec, part_size):
+        ...
+    mark_message(message, codec)
+
+gzip comes with the standard library, zstd needs the zstandard package and
+falls back to gzip without it. Both are deterministic, compressing the same
+file again gives the same bytes, so that an interrupted multipart upload
+resumes.
+"""
+
+import io
+import zlib
+import fnmatch
+
+CODECS = ('gzip', 'zstd')
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# raw bytes compressed at a time
+READ_SIZE = 1024 * 1024
+
+
+def zstd_available():
+    try:
+        import zstandard
+    except ImportError:
+        return False
+    return True
+
+
+def resolve(codec):
+    """ The codec files are compressed with for a configured one, None for no compression """
+
+    if not codec or codec == 'none':
+        return None
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec {codec!r}, one of none, {', '.join(CODECS)}")
+    if codec == 'zstd' and not zstd_available():
+        return 'gzip'
+    return codec
+
+
+def codec_for(rules, file_type, file_name):
+    """ Codec of the first rule matching the file type and name, None when none does """
+
+    name = file_name.rsplit('/', 1)[-1]
+    for rule in rules or ():
+        if 'file_type' in rule and rule['file_type'] != file_type:
+            continue
+        if 'pattern' in rule and not fnmatch.fnmatch(name, rule['pattern']):
+            continue
+        return resolve(rule.get('codec'))
+    return None
+
+
+def object_name(file_name, codec):
+    return f"{file_name}{SUFFIXES[codec]}" if codec else file_name
+
+
+def mark_message(message, codec):
+    """ Points the message at the compressed object and names its codec """
+
+    if codec:
+        message['file_name'] = object_name(message['file_name'], codec)
+        message['compression'] = codec
+    return message
+
+
+def compressor(codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # a gzip stream without a name or time in its header, the same for the same content
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def chunks(local_file_path, codec, chunk_size):
+    """ Yields the compressed file in chunks of `chunk_size` bytes, the last one shorter,
+        with the number of raw bytes each of them accounts for """
+
+    stream = compressor(codec)
+    buffer = bytearray()
+    raw = 0
+
+    with open(local_file_path, 'rb') as file:
+        while True:
+            data = file.read(READ_SIZE)
+            raw += len(data)
+            buffer += stream.compress(data) if data else stream.flush()
+
+            while len(buffer) >= chunk_size:
+                chunk = bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+                yield chunk, raw
+                raw = 0
+
+            if not data:
+                break
+
+    if buffer or raw:
+        yield bytes(buffer), raw
+
+
+class CompressedReader(io.RawIOBase):
+    """ The file compressed as it is read, for the ones small enough to be uploaded at once.
+        It is not seekable, its compressed size is only known once it was read to the end """
+
+    def __init__(self, local_file_path, codec):
+        self.parts = chunks(local_file_path, codec, READ_SIZE)
+        self.buffer = bytearray()
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target):
+            chunk = next(self.parts, None)
+            if chunk is None:
+                break
+            self.buffer += chunk[0]
+
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        del self.buffer[:size]
+        return size
+
+    def close(self):
+        self.parts.close()
+        super().close()
@@ -1,10 +1,89 @@
 import os
+import threading
+from time import monotonic
+from types import MappingProxyType
+
 import yaml
 
 BASE_DIR = os.path.dirname(__file__)
 CONFIG_DIR = os.path.expanduser('~/.config/ctadel')
 CONFIG_FILE = os.path.join(CONFIG_DIR, 'config.yaml')
 
+# how often, at most, the config file is checked for changes
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class ConfigLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """ Safe (C accelerated when libyaml is there) loader which still reads
+        the python tuples older versions of the kit dumped for list items """
+
+ConfigLoader.add_constructor(
+        'tag:yaml.org,2002:python/tuple',
+        lambda loader, node: loader.construct_sequence(node)
+    )
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+class Snapshot:
+    """ Immutable view of one version of the configuration. Every section is
+        merged over its defaults once, getters only read attributes """
+
+    __slots__ = (
+            'config', 'mtime', 'general', 'db', 'rabbit', 'aws', 'upload',
+            'companies', 'file_types', 'data_types', 'file_sub_types',
+            'rabbit_queues', 'rabbit_profiles', 'folder_name', 'db_name', 'console', 'theme'
+        )
+
+    def __init__(self, config, default_config, mtime=None):
+        set_ = lambda name, value: object.__setattr__(self, name, value)
+
+        set_('config', freeze(config))
+        set_('mtime', mtime)
+
+        for attribute, section in (('general', 'configurations'), ('db', 'db'),
+                ('rabbit', 'rabbit'), ('aws', 'aws'), ('upload', 'upload')):
+            merged = dict(default_config[section])
+            merged.update(config.get(section) or {})
+            set_(attribute, freeze(merged))
+
+        db = config.get('db') or {}
+        set_('companies', freeze(db.get('company') or []))
+        set_('file_types', freeze(db.get('file_type') or []))
+        set_('data_types', freeze(db.get('data_type') or []))
+        set_('file_sub_types', freeze(db.get('file_sub_type') or []))
+        set_('folder_name', db.get('folder_name') or '')
+        set_('db_name', db.get('db_name') or '')
+        set_('rabbit_queues', freeze((config.get('rabbit') or {}).get('rabbit_queue_name') or []))
+        # other brokers, by name, that a queue preset `queue@name` publishes to
+        set_('rabbit_profiles', freeze(config.get('rabbit_profiles') or {}))
+
+        general = config.get('configurations') or {}
+        set_('console', general.get('console', False))
+        theme = general.get('theme', 'auto')
+        if theme not in {'auto', 'light', 'dark'}:
+            print(f"Invalid theme type : {theme}")
+            theme = 'auto'
+        set_('theme', theme)
+
+    def __setattr__(self, *_):
+        raise AttributeError("Config snapshots are read only")
+
+
 class Conf:
 
     def __init__(self):
@@ -13,7 +92,9 @@ class Conf:
                         'console': False,
                         'rabbit_message_in_console': False,
                         'allow_open_input_file': False,
-                        'theme': 'auto'
+                        'theme': 'auto',
+                        'connect_timeout': 5,
+                        'read_timeout': 10
                     },
                 'db': {
                         'company': [],
@@ -25,6 +106,10 @@ class Conf:
                     },
                 'rabbit': {
                         'rabbit_queue_name': [],
+                        # correlation_id and reply_to on every message, and the latencies
+                        # of the consumer's replies reported for up to reply_timeout seconds
+                        'track_replies': False,
+                        'reply_timeout': 60,
                         'credentials': {
                                 'username': 'guest',
                                 'password': 'guest'
@@ -41,20 +126,60 @@ class Conf:
                         'credentials': {
                                 'aws_access_key_id':'',
                                 'aws_secret_access_key':''
-                            }
+                            },
+                        # other buckets or endpoints every upload is copied to, each a
+                        # partial aws section plus 'name' and 'required' (true by default)
+                        'replicas': []
+                    },
+                'upload': {
+                        'multipart_threshold': 8,
+                        'multipart_chunksize': 8,
+                        'max_concurrency': 10,
+                        'max_pool_connections': 10,
+                        'use_threads': True,
+                        'abandoned_upload_hours': 24,
+                        # also abort other clients' uploads that old in the folder, never bucket wide
+                        'sweep_abandoned_uploads': False,
+                        # files compressed on upload, rules of a file_type and/or name
+                        # pattern and the codec, gzip or zstd, see compression.py
+                        'compression': []
                     }
             }
 
-        self.config = self.read_config()
+        self.lock = threading.Lock()
+        self.checked_at = monotonic()
+        self.snapshot = Snapshot(self.read_config(), self.default_config, self.config_mtime())
+
+    @property
+    def config(self):
+        return self.current().config
+
+    def config_mtime(self):
+        try:
+            return os.stat(CONFIG_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+    def current(self):
+        """ The latest snapshot, re-read when the config file changed on disk """
+
+        if monotonic() - self.checked_at >= RELOAD_CHECK_INTERVAL:
+            with self.lock:
+                self.checked_at = monotonic()
+                mtime = self.config_mtime()
+                if mtime != self.snapshot.mtime:
+                    self.snapshot = Snapshot(self.read_config(), self.default_config, mtime)
+
+        return self.snapshot
 
     def read_config(self):
         try:
             with open(CONFIG_FILE, 'r') as file:
-                config = yaml.full_load(file)
+                config = yaml.load(file, Loader=ConfigLoader)
         except:
             print('Error while reading the config file, loading default')
             config = self.default_config
-        return config
+        return config or {}
 
 
     def write_config(self, config:dict, persistent=False):
@@ -62,96 +187,60 @@ class Conf:
         if not os.path.exists(CONFIG_DIR):
             os.mkdir(CONFIG_DIR)
 
+        config = thaw(config)
         if persistent:
             with open(CONFIG_FILE, 'w') as file:
-                yaml.dump(config, file)
+                yaml.safe_dump(config, file)
 
-        self.config = config
+        with self.lock:
+            self.checked_at = monotonic()
+            self.snapshot = Snapshot(config, self.default_config, self.config_mtime())
 
 
     def get_console(self):
-        try:
-            return self.config['configurations']['console']
-        except: return False
+        return self.current().console
 
     def get_theme(self):
-        try:
-            theme = self.config['configurations']['theme']
-            if theme not in {'auto', 'light', 'dark'}:
-                print(f"Invalid theme type : {theme}")
-                raise ValueError
-            return theme
-
-        except Exception as e:
-            return "auto"
+        return self.current().theme
 
     def get_file_types(self):
-        if self.config.get('db') and self.config['db'].get('file_type'):
-            return self.config['db']['file_type']
-        else: return []
+        return self.current().file_types
 
     def get_company_names(self):
-        if self.config.get('db') and self.config['db'].get('company'):
-            return self.config['db']['company']
-        else: return []
+        return self.current().companies
 
     def get_datatypes(self):
-        if self.config.get('db') and self.config['db'].get('data_type'):
-            return self.config['db']['data_type']
-        else: return []
+        return self.current().data_types
 
     def get_filesubtypes(self):
-        if self.config.get('db') and self.config['db'].get('file_sub_type'):
-            return self.config['db']['file_sub_type']
-        else: return []
+        return self.current().file_sub_types
 
     def get_rabbit_queues(self):
-        if self.config.get('rabbit') and self.config['rabbit'].get('rabbit_queue_name'):
-            return self.config['rabbit']['rabbit_queue_name']
-        else: return []
+        return self.current().rabbit_queues
+
+    def get_rabbit_profiles(self):
+        return self.current().rabbit_profiles
 
     def get_folder_name(self):
-        if self.config.get('db') and self.config['db'].get('folder_name'):
-            return self.config['db']['folder_name']
-        else: return ''
+        return self.current().folder_name
 
     def get_db_name(self):
-        if self.config.get('db') and self.config['db'].get('db_name'):
-            return self.config['db']['db_name']
-        else: return ''
+        return self.current().db_name
 
 
     def get_rabbit_information(self):
-        general_config = self.config.get('rabbit')
-
-        if not general_config:
-            return self.default_config['rabbit']
-        else:
-            self.default_config['rabbit'] \
-                .update(self.config.get('rabbit'))
-            return self.default_config['rabbit']
+        return self.current().rabbit
 
 
     def get_aws_information(self):
-        general_config = self.config.get('aws')
+        return self.current().aws
 
-        if not general_config:
-            return self.default_config['aws']
-        else:
-            self.default_config['aws'] \
-                .update(self.config.get('aws'))
-            return self.default_config['aws']
 
+    def get_upload_config(self):
+        return self.current().upload
 
-    def get_general_config(self):
-        general_config = self.config.get('configurations')
 
-        if not general_config:
-            return self.default_config['configurations']
-        else:
-            self.default_config['configurations'] \
-                .update(self.config.get('configurations'))
-            return self.default_config['configurations']
+    def get_general_config(self):
+        return self.current().general
 
 C = Conf()
-
@@ -0,0 +1,191 @@
+"""
+The console of the main window, kept fast through batch jobs of any size.
+
+Entries go into a ring buffer of CONSOLE_CAPACITY entries and reach the view
+in one edit every CONSOLE_FLUSH_MS, instead of one relayout per line. The
+oldest entries spill to a temporary file once the ring is full, so the view
+and the memory stay bounded while `export` still writes the whole history.
+Published messages show as a single line and are only pretty printed when
+that line is clicked.
+
+    console = Console(self.console_view)
+    console.append("Loaded configurations")
+    console.append_message(message)
+"""
+
+import json
+import tempfile
+import itertools
+from html import escape
+from collections import deque
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QTextCursor, QTextBlockFormat, QTextCharFormat
+
+CONSOLE_CAPACITY = 2000
+CONSOLE_FLUSH_MS = 100
+
+
+class ConsoleEntry:
+    __slots__ = ('id', 'text', 'message', 'expanded')
+
+    def __init__(self, id, text, message=None):
+        self.id = id
+        self.text = text
+        self.message = message
+        self.expanded = False
+
+    def html(self):
+        if self.message is None:
+            return escape(self.text).replace('\n', '<br>')
+
+        arrow = '▾' if self.expanded else '▸'
+        link = f'<a href="entry:{self.id}">{arrow} {escape(self.text)}</a>'
+        if not self.expanded:
+            return link
+        return f"{link}<br>{escape(json.dumps(self.message, indent=4)).replace(chr(10), '<br>').replace(' ', '&nbsp;')}"
+
+    def plain(self):
+        if self.message is None:
+            return self.text
+        return f"{self.text}\n{json.dumps(self.message, indent=4)}"
+
+
+class Console:
+    """ Bounded, batched log on a QTextBrowser. Every entry is one block of its
+        document, an expanded message included, so that the oldest entries are
+        dropped and an entry is redrawn by block number """
+
+    def __init__(self, view, capacity=CONSOLE_CAPACITY, flush_ms=CONSOLE_FLUSH_MS):
+        self.view = view
+        self.view.setOpenLinks(False)
+        self.view.anchorClicked.connect(self.toggle)
+
+        self.capacity = capacity
+        self.entries = deque()
+        self.pending = []
+        self.ids = itertools.count()
+
+        # entries pushed out of the ring, kept for `export`
+        self.history = None
+        self.spilled = 0
+
+        self.timer = QTimer(view)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(flush_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def append(self, text):
+        self.add(ConsoleEntry(next(self.ids), str(text)))
+
+    def append_message(self, message):
+        """ One clickable line, the message is pretty printed once it is expanded """
+
+        title = f"Message of {message.get('file_name', '')}".rstrip()
+        self.add(ConsoleEntry(next(self.ids), title, message))
+
+    def add(self, entry):
+        self.pending.append(entry)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        # of a burst larger than the ring, only its tail is ever shown
+        batch, self.pending = self.pending, []
+        self.spill(batch[:-self.capacity])
+        batch = batch[-self.capacity:]
+
+        self.entries.extend(batch)
+        dropped = []
+        while len(self.entries) > self.capacity:
+            dropped.append(self.entries.popleft())
+        self.spill(dropped)
+
+        document = self.view.document()
+        scrollbar = self.view.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+
+        if len(dropped) >= document.blockCount():
+            document.clear()
+        elif dropped:
+            cursor.movePosition(QTextCursor.Start)
+            cursor.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor, len(dropped))
+            cursor.removeSelectedText()
+
+        cursor.movePosition(QTextCursor.End)
+        shown = len(self.entries) - len(batch)
+        for index, entry in enumerate(batch):
+            if shown or index:
+                cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+            self.insert(cursor, entry)
+
+        cursor.endEditBlock()
+
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    @staticmethod
+    def insert(cursor, entry):
+        # a fresh format, or the text would continue the link of the entry before
+        cursor.setCharFormat(QTextCharFormat())
+        cursor.insertHtml(entry.html())
+
+    def toggle(self, url):
+        if url.scheme() != 'entry':
+            return
+
+        self.flush()
+        entry_id = int(url.path())
+        for index, entry in enumerate(self.entries):
+            if entry.id == entry_id:
+                entry.expanded = not entry.expanded
+
+                block = self.view.document().findBlockByNumber(index)
+                cursor = QTextCursor(block)
+                cursor.beginEditBlock()
+                cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+                self.insert(cursor, entry)
+                cursor.endEditBlock()
+                return
+
+    def spill(self, entries):
+        if not entries:
+            return
+        if self.history is None:
+            self.history = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self.history.writelines(f"{entry.plain()}\n" for entry in entries)
+        self.spilled += len(entries)
+
+    def clear(self):
+        self.timer.stop()
+        self.pending.clear()
+        self.entries.clear()
+        self.view.clear()
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+        self.spilled = 0
+
+    def export(self, file_name):
+        """ Writes every entry since the last clear, messages pretty printed, returns how many """
+
+        self.flush()
+
+        with open(file_name, 'w', encoding='utf-8') as file:
+            if self.history is not None:
+                self.history.seek(0)
+                for line in self.history:
+                    file.write(line)
+                self.history.seek(0, 2)
+
+            for entry in self.entries:
+                file.write(f"{entry.plain()}\n")
+
+        return self.spilled + len(self.entries)
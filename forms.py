@@ -0,0 +1,74 @@
+"""
+Qt Designer forms of the kit.
+
+The forms in resources/*.ui are compiled ahead of time to resources/*_ui.py
+(`python forms.py`, also run by pyinstaller.spec). A compiled form is used
+as long as it is newer than its .ui file, otherwise the .ui is loaded at
+runtime, parsed once per process and reused for every window opened after.
+"""
+
+import os
+import importlib.util
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESOURCES_DIR = os.path.join(BASE_DIR, 'resources')
+
+FORMS = ('main_window', 'conf_window', 'about_window')
+
+_form_classes = {}
+
+
+def ui_file(name):
+    return os.path.join(RESOURCES_DIR, f'{name}.ui')
+
+
+def compiled_file(name):
+    return os.path.join(RESOURCES_DIR, f'{name}_ui.py')
+
+
+def is_compiled(name):
+    compiled = compiled_file(name)
+    return os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(ui_file(name))
+
+
+def form_class(name):
+    """ The Ui_* class of the form, compiled when up to date, else built from the .ui """
+
+    if name not in _form_classes:
+        if is_compiled(name):
+            spec = importlib.util.spec_from_file_location(f'{name}_ui', compiled_file(name))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            form = next(value for key, value in vars(module).items() if key.startswith('Ui_'))
+        else:
+            from PyQt5 import uic
+            form, _ = uic.loadUiType(ui_file(name))
+
+        _form_classes[name] = form
+
+    return _form_classes[name]
+
+
+def load_form(name, widget):
+    """ Builds the form on `widget` and exposes its child widgets as attributes, like uic.loadUi """
+
+    ui = form_class(name)()
+    ui.setupUi(widget)
+
+    for attribute, value in vars(ui).items():
+        setattr(widget, attribute, value)
+
+
+def compile_forms():
+    from PyQt5 import uic
+
+    for name in FORMS:
+        if is_compiled(name):
+            continue
+        with open(compiled_file(name), 'w') as file:
+            uic.compileUi(ui_file(name), file)
+        print(f"compiled {ui_file(name)} -> {compiled_file(name)}")
+
+
+if __name__ == '__main__':
+    compile_forms()
@@ -0,0 +1,135 @@
+"""
+Content hashes of local files, uploaded as the objects' metadata, so that
+re-running an unchanged file only publishes its message again.
+
+Files are hashed in fixed size chunks, and the hash is remembered against
+the file's (path, size, mtime) so an unchanged file is never read twice.
+"""
+
+import os
+import json
+import atexit
+import hashlib
+import tempfile
+import threading
+import itertools
+from time import monotonic
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# digests of this many files are kept, the least recently used ones go first
+MAX_FILES = 10000
+# seconds between two writes of the cache file
+SAVE_INTERVAL = 1.0
+
+# object metadata key the content hash is uploaded with (x-amz-meta-sha256)
+METADATA_KEY = 'sha256'
+
+
+def file_digest(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """ Digests of local files by (path, size, mtime), the `max_files` most recently
+        used ones. Writes are batched, at most one every SAVE_INTERVAL seconds and one
+        at exit, and merged with what other processes saved in the meantime """
+
+    def __init__(self, cache_file, max_files=MAX_FILES):
+        self.cache_file = cache_file
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        # path -> [size, mtime_ns, digest], least recently used first
+        self.files = self.load()
+        self.dirty = False
+        self.saved_at = 0.0
+
+        atexit.register(self.save)
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                return dict(json.load(file).get('files', {}))
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        with self.lock:
+            cached = self.files.pop(path, None)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                self.files[path] = cached
+                return cached[2]
+
+        digest = file_digest(path)
+        with self.lock:
+            self.files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.evict(self.files)
+            self.dirty = True
+            due = monotonic() - self.saved_at >= SAVE_INTERVAL
+
+        if due:
+            self.save()
+        return digest
+
+    def evict(self, files):
+        for path in list(itertools.islice(files, max(0, len(files) - self.max_files))):
+            del files[path]
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                files = dict(self.files)
+                self.dirty = False
+                self.saved_at = monotonic()
+
+            # the entries of this process win over the ones saved by others meanwhile
+            merged = {path: entry for path, entry in self.load().items() if path not in files}
+            merged.update(files)
+            self.evict(merged)
+
+            directory = os.path.dirname(self.cache_file)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_file = tempfile.mkstemp(dir=directory, prefix='.upload_cache.', suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as file:
+                        json.dump(dict(files=merged), file)
+                    os.replace(temp_file, self.cache_file)
+                except BaseException:
+                    os.remove(temp_file)
+                    raise
+            except OSError:
+                # only a cache, the digests are computed again next time
+                pass
+
+
+def is_uploaded(client, digest, bucket_name, key):
+    """ Whether the object already holds this content, checked against the server.
+        Only a missing object counts as not uploaded, any other error is raised """
+
+    try:
+        head = client.head_object(Bucket=bucket_name, Key=key)
+    except client.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+    return head.get('Metadata', {}).get(METADATA_KEY) == digest
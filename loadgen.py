@@ -0,0 +1,153 @@
+"""
+Rate control and latency statistics of the `--load-test` mode of
+publisher_script.py.
+
+Messages are let through by a token bucket whose rate follows a ramp-up
+profile, from a trickle up to the target rate, and the time every publish
+took to be confirmed goes into LatencyStats, which reports the rate
+achieved and the latency percentiles of every interval and of the run.
+
+    bucket = TokenBucket(ramp('linear', 200, 30))
+    stats = LatencyStats()
+    while ...:
+        bucket.acquire(stop)
+        ...
+        stats.add(latency)
+"""
+
+import math
+import threading
+from time import sleep, monotonic
+
+RAMP_PROFILES = ('none', 'linear', 'step')
+RAMP_STEPS = 4
+
+# a ramp starts at this many messages per second rather than at none
+MIN_RATE = 1.0
+
+# a wait for the next token is cut into slices this long, so that a rate
+# rising in the meantime is followed without waiting out the slower one
+MAX_WAIT = 0.05
+
+REPORTED_PERCENTILES = (50, 95, 99)
+
+
+class TokenBucket:
+    """ Lets `schedule(seconds since it was created)` acquisitions through per
+        second on average, and up to `capacity` at once after an idle spell """
+
+    def __init__(self, schedule, capacity=None):
+        self.lock = threading.Lock()
+        self.schedule = schedule
+        self.capacity = capacity
+        self.tokens = 1.0
+        self.started = self.updated = monotonic()
+        self.rate = schedule(0)
+
+    def refill(self):
+        now = monotonic()
+        self.rate = self.schedule(now - self.started)
+        # one second worth of tokens by default, the burst at the target rate
+        capacity = self.capacity or max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, stop=None):
+        """ Waits for a token, returns False when `stop` was set in the meantime """
+
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = min(MAX_WAIT, (1 - self.tokens) / self.rate)
+
+            if stop is None:
+                sleep(wait)
+            elif stop.wait(wait):
+                return False
+
+
+def ramp(profile, rate, seconds, steps=RAMP_STEPS):
+    """ The target rate at a number of seconds into the run:
+
+        none     the full rate from the start
+        linear   rising evenly up to the full rate over `seconds`
+        step     in `steps` equal steps over `seconds`
+    """
+
+    if profile not in RAMP_PROFILES:
+        raise ValueError(f"Unknown ramp profile {profile!r}, one of {', '.join(RAMP_PROFILES)}")
+
+    def rate_at(elapsed):
+        if profile == 'none' or seconds <= 0 or elapsed >= seconds:
+            return rate
+        if profile == 'linear':
+            fraction = elapsed / seconds
+        else:
+            fraction = (math.floor(elapsed / seconds * steps) + 1) / steps
+        return max(min(rate, MIN_RATE), rate * fraction)
+
+    return rate_at
+
+
+def percentile(ordered, percent):
+    """ Nearest rank percentile of an already sorted list """
+
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyStats:
+    """ Publish latencies of the whole run, and of the interval since the last `interval()` """
+
+    def __init__(self):
+        self.started = monotonic()
+        self.latencies = []
+        self.errors = 0
+
+        self.interval_started = self.started
+        self.interval_from = 0
+        self.interval_errors = 0
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def failed(self):
+        self.errors += 1
+        self.interval_errors += 1
+
+    @staticmethod
+    def summary(latencies, errors, seconds):
+        ordered = sorted(latencies)
+        return dict(
+                messages = len(latencies),
+                errors = errors,
+                seconds = seconds,
+                rate = len(latencies) / seconds if seconds > 0 else 0.0,
+                percentiles = {percent: percentile(ordered, percent) for percent in REPORTED_PERCENTILES},
+                max = ordered[-1] if ordered else 0.0
+            )
+
+    def interval(self):
+        """ Summary of the messages since the previous call """
+
+        now = monotonic()
+        summary = self.summary(
+                self.latencies[self.interval_from:], self.interval_errors, now - self.interval_started
+            )
+        self.interval_started, self.interval_from, self.interval_errors = now, len(self.latencies), 0
+        return summary
+
+    def total(self):
+        return self.summary(self.latencies, self.errors, monotonic() - self.started)
+
+
+def describe(summary):
+    percentiles = '  '.join(
+            f"p{percent} {seconds * 1000:.1f} ms" for percent, seconds in summary['percentiles'].items()
+        )
+    return f"{summary['rate']:.1f} msgs/sec  {percentiles}  max {summary['max'] * 1000:.1f} ms"
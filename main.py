@@ -1,19 +1,244 @@
 import os
-import json
+import copy
 import sys
 import subprocess
-from time import sleep
-from threading import Thread
+from time import strftime, monotonic
+from threading import Thread, Event
+
+# the headless mode is handed over to before PyQt5 is imported, see cli.py
+if __name__ == "__main__" and sys.argv[1:2] == ['--cli']:
+    import cli
+    sys.exit(cli.main(sys.argv[2:]))
 
-import qdarktheme
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import *
-from PyQt5.QtCore import Qt, QPropertyAnimation, QSettings, QPoint
-from PyQt5 import uic
-
+from PyQt5.QtCore import Qt, QSettings, QPoint, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+import forms
 import utils
+import tracing
+import pipeline
+import replies
+import compression
+from console import Console
 from config import C, BASE_DIR
 
+PRELOAD_DELAY_MS = 500
+
+
+def setup_theme(theme):
+    # qdarktheme is most of the start up's import time, it is only
+    # imported once the window shows, see main
+    import qdarktheme
+    qdarktheme.setup_theme(theme)
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int)
+    uploaded = pyqtSignal(int, str, str, bool)
+    published = pyqtSignal(int, dict, str)
+    failed = pyqtSignal(int, str, str, object)
+    finished = pyqtSignal(int, str, str)
+    flushed = pyqtSignal(int, int, int)
+
+
+class RepliesSignals(QObject):
+    replied = pyqtSignal(int, object)
+
+
+class HealthCheckSignals(QObject):
+    checked = pyqtSignal(str, object, bool)
+
+
+class UploadPublishJob(QRunnable):
+    """ Uploads the files and publishes their messages away from the GUI thread """
+
+    def __init__(self, job_id, files, queues, force_upload=False):
+        super().__init__()
+
+        self.job_id = job_id
+        self.files = files
+        # (display name, value) of every queue the messages are published to
+        self.queues = queues
+        self.force_upload = force_upload
+        self.track_replies = any('correlation_id' in message for _, message in files)
+
+        # timings of the job's setup, every file gets a trace of its own
+        self.run_id = tracing.new_run_id()
+        self.trace = tracing.Trace('setup')
+
+        # configuration is captured when the job is queued, not when it runs
+        with self.trace.span('config'):
+            self.aws_config = C.get_aws_information()
+            self.upload_config = C.get_upload_config()
+            self.rabbit_config = C.get_rabbit_information()
+            self.rabbit_profiles = C.get_rabbit_profiles()
+            self.folder_name = C.get_folder_name()
+            self.db_name = C.get_db_name()
+
+        self.signals = JobSignals()
+
+    def report_progress(self, percent):
+        # the uploads take the progress bar up to 90%, publishing completes it
+        self.signals.progress.emit(self.job_id, int(percent * 0.9))
+
+    def log(self, trace, **fields):
+        utils.run_log().write(trace.as_record(run=self.run_id, source='gui', **fields))
+
+    def run(self):
+        try:
+            with tracing.activate(self.trace):
+                aws = utils.AWS(self.aws_config, self.folder_name, self.upload_config)
+                aws.get_connection()
+                targets = [
+                        (name, *utils.rabbit_target(self.rabbit_config, self.rabbit_profiles, value))
+                        for name, value in self.queues
+                    ]
+                rmq = utils.FanOut(targets, self.db_name)
+        except Exception as e:
+            self.log(self.trace, ok=False, error=str(e))
+            self.signals.failed.emit(self.job_id, '', 'upload', e)
+            self.signals.finished.emit(self.job_id, self.trace.breakdown(), '')
+            return
+
+        # the messages still go out when their replies cannot be listened for
+        if self.track_replies:
+            try:
+                with tracing.activate(self.trace), self.trace.span('replies'):
+                    for _, config, _ in targets:
+                        utils.listen_for_replies(config)
+            except Exception as e:
+                self.signals.failed.emit(self.job_id, '', 'replies', e)
+
+        # a listing that fails only leaves the abandoned uploads for the next job
+        try:
+            with tracing.activate(self.trace):
+                aws.abort_abandoned_uploads()
+        except Exception:
+            pass
+
+        # messages earlier jobs could not get confirmed go out first
+        try:
+            if rmq.pending():
+                with tracing.activate(self.trace), self.trace.span('outbox_flush'):
+                    self.signals.flushed.emit(self.job_id, *rmq.flush_outbox())
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, '', 'outbox', e)
+
+        # whatever goes wrong past this point, the window still learns that the job is over
+        summary = ''
+        try:
+            jobs = [pipeline.PipelineJob(local_file_path, message) for local_file_path, message in self.files]
+            progress = utils.UploadProgress(sum(job.size for job in jobs), self.report_progress)
+
+            def upload(job):
+                encoding = aws.encoding_for(job.message, job.local_file_path)
+                uploaded = aws.upload(job.local_file_path, callback=progress, force=self.force_upload, encoding=encoding)
+                compression.mark_message(job.message, encoding)
+                self.signals.uploaded.emit(self.job_id, job.local_file_path, aws.bucket_name, uploaded)
+                for name, error in utils.replica_failures(job.trace).items():
+                    self.signals.failed.emit(self.job_id, job.local_file_path, 'replica', f"{name}: {error}")
+                return uploaded
+
+            def publish(job):
+                correlation_id = job.message.get('correlation_id')
+                if correlation_id:
+                    utils.reply_tracker().published(correlation_id, job.local_file_path)
+                rmq.publish(job.message)
+
+            def report(job):
+                self.log(
+                        job.trace, ok=job.ok, uploaded=job.uploaded, stage=job.stage,
+                        error=str(job.error) if job.error else None
+                    )
+                if job.ok:
+                    self.signals.published.emit(self.job_id, job.message, job.trace.breakdown())
+                else:
+                    self.signals.failed.emit(self.job_id, job.local_file_path, job.stage, job.error)
+
+            try:
+                stats = pipeline.Pipeline(upload, publish, on_result=report).run(jobs)
+            finally:
+                rmq.close()
+            self.log(self.trace, ok=not stats.failures, files=len(jobs), failures=stats.failures,
+                     wall_ms=round(stats.wall_time * 1000, 3))
+
+            if not stats.failures:
+                self.signals.progress.emit(self.job_id, 100)
+            summary = stats.summary()
+        except Exception as e:
+            self.log(self.trace, ok=False, error=str(e))
+            self.signals.failed.emit(self.job_id, '', 'upload', e)
+        finally:
+            self.signals.finished.emit(self.job_id, self.trace.breakdown(), summary)
+
+
+class FlushOutboxJob(QRunnable):
+    """ Publishes the messages the outbox holds for the configured server """
+
+    def __init__(self, job_id):
+        super().__init__()
+
+        self.job_id = job_id
+        self.rabbit_config = C.get_rabbit_information()
+        self.db_name = C.get_db_name()
+
+        self.signals = JobSignals()
+
+    def run(self):
+        try:
+            rmq = utils.RabbitMQ(self.rabbit_config, self.db_name, None)
+            self.signals.flushed.emit(self.job_id, *rmq.flush_outbox())
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, '', 'outbox', e)
+        self.signals.finished.emit(self.job_id, '', '')
+
+
+class RepliesJob(QRunnable):
+    """ Waits for the consumer's replies to the messages of a job, then reports their latencies """
+
+    def __init__(self, job_id, correlation_ids, timeout, stop):
+        super().__init__()
+
+        self.job_id = job_id
+        self.correlation_ids = correlation_ids
+        self.timeout = timeout
+        self.stop = stop
+
+        self.signals = RepliesSignals()
+
+    def run(self):
+        tracker = utils.reply_tracker()
+        tracker.wait(self.correlation_ids, self.timeout, self.stop)
+        if not self.stop.is_set():
+            self.signals.replied.emit(self.job_id, replies.report(tracker.collect(self.correlation_ids)))
+
+
+class HealthCheckJob(QRunnable):
+    """ Tests the connection to RabbitMQ ('rabbit') or S3 ('aws') away from the GUI thread """
+
+    def __init__(self, kind):
+        super().__init__()
+
+        self.kind = kind
+        general_config = C.get_general_config()
+        self.timeouts = (int(general_config['connect_timeout']), int(general_config['read_timeout']))
+        self.rabbit_config = C.get_rabbit_information()
+        self.aws_config = C.get_aws_information()
+        self.folder_name = C.get_folder_name()
+
+        self.signals = HealthCheckSignals()
+
+    def run(self):
+        try:
+            if self.kind == 'rabbit':
+                result, cached = utils.probe_rabbit(self.rabbit_config, *self.timeouts)
+            else:
+                result, cached = utils.probe_s3(self.aws_config, self.folder_name, *self.timeouts)
+        except Exception as e:
+            result, cached = utils.ProbeResult(False, {}, e), False
+        self.signals.checked.emit(self.kind, result, cached)
+
+
 class MainWindow(QMainWindow):
 
     def __init__(self):
@@ -25,15 +250,18 @@ class MainWindow(QMainWindow):
         pos = self.settings.value("window_position", QPoint(200, 200))
         self.move(pos)
 
-        uic.loadUi(os.path.join(BASE_DIR, "resources", "main_window.ui"), self)
+        forms.load_form("main_window", self)
+        self.console = Console(self.console_view)
+        # messages are published to every checked queue
+        utils.make_multi_select(self.x_rabbit_queue)
         self.apply_configuration()
         self.show()
 
-        self.general_config = C.get_general_config()
-
         # Menu Operations
         self.actionConsole.triggered.connect(self.toggle_console)
         self.actionConfiguration.triggered.connect(self.open_config_window)
+        self.actionFlushOutbox.triggered.connect(self.flush_outbox)
+        self.actionExportConsole.triggered.connect(self.export_console)
         self.actionAbout.triggered.connect(self.open_about_window)
         self.menuAbout.addAction(self.actionAbout)
         self.actionExit.triggered.connect(sys.exit)
@@ -53,6 +281,26 @@ class MainWindow(QMainWindow):
         self.btn_execute.setEnabled(False)
         self.btn_run.setEnabled(False)
 
+        # jobs run one after another on a single worker so that the
+        # progress bar always follows the job currently uploading
+        self.job_pool = QThreadPool(self)
+        self.job_pool.setMaxThreadCount(1)
+        self.job_files = {}
+        self.last_job_id = 0
+
+        # replies are waited for apart, so that the next job need not wait on them
+        self.reply_pool = QThreadPool(self)
+        self.job_replies = {}
+        self.replies_stop = Event()
+
+        self.config_window = None
+        self.update_job_status()
+
+    @property
+    def general_config(self):
+        # read on every use so that saved and hot reloaded changes apply
+        return C.get_general_config()
+
     def toggle_console(self):
         if self.actionConsole.isChecked():
             self.setFixedWidth(650)
@@ -62,7 +310,7 @@ class MainWindow(QMainWindow):
     def update_theme(self, theme):
         if theme not in {'auto', 'light', 'dark'}:
             theme = 'auto'
-        qdarktheme.setup_theme(theme)
+        setup_theme(theme)
         if theme == 'auto':
             theme='system'
         self.console.append(f"Switched to '{theme}' theme")
@@ -107,13 +355,36 @@ class MainWindow(QMainWindow):
         self.console.append("Loaded configurations")
 
     def open_config_window(self):
-        config_window = ConfigWindow(self)
-        config_window.exec_()
+        # the dialog is built once and re-populated on every later open
+        if self.config_window is None:
+            self.config_window = ConfigWindow(self)
+        elif self.config_window.isVisible():
+            self.config_window.raise_()
+            return
+        else:
+            self.config_window.load_configurations()
+            self.config_window.show()
+        self.config_window.exec_()
 
     def open_about_window(self):
         aboutwindow = AboutWindow(self)
         aboutwindow.exec_()
 
+    def export_console(self):
+        last_browsed_dir = self.settings.value("last_browsed_dir", os.path.expanduser('~'))
+        default_name = os.path.join(last_browsed_dir, strftime('console-%Y%m%d-%H%M%S.log'))
+
+        file_name = QFileDialog.getSaveFileName(self, "Export Console", default_name)[0]
+        if not file_name:
+            return
+
+        try:
+            count = self.console.export(file_name)
+        except OSError as e:
+            self.console.append(f"❌ Could not export the console: {e}")
+            return
+        self.console.append(f"Exported {count} console entries to {file_name}")
+
     def open_selected_file(self):
         filename = self.x_inputfile.toPlainText()
 
@@ -128,96 +399,167 @@ class MainWindow(QMainWindow):
 
         last_browsed_dir = self.settings.value("last_browsed_dir", os.path.expanduser('~'))
 
-        filename = QFileDialog.getOpenFileName(self, "Select File", last_browsed_dir)[0]
-        if not filename:
+        filenames = QFileDialog.getOpenFileNames(self, "Select Files", last_browsed_dir)[0]
+        if not filenames:
             return
 
-        self.settings.setValue("last_browsed_dir", os.path.dirname(filename))
-        self.x_inputfile.setPlainText(filename)
+        self.settings.setValue("last_browsed_dir", os.path.dirname(filenames[0]))
+        self.x_inputfile.setPlainText('\n'.join(filenames))
 
-        self.btn_execute.setEnabled(bool(filename))
-        self.btn_run.setEnabled(bool(filename))
+        self.btn_execute.setEnabled(len(filenames) == 1)
+        self.btn_run.setEnabled(True)
 
 
-    def run(self):
+    def input_files(self):
+        return [line.strip() for line in self.x_inputfile.toPlainText().splitlines() if line.strip()]
 
-        progress_animation = QPropertyAnimation(self.progressBar, b"value")
-        progress_animation.setDuration(1000)
+    def run(self):
 
-        progress_animation.setStartValue(0)
-        progress_animation.setEndValue(20)
-        progress_animation.start()  # Start the animation
+        queues = utils.checked_items(self.x_rabbit_queue)
+        if not queues:
+            self.console.append("❌ Check at least one rabbit queue to publish to")
+            return
 
-        aws = utils.AWS(C.get_aws_information(), C.get_folder_name())
-        try:
-            aws.upload(self.x_inputfile.toPlainText())
-            self.console.append(
-                    f'✅ File {self.x_inputfile.toPlainText()} was uploaded to {C.get_aws_information().get("bucket_name")}'
+        track_replies = C.get_rabbit_information()['track_replies']
+
+        files = []
+        for local_file_path in self.input_files():
+            message = dict(
+                    file_name = os.path.basename(local_file_path),
+                    company_name = self.x_company.currentData(),
+                    file_type = self.x_filetype.currentData(),
+                    data_type = self.x_datatype.currentData(),
+                    load_id = self.x_loadid.value(),
+                    file_sub_type = self.x_filesubtype.currentData(),
+                    bucket_name = self.x_bucketname.toPlainText(),
+                    folder_name = self.x_foldername.toPlainText(),
+                    original_file_name = self.x_originalfilename.toPlainText(),
                 )
+            if track_replies:
+                message.update(replies.new_reply_fields(utils.reply_queue()))
+            files.append((local_file_path, message))
+
+        self.last_job_id += 1
+        job = UploadPublishJob(
+                self.last_job_id, files,
+                queues, self.x_force_upload.isChecked()
+            )
+        job.signals.progress.connect(self.job_progress)
+        job.signals.uploaded.connect(self.job_uploaded)
+        job.signals.published.connect(self.job_published)
+        job.signals.failed.connect(self.job_failed)
+        job.signals.flushed.connect(self.outbox_flushed)
+        job.signals.finished.connect(self.job_finished)
 
-        except Exception as e:
+        self.job_files[job.job_id] = files
+        if len(self.job_files) > 1:
+            self.console.append(f"Queued job #{job.job_id}: {len(files)} file(s)")
+        self.update_job_status()
 
-            progress_animation.setStartValue(20)
-            progress_animation.setEndValue(30)
-            progress_animation.start()  # Start the animation
+        self.job_pool.start(job)
 
-            if isinstance(e, ValueError):
-                self.open_config_window()
+    def flush_outbox(self):
+        self.last_job_id += 1
+        job = FlushOutboxJob(self.last_job_id)
+        job.signals.flushed.connect(self.outbox_flushed)
+        job.signals.failed.connect(self.job_failed)
+        job.signals.finished.connect(self.job_finished)
 
-            self.console.append(f"❌ AWS Exception: {e}")
-            return
+        self.job_files[job.job_id] = []
+        self.update_job_status()
 
-        progress_animation.setStartValue(0)
-        progress_animation.setEndValue(50)
-        progress_animation.start()  # Start the animation
+        self.job_pool.start(job)
 
+    def update_job_status(self):
+        status = []
+        if self.job_files:
+            status.append(f"{len(self.job_files)} job(s) pending")
 
         try:
-            with utils.RabbitMQ(
-                    C.get_rabbit_information(),
-                    C.get_db_name(),
-                    self.x_rabbit_queue.currentData()
-                ) as rmq:
-
-                message = dict(
-                        file_name = os.path.basename(self.x_inputfile.toPlainText()),
-                        company_name = self.x_company.currentData(),
-                        file_type = self.x_filetype.currentData(),
-                        data_type = self.x_datatype.currentData(),
-                        load_id = self.x_loadid.value(),
-                        file_sub_type = self.x_filesubtype.currentData(),
-                        bucket_name = self.x_bucketname.toPlainText(),
-                        folder_name = self.x_foldername.toPlainText(),
-                        original_file_name = self.x_originalfilename.toPlainText(),
-                    )
+            pending = utils.message_outbox().count()
+        except Exception:
+            pending = 0
+        if pending:
+            status.append(f"{pending} message(s) in the outbox")
+
+        if status:
+            self.statusbar.showMessage(', '.join(status))
+        else:
+            self.statusbar.clearMessage()
 
-                try:
-                    rmq.publish(message)
-                    self.console.append(f'✅ Message published to rabbitmq\n')
+    def job_progress(self, job_id, percent):
+        self.progressBar.setValue(percent)
 
-                    if self.general_config['rabbit_message_in_console']:
-                        self.console.append(json.dumps(message, indent=4))
+    def job_uploaded(self, job_id, local_file_path, bucket_name, uploaded):
+        if uploaded:
+            self.console.append(f'✅ File {local_file_path} was uploaded to {bucket_name}')
+        else:
+            self.console.append(f'✅ File {local_file_path} is unchanged in {bucket_name}, upload skipped')
 
-                    progress_animation.setStartValue(50)
-                    progress_animation.setEndValue(100)
-                    progress_animation.start()  # Start the animation
+    def job_published(self, job_id, message, breakdown):
+        self.console.append(f'✅ Message published to rabbitmq')
+        self.console.append(f'⏱ {breakdown}\n')
 
-                except Exception as e:
-                    progress_animation.setStartValue(50)
-                    progress_animation.setEndValue(80)
-                    progress_animation.start()  # Start the animation
-                    self.console.append(f'❌ Error while publishing to rabbitmq: {e}')
+        if self.general_config['rabbit_message_in_console']:
+            self.console.append_message(message)
 
-            self.progressBar.setValue(100)
-        except Exception as e:
-            self.console.append(f"Exception: {e}")
-            self.progressBar.setValue(0)
+        if 'correlation_id' in message:
+            self.job_replies.setdefault(job_id, []).append(message['correlation_id'])
+
+    def job_failed(self, job_id, local_file_path, stage, error):
+        if stage == 'upload':
+            self.console.append(f"❌ AWS Exception: {error} {local_file_path}".rstrip())
+            if isinstance(error, ValueError):
+                self.open_config_window()
+        elif stage == 'outbox':
+            self.console.append(f'❌ Error while publishing the outbox to rabbitmq: {error}')
+        elif stage == 'replies':
+            self.console.append(f"❌ Could not listen for the consumer's replies: {error}")
+            return
+        elif stage == 'replica':
+            self.console.append(f"⚠ File {local_file_path} was not copied to the replica {error}")
+            return
+        else:
+            self.console.append(f'❌ Error while publishing {local_file_path} to rabbitmq: {error}')
+            self.console.append('The message was kept in the outbox, File > Flush outbox sends it again')
+        self.progressBar.setValue(0)
+
+    def outbox_flushed(self, job_id, published, pending):
+        self.console.append(f'📤 {published} message(s) published from the outbox, {pending} still pending')
+        self.update_job_status()
+
+    def job_finished(self, job_id, setup, summary):
+        files = self.job_files.pop(job_id, [])
+        if setup:
+            self.console.append(f"⏱ Job #{job_id} setup: {setup}")
+        if summary and len(files) > 1:
+            self.console.append(f"Job #{job_id}: {summary}")
+        self.update_job_status()
+
+        correlation_ids = self.job_replies.pop(job_id, None)
+        if correlation_ids:
+            job = RepliesJob(
+                    job_id, correlation_ids,
+                    float(C.get_rabbit_information()['reply_timeout']), self.replies_stop
+                )
+            job.signals.replied.connect(self.job_replied)
+            self.reply_pool.start(job)
+
+    def job_replied(self, job_id, lines):
+        self.console.append(f"📨 Replies to job #{job_id}:\n" + '\n'.join(lines))
 
 
     def closeEvent(self, event):
         # Save the window position in settings when the application is closed
         self.settings.setValue("window_position", self.pos())
 
+        # let the job that is already uploading finish, drop the queued ones
+        self.job_pool.clear()
+        self.job_pool.waitForDone()
+        self.replies_stop.set()
+        self.reply_pool.waitForDone()
+        utils.close_rabbit_connections()
+
         super().closeEvent(event)
 
 
@@ -226,7 +568,7 @@ class ConfigWindow(QDialog):
         super().__init__(parent)
 
         self.parent = parent
-        uic.loadUi(os.path.join(BASE_DIR, "resources", "conf_window.ui"), self)
+        forms.load_form("conf_window", self)
         self.show()
 
         self.btn_save.clicked.connect(lambda: self.save())
@@ -240,55 +582,59 @@ class ConfigWindow(QDialog):
         self.rabbit_test.clicked.connect(self.test_rabbit_connection)
         self.aws_test.clicked.connect(self.test_aws_connection)
 
-        self.load_configurations()
-
-    def load_configurations(self):
-        self.checkBox_console.setChecked(C.get_console())
-        self.cb_rabbit_message_in_console.setChecked(C.get_general_config()['rabbit_message_in_console'])
-        self.cb_allow_open_input_file.setChecked(C.get_general_config()['allow_open_input_file'])
-        self.get_config_theme().setChecked(True)
-
-        for item in C.get_company_names():
-            self.add_item(self.listWidget_company, item)
+        # both connections can be tested at the same time
+        self.check_pool = QThreadPool(self)
+        self.check_pool.setMaxThreadCount(2)
 
         utils.add_delete_move_functionality(self.listWidget_company,
                 (self.cn_add, self.cn_up, self.cn_down, self.cn_delete)
             )
-
-        for item in C.get_file_types():
-            self.add_item(self.listWidget_filetype, item)
-
         utils.add_delete_move_functionality(self.listWidget_filetype,
                 (self.ft_add, self.ft_up, self.ft_down, self.ft_delete)
             )
-
-        for item in C.get_datatypes():
-            self.add_item(self.listWidget_datatype, item)
-
         utils.add_delete_move_functionality(self.listWidget_datatype,
                 (self.dt_add, self.dt_up, self.dt_down, self.dt_delete)
             )
-
-        for item in C.get_filesubtypes():
-            self.add_item(self.listWidget_filesubtype, item)
-
         utils.add_delete_move_functionality(self.listWidget_filesubtype,
                 (self.st_add, self.st_up, self.st_down, self.st_delete)
             )
-
-        for item in C.get_rabbit_queues():
-            self.add_item(self.listWidget_rabbitqueues, item)
-
         utils.add_delete_move_functionality(self.listWidget_rabbitqueues,
                 (self.rq_add, self.rq_up, self.rq_down, self.rq_delete)
             )
 
+        self.load_configurations()
+
+    def load_configurations(self):
+        self.checkBox_console.setChecked(C.get_console())
+        self.cb_rabbit_message_in_console.setChecked(C.get_general_config()['rabbit_message_in_console'])
+        self.cb_allow_open_input_file.setChecked(C.get_general_config()['allow_open_input_file'])
+        self.check_connect_timeout.setValue(int(C.get_general_config()['connect_timeout']))
+        self.check_read_timeout.setValue(int(C.get_general_config()['read_timeout']))
+
+        # the theme in use is only being displayed here, re-applying it
+        # through the toggled signal costs hundreds of milliseconds
+        theme_button = self.get_config_theme()
+        theme_button.blockSignals(True)
+        theme_button.setChecked(True)
+        theme_button.blockSignals(False)
+
+        for list_widget, items in (
+                (self.listWidget_company, C.get_company_names()),
+                (self.listWidget_filetype, C.get_file_types()),
+                (self.listWidget_datatype, C.get_datatypes()),
+                (self.listWidget_filesubtype, C.get_filesubtypes()),
+                (self.listWidget_rabbitqueues, C.get_rabbit_queues()),
+            ):
+            list_widget.clear()
+            for item in items:
+                self.add_item(list_widget, item)
 
         self.config_foldername.setPlainText(C.get_folder_name())
         self.config_dbname.setPlainText(C.get_db_name())
 
         self.setup_rabbit()
         self.setup_aws()
+        self.setup_upload()
 
 
     def setup_aws(self):
@@ -298,6 +644,15 @@ class ConfigWindow(QDialog):
         self.aws_secret.setPlainText(self.aws.secret)
         self.aws_bucket.setPlainText(self.aws.bucket_name)
 
+    def setup_upload(self):
+        upload_config = C.get_upload_config()
+        self.upload_threshold.setValue(int(upload_config['multipart_threshold']))
+        self.upload_chunksize.setValue(int(upload_config['multipart_chunksize']))
+        self.upload_concurrency.setValue(int(upload_config['max_concurrency']))
+        self.upload_pool.setValue(int(upload_config['max_pool_connections']))
+        self.upload_threads.setChecked(bool(upload_config['use_threads']))
+        self.upload_abandoned.setValue(int(upload_config['abandoned_upload_hours']))
+
     def setup_rabbit(self):
         self.rmq = utils.RabbitMQ(
                 C.get_rabbit_information(),
@@ -311,63 +666,55 @@ class ConfigWindow(QDialog):
         self.rabbit_vhost.setPlainText(self.rmq.server_config['virtual_host'])
 
     def revert_styled_button(self, button):
-        sleep(1.5)
         button.setStyleSheet("background-color: grey; color: black; border: 1px solid grey;")
+        button.setText("Test\nConnection")
+        button.setEnabled(True)
+
+    def style_tested_button(self, button, ok):
+        color, qt_color = ('green', Qt.green) if ok else ('red', Qt.red)
+        button.setStyleSheet(f"background-color: {color}; border: 2px solid {color};")
+        button.setAutoFillBackground(True)
+        effect = QGraphicsDropShadowEffect(button)
+        effect.setColor(qt_color)
+        effect.setOffset(0, 0)
+        effect.setBlurRadius(20)
+        button.setGraphicsEffect(effect)
+
+    def start_health_check(self, kind, button):
+        button.setEnabled(False)
+        button.setText("Testing...")
+
+        job = HealthCheckJob(kind)
+        job.signals.checked.connect(self.health_checked)
+        self.check_pool.start(job)
+
+    def health_checked(self, kind, result, cached):
+        button, name = (self.rabbit_test, 'RabbitMQ') if kind == 'rabbit' else (self.aws_test, 'AWS S3/Minio')
+        self.style_tested_button(button, result.ok)
+
+        age = f", {monotonic() - result.checked_at:.0f}s ago" if cached else ''
+        if result.ok:
+            button.setText(f"{result.total * 1000:.0f} ms")
+            self.parent.console.append(f"Connection to {name} was successfull ({result.describe()}{age})")
+        else:
+            button.setText("Failed")
+            timings = f" after {result.describe()}" if result.latencies else ''
+            self.parent.console.append(
+                    f"Error connecting to {name}: {type(result.error).__name__}: {result.error}{timings}{age}"
+                )
 
+        QTimer.singleShot(1500, lambda: self.revert_styled_button(button))
 
     def test_rabbit_connection(self):
-        try:
-            self.save(persistent=False)
-            self.setup_rabbit()
-            connection = self.rmq.get_connection()
-            connection.close()
-            self.rabbit_test.setStyleSheet("background-color: green; border: 2px solid green;")
-            self.rabbit_test.setAutoFillBackground(True)
-            effect = QGraphicsDropShadowEffect(self.rabbit_test)
-            effect.setColor(Qt.green)
-            effect.setOffset(0, 0)
-            effect.setBlurRadius(20)
-            self.rabbit_test.setGraphicsEffect(effect)
-            self.parent.console.append("Connection to RabbitMQ was successfull")
-        except Exception as e:
-            self.rabbit_test.setStyleSheet("background-color: red; border: 2px solid red;")
-            self.rabbit_test.setAutoFillBackground(True)
-            effect = QGraphicsDropShadowEffect(self.rabbit_test)
-            effect.setColor(Qt.red)
-            effect.setOffset(0, 0)
-            effect.setBlurRadius(20)
-            self.rabbit_test.setGraphicsEffect(effect)
-            self.parent.console.append("Error connecting to RabbitMQ")
-
-        finally:
-            Thread(target=self.revert_styled_button, args=(self.rabbit_test,)).start()
+        # the values being edited are tested, without saving them to the file
+        self.save(persistent=False)
+        self.setup_rabbit()
+        self.start_health_check('rabbit', self.rabbit_test)
 
     def test_aws_connection(self):
-        try:
-            self.save(persistent=False)
-            self.setup_aws()
-            self.aws.list_buckets()
-            self.aws_test.setStyleSheet("background-color: green; border: 2px solid green;")
-            self.aws_test.setAutoFillBackground(True)
-            effect = QGraphicsDropShadowEffect(self.aws_test)
-            effect.setColor(Qt.green)
-            effect.setOffset(0, 0)
-            effect.setBlurRadius(20)
-            self.aws_test.setGraphicsEffect(effect)
-            self.parent.console.append("Connection to AWS S3/Minio was successfull")
-        except Exception as e:
-            print(e)
-            self.aws_test.setStyleSheet("background-color: red; border: 2px solid red;")
-            self.aws_test.setAutoFillBackground(True)
-            effect = QGraphicsDropShadowEffect(self.aws_test)
-            effect.setColor(Qt.red)
-            effect.setOffset(0, 0)
-            effect.setBlurRadius(20)
-            self.aws_test.setGraphicsEffect(effect)
-            self.parent.console.append("Error connecting to AWS/Minio")
-
-        finally:
-            Thread(target=self.revert_styled_button, args=(self.aws_test,)).start()
+        self.save(persistent=False)
+        self.setup_aws()
+        self.start_health_check('aws', self.aws_test)
 
 
     def add_item(self, list_widget, data):
@@ -378,7 +725,7 @@ class ConfigWindow(QDialog):
 
 
     def update_theme(self):
-        qdarktheme.setup_theme(self.get_selected_theme())
+        setup_theme(self.get_selected_theme())
 
 
     def get_selected_theme(self):
@@ -395,13 +742,15 @@ class ConfigWindow(QDialog):
 
 
     def save(self, persistent=True):
-        data = C.default_config.copy()
+        data = copy.deepcopy(C.default_config)
 
         configurations = data['configurations']
         configurations['console'] = self.checkBox_console.isChecked()
         configurations['rabbit_message_in_console'] = self.cb_rabbit_message_in_console.isChecked()
         configurations['allow_open_input_file'] = self.cb_allow_open_input_file.isChecked()
         configurations['theme'] = self.get_selected_theme()
+        configurations['connect_timeout'] = self.check_connect_timeout.value()
+        configurations['read_timeout'] = self.check_read_timeout.value()
 
         data_variables = data['db']
         data_variables['file_type'] = utils.retrive_list_widget_items(self.listWidget_filetype)
@@ -418,16 +767,39 @@ class ConfigWindow(QDialog):
         rabbit['server']['port'] = self.rabbit_port.toPlainText()
         rabbit['server']['virtual_host'] = self.rabbit_vhost.toPlainText()
         rabbit['rabbit_queue_name'] = utils.retrive_list_widget_items(self.listWidget_rabbitqueues)
+        # edited in the config file only
+        current_rabbit = C.get_rabbit_information()
+        rabbit['track_replies'] = current_rabbit['track_replies']
+        rabbit['reply_timeout'] = current_rabbit['reply_timeout']
 
         aws = data['aws']
         aws['bucket_name'] = self.aws_bucket.toPlainText()
         aws['endpoint_url'] = self.aws_endpoint.toPlainText()
         aws['credentials']['aws_access_key_id'] = self.aws_access.toPlainText()
         aws['credentials']['aws_secret_access_key'] = self.aws_secret.toPlainText()
+        # edited in the config file only
+        aws['replicas'] = C.get_aws_information()['replicas']
+
+        upload = data['upload']
+        upload['multipart_threshold'] = self.upload_threshold.value()
+        upload['multipart_chunksize'] = self.upload_chunksize.value()
+        upload['max_concurrency'] = self.upload_concurrency.value()
+        upload['max_pool_connections'] = self.upload_pool.value()
+        upload['use_threads'] = self.upload_threads.isChecked()
+        upload['abandoned_upload_hours'] = self.upload_abandoned.value()
+        # edited in the config file only
+        upload['sweep_abandoned_uploads'] = C.get_upload_config()['sweep_abandoned_uploads']
+        upload['compression'] = C.get_upload_config()['compression']
+
+        # sections edited by hand only, such as the 'watch' presets of publisher_script.py, are kept
+        for section, value in C.current().config.items():
+            data.setdefault(section, value)
 
         C.write_config(data, persistent=persistent)
 
         if persistent:
+            # cached s3 clients were built with the previous credentials
+            utils.invalidate_s3_clients()
             self.parent.console.append('Configurations saved..')
             self.parent.delete_old_configuration()
             self.parent.apply_configuration()
@@ -444,7 +816,8 @@ class ConfigWindow(QDialog):
 
     def restore_defaults(self):
         self.parent.console.append('Settings restored to default')
-        C.write_config(C.default_config.copy(), persistent=True)
+        C.write_config(copy.deepcopy(C.default_config), persistent=True)
+        utils.invalidate_s3_clients()
         self.close()
 
 
@@ -453,15 +826,20 @@ class AboutWindow(QDialog):
         super().__init__(parent)
 
         self.parent = parent
-        uic.loadUi(os.path.join(BASE_DIR, "resources", "about_window.ui"), self)
+        forms.load_form("about_window", self)
         self.show()
 
 
 def main():
     app = QApplication([])
     app.setWindowIcon(QIcon(os.path.join(BASE_DIR, "resources", "icon.svg")))
-    qdarktheme.setup_theme(C.get_theme())
     window = MainWindow()
+    # the theme is applied right after the window first shows
+    QTimer.singleShot(0, lambda: setup_theme(C.get_theme()))
+
+    # boto3 and pika load in the background once the window is painted,
+    # the first Run does not pay for them and the window does not wait on them
+    QTimer.singleShot(PRELOAD_DELAY_MS, lambda: Thread(target=utils.preload, daemon=True).start())
     app.exec_()
 
 if __name__ == "__main__":
@@ -0,0 +1,404 @@
+"""
+Resumable multipart uploads.
+
+Files above the multipart threshold are uploaded as explicit multipart
+uploads whose upload id and completed part ETags are checkpointed in a small
+JSON file of their own. Uploading the same content to the same object again,
+after a crash or a dropped connection, only sends the parts the server does
+not have yet. Uploads nobody came back for are aborted by `abort_abandoned`.
+
+    store = CheckpointStore(checkpoint_dir)
+    etag = upload(client, path, bucket, key, digest, store, endpoint_url, part_size=8 * MB)
+
+`upload_many` sends the same file to several buckets or endpoints at once,
+every part is read from disk once and uploaded to each of them in its own
+multipart upload. With an `encoding`, the parts are cut from the file
+compressed on the fly by compression.py instead.
+
+The boto3 client is passed in rather than created here.
+"""
+
+import os
+import json
+import math
+import hashlib
+import threading
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+import compression
+
+MB = 1024 * 1024
+
+# S3 limits: parts but the last one are at least 5 MB, and at most 10000 of them
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+
+ABANDONED_AFTER_HOURS = 24
+
+
+class CheckpointStore:
+    """ One JSON file per unfinished upload, named after the object it is for """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+
+    def path(self, endpoint_url, bucket_name, key):
+        name = hashlib.sha1(f'{endpoint_url}|{bucket_name}|{key}'.encode()).hexdigest()
+        return os.path.join(self.checkpoint_dir, f'{name}.json')
+
+    def load(self, endpoint_url, bucket_name, key):
+        try:
+            with open(self.path(endpoint_url, bucket_name, key), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, state):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.path(state['endpoint_url'], state['bucket_name'], state['key'])
+
+        temp_file = f'{path}.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_file, path)
+
+    def remove(self, state):
+        try:
+            os.remove(self.path(state['endpoint_url'], state['bucket_name'], state['key']))
+        except OSError:
+            pass
+
+    def states(self):
+        try:
+            names = os.listdir(self.checkpoint_dir)
+        except OSError:
+            return
+
+        for name in names:
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.checkpoint_dir, name), 'r') as file:
+                        yield json.load(file)
+                except (OSError, ValueError):
+                    continue
+
+
+def part_size_for(size, chunksize):
+    return max(chunksize, MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+
+
+def uploaded_parts(client, state):
+    """ {part number: etag} of the parts the server holds, None when the upload is gone """
+
+    size, part_size = state['size'], state['part_size']
+    parts = {}
+
+    try:
+        pages = client.get_paginator('list_parts').paginate(
+                Bucket=state['bucket_name'], Key=state['key'], UploadId=state['upload_id']
+            )
+        for page in pages:
+            for part in page.get('Parts', []):
+                number = part['PartNumber']
+                # a part cut short by the dropped connection is sent again. The size of
+                # the compressed file is not known ahead, its last part is always sent again
+                expected = part_size if state.get('encoding') else min(part_size, size - (number - 1) * part_size)
+                if part['Size'] == expected:
+                    parts[str(number)] = part['ETag']
+    except client.exceptions.ClientError:
+        return None
+
+    return parts
+
+
+def upload(client, local_file_path, bucket_name, key, digest, store, endpoint_url,
+           part_size, max_concurrency=10, metadata=None, callback=None, encoding=None):
+    """ Uploads the file in parts, resuming what an earlier attempt left behind. Returns the ETag """
+
+    result, = upload_many(
+            [(client, bucket_name, key, endpoint_url)], local_file_path, digest, store,
+            part_size, max_concurrency, metadata, callback, encoding
+        )
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def resumable_state(client, bucket_name, key, digest, size, store, endpoint_url, encoding=None):
+    """ The checkpoint of an earlier attempt with the parts the server holds, None when there is nothing to resume """
+
+    state = store.load(endpoint_url, bucket_name, key)
+    if state and (state['digest'] != digest or state['size'] != size or state.get('encoding') != encoding):
+        # the file, or how it is compressed, changed since, what was uploaded of it is of no use
+        abort(client, state, store)
+        return None
+
+    if state:
+        parts = uploaded_parts(client, state)
+        if parts is None:
+            store.remove(state)
+            return None
+        state['parts'] = parts
+
+    return state
+
+
+def upload_many(targets, local_file_path, digest, store, part_size,
+                max_concurrency=10, metadata=None, callback=None, encoding=None):
+    """ Uploads the file in parts to every (client, bucket name, key, endpoint url) target,
+        reading each part once for all of them. A target that fails does not stop the others,
+        returns the ETag, or the exception, of every target """
+
+    size = os.path.getsize(local_file_path)
+    results = [None] * len(targets)
+
+    states = [
+            resumable_state(client, bucket_name, key, digest, size, store, endpoint_url, encoding)
+            for client, bucket_name, key, endpoint_url in targets
+        ]
+
+    # a part read once is sent to every target, which all have to cut the file the same
+    part_size = next((state['part_size'] for state in states if state), part_size_for(size, part_size))
+
+    for index, (client, bucket_name, key, endpoint_url) in enumerate(targets):
+        if states[index] and states[index]['part_size'] != part_size:
+            abort(client, states[index], store)
+            states[index] = None
+        if states[index]:
+            continue
+
+        try:
+            created = client.create_multipart_upload(
+                    Bucket=bucket_name, Key=key, Metadata=metadata or {},
+                    **({'ContentEncoding': encoding} if encoding else {})
+                )
+        except Exception as e:
+            results[index] = e
+            continue
+
+        states[index] = dict(
+                endpoint_url = endpoint_url,
+                bucket_name = bucket_name,
+                key = key,
+                upload_id = created['UploadId'],
+                digest = digest,
+                size = size,
+                part_size = part_size,
+                encoding = encoding,
+                started = time(),
+                parts = {}
+            )
+        store.save(states[index])
+
+    live = [index for index in range(len(targets)) if results[index] is None]
+    if encoding:
+        return upload_stream(
+                targets, states, results, live, local_file_path, store, part_size,
+                max_concurrency, callback, encoding
+            )
+
+    count = max(1, math.ceil(size / part_size))
+    part_length = lambda number: min(part_size, size - (number - 1) * part_size)
+
+    # part by part, so that a part is done with on every target before the next ones are read
+    missing = [
+            (number, index) for number in range(1, count + 1)
+            for index in live if str(number) not in states[index]['parts']
+        ]
+
+    # progress is of the file, every target counts for its share of it
+    if callback and live and len(missing) < count * len(live):
+        callback((size * len(live) - sum(part_length(number) for number, _ in missing)) / len(targets))
+
+    lock = threading.Lock()
+    # part number: [lock, data or None, targets still to send it to]
+    buffers = {}
+    for number, _ in missing:
+        buffers.setdefault(number, [threading.Lock(), None, 0])[2] += 1
+
+    def part_data(number):
+        buffer = buffers[number]
+        with buffer[0]:
+            if buffer[1] is None:
+                with open(local_file_path, 'rb') as file:
+                    file.seek((number - 1) * part_size)
+                    buffer[1] = file.read(part_size)
+        return buffer[1]
+
+    def release(number):
+        with lock:
+            buffers[number][2] -= 1
+            if not buffers[number][2]:
+                buffers[number][1] = None
+
+    def upload_part(number, index):
+        client, bucket_name, key, _ = targets[index]
+        state = states[index]
+
+        try:
+            # the rest of the parts of a failed target are not sent
+            if results[index] is not None:
+                return
+
+            data = part_data(number)
+            etag = client.upload_part(
+                    Bucket=bucket_name, Key=key, UploadId=state['upload_id'],
+                    PartNumber=number, Body=data
+                )['ETag']
+        except Exception as e:
+            with lock:
+                results[index] = results[index] or e
+            return
+        finally:
+            release(number)
+
+        with lock:
+            state['parts'][str(number)] = etag
+            store.save(state)
+
+        if callback:
+            callback(len(data) / len(targets))
+
+    # every target has up to `max_concurrency` parts in flight, the parts in
+    # flight are shared, about `max_concurrency` of them are held in memory
+    with ThreadPoolExecutor(max(1, max_concurrency) * max(1, len(live))) as pool:
+        for future in [pool.submit(upload_part, number, index) for number, index in missing]:
+            future.result()
+
+        live = [index for index in live if results[index] is None]
+        for future in [pool.submit(complete, targets, states, results, store, index, count) for index in live]:
+            future.result()
+
+    return results
+
+
+def upload_stream(targets, states, results, live, local_file_path, store, part_size,
+                  max_concurrency, callback, encoding):
+    """ The parts of upload_many for a file compressed as it is read. The parts are only
+        known in order, every one is compressed once and sent to every target while the
+        next ones are, with at most `max_concurrency` of them held in memory """
+
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(max(1, max_concurrency))
+    # part number: targets still to send it to, the part is let go of after the last one
+    sending = {}
+
+    def upload_part(number, data, raw, index):
+        client, bucket_name, key, _ = targets[index]
+        state = states[index]
+
+        try:
+            # the rest of the parts of a failed target are not sent
+            if results[index] is not None:
+                return
+
+            etag = client.upload_part(
+                    Bucket=bucket_name, Key=key, UploadId=state['upload_id'],
+                    PartNumber=number, Body=data
+                )['ETag']
+        except Exception as e:
+            with lock:
+                results[index] = results[index] or e
+            return
+        finally:
+            with lock:
+                sending[number] -= 1
+                if not sending[number]:
+                    del sending[number]
+                    in_flight.release()
+
+        with lock:
+            state['parts'][str(number)] = etag
+            store.save(state)
+
+        if callback:
+            callback(raw / len(targets))
+
+    count = 0
+    with ThreadPoolExecutor(max(1, max_concurrency) * max(1, len(live))) as pool:
+        futures = []
+        for count, (data, raw) in enumerate(compression.chunks(local_file_path, encoding, part_size), 1):
+            if not any(results[index] is None for index in live):
+                break
+
+            # a resumed upload compresses the parts the server holds again, without sending them
+            pending = [
+                    index for index in live
+                    if str(count) not in states[index]['parts'] or len(data) < part_size
+                ]
+            if callback and len(pending) < len(live):
+                callback(raw * (len(live) - len(pending)) / len(targets))
+            if not pending:
+                continue
+
+            in_flight.acquire()
+            sending[count] = len(pending)
+            futures.extend(pool.submit(upload_part, count, data, raw, index) for index in pending)
+
+        for future in futures:
+            future.result()
+
+        live = [index for index in live if results[index] is None]
+        for future in [pool.submit(complete, targets, states, results, store, index, count) for index in live]:
+            future.result()
+
+    return results
+
+
+def complete(targets, states, results, store, index, count):
+    client, bucket_name, key, _ = targets[index]
+    state = states[index]
+
+    try:
+        completed = client.complete_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=state['upload_id'],
+                MultipartUpload={'Parts': [
+                    {'ETag': state['parts'][str(number)], 'PartNumber': number}
+                    for number in range(1, count + 1)
+                ]}
+            )
+    except Exception as e:
+        results[index] = e
+        return
+
+    store.remove(state)
+    results[index] = completed['ETag']
+
+
+def abort(client, state, store):
+    try:
+        client.abort_multipart_upload(Bucket=state['bucket_name'], Key=state['key'], UploadId=state['upload_id'])
+    except client.exceptions.ClientError:
+        pass
+    store.remove(state)
+
+
+def abort_abandoned(client, bucket_name, store, endpoint_url, hours=ABANDONED_AFTER_HOURS, prefix='', sweep=False):
+    """ Aborts the multipart uploads under `prefix` this machine started over `hours` ago and
+        never completed, as its checkpoints record them. Returns how many were aborted.
+
+        With `sweep`, every upload of the bucket under `prefix` that old is aborted as well,
+        other clients' included, which is why it takes a prefix that is not empty """
+
+    if sweep and not prefix:
+        raise ValueError("Sweeping abandoned multipart uploads takes a prefix, not the whole bucket")
+
+    cutoff = time() - hours * 3600
+    aborted = set()
+
+    for state in store.states():
+        if (state['endpoint_url'], state['bucket_name']) == (endpoint_url, bucket_name) \
+                and state['key'].startswith(prefix) and state['started'] < cutoff:
+            abort(client, state, store)
+            aborted.add(state['upload_id'])
+
+    if sweep:
+        pages = client.get_paginator('list_multipart_uploads').paginate(Bucket=bucket_name, Prefix=prefix)
+        for page in pages:
+            for upload in page.get('Uploads', []):
+                if upload['Initiated'].timestamp() < cutoff and upload['UploadId'] not in aborted:
+                    client.abort_multipart_upload(Bucket=bucket_name, Key=upload['Key'], UploadId=upload['UploadId'])
+                    aborted.add(upload['UploadId'])
+
+    return len(aborted)
@@ -0,0 +1,174 @@
+"""
+Messages on their way to RabbitMQ, kept in SQLite until the broker confirms
+them. A message whose file is already uploaded survives a broker outage, a
+dead channel or a crash, and goes out with the next batch drained from here
+instead of the whole job being run (and its files uploaded) again.
+
+    box = Outbox(outbox_file)
+    ids = box.add_many(server, queue_name, db_name, bodies)
+    box.settle(ids, publish(bodies))          # one ack boolean per body
+    box.drain(server, publish_batch)          # on the next run
+
+Every message is inserted before it is published and only marked once it is
+confirmed, so delivery is at least once. The database is in WAL mode with
+synchronous=NORMAL: a crash of the program loses nothing, a power cut can
+lose the last few inserts.
+"""
+
+import os
+import sqlite3
+import threading
+from time import time
+
+DRAIN_BATCH_SIZE = 500
+
+# confirmed messages are kept this long for reference, then deleted
+KEEP_CONFIRMED = 7 * 24 * 3600
+
+# sqlite limits the number of parameters of a statement
+SQL_CHUNK = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server TEXT NOT NULL,
+    queue_name TEXT NOT NULL,
+    db_name TEXT,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    confirmed REAL
+);
+CREATE INDEX IF NOT EXISTS pending_messages ON messages (server, confirmed, id);
+'''
+
+
+def server_key(server_config):
+    """ Messages are drained to the server they were meant for, identified by this """
+
+    return '{host}:{port}/{virtual_host}'.format(**server_config)
+
+
+class OutboxMessage:
+    __slots__ = ('id', 'queue_name', 'db_name', 'body', 'attempts')
+
+    def __init__(self, id, queue_name, db_name, body, attempts):
+        self.id = id
+        self.queue_name = queue_name
+        self.db_name = db_name
+        self.body = body
+        self.attempts = attempts
+
+
+class Outbox:
+
+    def __init__(self, outbox_file):
+        self.outbox_file = outbox_file
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.outbox_file), exist_ok=True)
+
+            db = sqlite3.connect(self.outbox_file, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            db.execute('DELETE FROM messages WHERE confirmed < ?', (time() - KEEP_CONFIRMED,))
+            self.db = db
+
+        return self.db
+
+    def add_many(self, server, queue_name, db_name, bodies):
+        """ Records the messages before they are published, returns their ids """
+
+        with self.lock:
+            db = self.connect()
+            db.execute('BEGIN')
+            try:
+                ids = [
+                        db.execute(
+                            'INSERT INTO messages (server, queue_name, db_name, body, created) VALUES (?, ?, ?, ?, ?)',
+                            (server, queue_name, db_name, body, time())
+                        ).lastrowid
+                        for body in bodies
+                    ]
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+        return ids
+
+    def add(self, server, queue_name, db_name, body):
+        return self.add_many(server, queue_name, db_name, [body])[0]
+
+    def update(self, statement, ids, *parameters):
+        ids = list(ids)
+        with self.lock:
+            db = self.connect()
+            for start in range(0, len(ids), SQL_CHUNK):
+                chunk = ids[start:start + SQL_CHUNK]
+                db.execute(statement.format(', '.join('?' * len(chunk))), (*parameters, *chunk))
+
+    def confirm(self, ids):
+        self.update('UPDATE messages SET confirmed = ? WHERE id IN ({})', ids, time())
+
+    def failed(self, ids):
+        self.update('UPDATE messages SET attempts = attempts + 1 WHERE id IN ({})', ids)
+
+    def settle(self, ids, acked):
+        """ Marks the acked messages confirmed, the others stay pending for the next drain """
+
+        self.confirm(id for id, ok in zip(ids, acked) if ok)
+        self.failed(id for id, ok in zip(ids, acked) if not ok)
+
+    def pending(self, server, limit=DRAIN_BATCH_SIZE, after=0):
+        with self.lock:
+            rows = self.connect().execute(
+                    'SELECT id, queue_name, db_name, body, attempts FROM messages '
+                    'WHERE server = ? AND confirmed IS NULL AND id > ? ORDER BY id LIMIT ?',
+                    (server, after, limit)
+                ).fetchall()
+        return [OutboxMessage(*row) for row in rows]
+
+    def count(self, server=None):
+        if self.db is None and not os.path.exists(self.outbox_file):
+            return 0
+
+        query = 'SELECT COUNT(*) FROM messages WHERE confirmed IS NULL'
+        parameters = ()
+        if server is not None:
+            query += ' AND server = ?'
+            parameters = (server,)
+
+        with self.lock:
+            return self.connect().execute(query, parameters).fetchone()[0]
+
+    def drain(self, server, publish, batch_size=DRAIN_BATCH_SIZE):
+        """
+        Publishes the pending messages of `server` oldest first, in batches.
+        `publish(queue_name, db_name, bodies)` returns one ack boolean per body.
+        Nacked messages stay pending, an exception stops the drain with the
+        messages confirmed so far marked. Returns (published, still pending).
+        """
+
+        published, after = 0, 0
+
+        while True:
+            batch = self.pending(server, batch_size, after)
+            if not batch:
+                break
+            after = batch[-1].id
+
+            groups = {}
+            for message in batch:
+                groups.setdefault((message.queue_name, message.db_name), []).append(message)
+
+            for (queue_name, db_name), messages in groups.items():
+                acked = publish(queue_name, db_name, [message.body for message in messages])
+                self.settle([message.id for message in messages], acked)
+                published += sum(acked)
+
+        return published, self.count(server)
@@ -0,0 +1,174 @@
+"""
+Upload -> publish pipeline shared by main.py and publisher_script.py.
+
+A pool of upload workers feeds a bounded queue that a single publisher
+drains, so every message goes out as soon as its file is uploaded while
+the broker connection is only ever used from one thread. When publishing
+falls behind, the workers block on the full queue instead of uploading
+further ahead. Every job carries a `tracing.Trace`, active on whichever
+thread is uploading or publishing it.
+
+    pipeline = Pipeline(upload, publish, workers=4)
+    stats = pipeline.run([PipelineJob(path, message) for path, message in files])
+    print(stats.summary())
+
+`stream` takes the jobs from an iterator instead, for as long as it yields
+them, never reading more than `backlog` of them ahead of the uploads.
+"""
+
+import os
+import queue
+import threading
+from time import perf_counter
+
+import tracing
+
+DEFAULT_WORKERS = 4
+
+
+class PipelineJob:
+    __slots__ = (
+            'local_file_path', 'message', 'size', 'uploaded', 'error', 'stage',
+            'upload_time', 'queue_time', 'publish_time', 'uploaded_at', 'trace'
+        )
+
+    def __init__(self, local_file_path, message):
+        self.local_file_path = local_file_path
+        self.message = message
+        # a file moved or deleted since it was listed fails its upload instead
+        try:
+            self.size = os.path.getsize(local_file_path)
+        except OSError:
+            self.size = 0
+
+        self.uploaded = False
+        self.error = None
+        self.stage = None
+
+        self.upload_time = 0.0
+        self.queue_time = 0.0
+        self.publish_time = 0.0
+        self.uploaded_at = 0.0
+
+        self.trace = tracing.Trace(local_file_path)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class PipelineStats:
+
+    def __init__(self, jobs, wall_time):
+        self.jobs = jobs
+        self.wall_time = wall_time
+
+        self.failures = sum(not job.ok for job in jobs)
+        self.uploaded_bytes = sum(job.size for job in jobs if job.ok and job.uploaded)
+        self.upload_time = sum(job.upload_time for job in jobs)
+        self.queue_time = sum(job.queue_time for job in jobs)
+        self.publish_time = sum(job.publish_time for job in jobs)
+
+    def summary(self):
+        return (
+                f"wall {self.wall_time:.2f}s | upload {self.upload_time:.2f}s "
+                f"(summed over workers) | waiting for publisher {self.queue_time:.2f}s "
+                f"| publish {self.publish_time:.2f}s"
+            )
+
+
+class Pipeline:
+    """
+    `upload(job)` runs on the worker threads and returns whether the file was
+    actually uploaded, `publish(job)` and `on_result(job)` run on the thread
+    calling `run`. A job whose upload raised is reported without publishing.
+    """
+
+    def __init__(self, upload, publish, workers=DEFAULT_WORKERS, backlog=None, on_result=None):
+        self.upload = upload
+        self.publish = publish
+        self.workers = max(1, workers)
+        self.backlog = backlog or self.workers * 2
+        self.on_result = on_result
+
+    def upload_worker(self, pending, uploaded):
+        while True:
+            job = pending.get()
+            if job is None:
+                uploaded.put(None)
+                return
+
+            started = perf_counter()
+            try:
+                with tracing.activate(job.trace):
+                    job.uploaded = self.upload(job)
+            except Exception as e:
+                job.error, job.stage = e, 'upload'
+            job.uploaded_at = perf_counter()
+            job.upload_time = job.uploaded_at - started
+
+            # blocks while the publisher is `backlog` files behind
+            uploaded.put(job)
+
+    def feed(self, jobs, pending, workers, errors):
+        try:
+            for job in jobs:
+                # blocks while `backlog` jobs wait for an upload worker
+                pending.put(job)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                pending.put(None)
+
+    def stream(self, jobs, workers=None):
+        """ Runs the jobs as `jobs` yields them, returns how many ran once it is exhausted
+            and every job taken from it is reported. What the iterator raises is raised then """
+
+        workers = self.workers if workers is None else workers
+        pending = queue.Queue(maxsize=self.backlog)
+        uploaded = queue.Queue(maxsize=self.backlog)
+        errors = []
+
+        threads = [
+                threading.Thread(target=self.upload_worker, args=(pending, uploaded), daemon=True)
+                for _ in range(workers)
+            ]
+        threads.append(threading.Thread(target=self.feed, args=(jobs, pending, workers, errors), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        count, running = 0, workers
+        while running:
+            job = uploaded.get()
+            if job is None:
+                running -= 1
+                continue
+
+            job.queue_time = perf_counter() - job.uploaded_at
+            job.trace.add('queue', job.queue_time)
+
+            if job.ok:
+                publish_started = perf_counter()
+                try:
+                    with tracing.activate(job.trace):
+                        self.publish(job)
+                except Exception as e:
+                    job.error, job.stage = e, 'publish'
+                job.publish_time = perf_counter() - publish_started
+
+            if self.on_result:
+                self.on_result(job)
+            count += 1
+
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return count
+
+    def run(self, jobs):
+        started = perf_counter()
+        self.stream(jobs, min(self.workers, len(jobs)))
+        return PipelineStats(jobs, perf_counter() - started)
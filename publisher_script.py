@@ -2,7 +2,11 @@
                             NOTE
 
 This used functions from the pwc repo so this should be
-placed into the repo directory to be used as a publisher.
+placed into the repo directory to be used as a publisher,
+along with hashcache.py, pipeline.py, tracing.py, outbox.py,
+multipart.py, watcher.py, loadgen.py, replies.py and compression.py
+from this kit. Those modules only need the standard library, so
+that they run there without the kit's own requirements.
 
 
 """
@@ -10,19 +14,53 @@ placed into the repo directory to be used as a publisher.
 import re
 import os
 import sys
+import csv
+import glob
 import json
+import signal
+import itertools
+import threading
+from time import perf_counter, monotonic
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, REMAINDER
 
-import pika
-import boto3
-
+# pika and boto3 are imported by RabbitMQ and AWS when they are used, so that
+# argument errors and invalid paths exit without loading them
+
+import outbox
+import tracing
+import hashcache
+import multipart
+import watcher
+import loadgen
+import replies
+import compression
+from pipeline import Pipeline, PipelineJob, DEFAULT_WORKERS
 from config import config
 from constants.constant import RABBITMQ_QUEUE_NAME
 
+UPLOAD_CACHE_FILE = os.path.expanduser('~/.config/ctadel/upload_cache.json')
+RUN_LOG_FILE = os.path.expanduser('~/.config/ctadel/runs.jsonl')
+OUTBOX_FILE = os.path.expanduser('~/.config/ctadel/publisher_outbox.sqlite3')
+MULTIPART_CHECKPOINT_DIR = os.path.expanduser('~/.config/ctadel/multipart')
+# the presets of --watch and the brokers of `-Q queue@profile` are read from
+# the 'watch' and 'rabbit_profiles' sections of the kit's config
+KIT_CONFIG_FILE = os.path.expanduser('~/.config/ctadel/config.yaml')
+
+# --show reads this much of a CSV/TXT file to guess its delimiter, and cuts
+# every previewed cell to this width
+PREVIEW_SAMPLE_SIZE = 64 * 1024
+PREVIEW_CELL_WIDTH = 24
+
 def setup_parser(parser:ArgumentParser):
     parser.add_argument(
-            'file_name', type=str, action='store',
-            help="Location of the file that is to be uploaded and published."
+            'file_name', type=str, nargs='*', action='store',
+            help="Files, directories or glob patterns that are to be uploaded and published."
+        )
+
+    parser.add_argument(
+            '--from-manifest', dest='manifest', action='store', default='',
+            help="JSONL/CSV file listing a 'file_name' per entry plus per-file message overrides"
         )
 
     parser.add_argument(
@@ -36,8 +74,13 @@ def setup_parser(parser:ArgumentParser):
         )
 
     parser.add_argument(
-            '-T', '--file_type', action='store', required=True,
-            help="'file_type' value in the to be published message"
+            '--show-rows', type=int, action='store', default=10,
+            help="Number of rows --show prints of every file"
+        )
+
+    parser.add_argument(
+            '-T', '--file_type', action='store', default=None,
+            help="'file_type' value in the to be published message, required unless --watch presets set it"
         )
 
     parser.add_argument(
@@ -79,6 +122,135 @@ def setup_parser(parser:ArgumentParser):
             help="The loadType value for the message"
         )
 
+    parser.add_argument(
+            '-Q', '--queue', dest='queues', action='append', default=None,
+            help="Queue to publish to, repeat it to publish every message to several queues at once. "
+                 "'queue@profile' is the queue on a broker of the 'rabbit_profiles' of the kit's config"
+        )
+
+    parser.add_argument(
+            '-W', '--workers', type=int, action='store', default=DEFAULT_WORKERS,
+            help="Number of files uploaded at the same time"
+        )
+
+    parser.add_argument(
+            '--force-upload', action='store_true', default=False,
+            help="Upload the files even if the bucket already holds the same content"
+        )
+
+    parser.add_argument(
+            '--multipart-threshold', type=int, action='store',
+            default=getattr(config, 'AWS_MULTIPART_THRESHOLD', 8),
+            help="Size in MB above which files are uploaded in parts"
+        )
+
+    parser.add_argument(
+            '--multipart-chunksize', type=int, action='store',
+            default=getattr(config, 'AWS_MULTIPART_CHUNKSIZE', 8),
+            help="Size in MB of every part of a multipart upload"
+        )
+
+    parser.add_argument(
+            '--max-concurrency', type=int, action='store',
+            default=getattr(config, 'AWS_MAX_CONCURRENCY', 10),
+            help="Number of parts uploaded at the same time"
+        )
+
+    parser.add_argument(
+            '--no-threads', action='store_true', default=False,
+            help="Upload the parts one after another on the main thread"
+        )
+
+    parser.add_argument(
+            '--abandoned-upload-hours', type=float, action='store',
+            default=getattr(config, 'AWS_ABANDONED_UPLOAD_HOURS', multipart.ABANDONED_AFTER_HOURS),
+            help="Abort the unfinished multipart uploads older than this instead of resuming them"
+        )
+
+    parser.add_argument(
+            '--sweep-abandoned-uploads', action='store_true', default=False,
+            help="Also abort other clients' unfinished multipart uploads that old in the folder, "
+                 "never in a whole bucket"
+        )
+
+    parser.add_argument(
+            '--compress', choices=('none', *compression.CODECS), action='store', default=None,
+            help="Compress every file on upload with this codec, by default as the compression "
+                 "rules of the upload section of the kit's config say"
+        )
+
+    parser.add_argument(
+            '--trace', action='store_true', default=False,
+            help="Print how long every stage of every file took"
+        )
+
+    parser.add_argument(
+            '--watch', metavar='DIR', action='store', default='',
+            help="Keep running, uploading and publishing every file written into DIR or its sub-directories"
+        )
+
+    parser.add_argument(
+            '--watch-existing', action='store_true', default=False,
+            help="With --watch, also send the files already in DIR when it starts"
+        )
+
+    parser.add_argument(
+            '--poll', action='store_true', default=False,
+            help="With --watch, scan DIR periodically instead of relying on inotify"
+        )
+
+    parser.add_argument(
+            '--settle-seconds', type=float, action='store', default=None,
+            help="With --watch, how long a file must stay unchanged before it is sent"
+        )
+
+    parser.add_argument(
+            '--backlog', type=int, action='store', default=None,
+            help="With --watch, number of files queued ahead of the uploads before new ones wait on disk"
+        )
+
+    parser.add_argument(
+            '--load-test', metavar='N', type=int, action='store', default=0,
+            help="Upload the one file given once, then publish N messages for it to load test the consumers. "
+                 "load_id counts up from -L, {n} and {load_id} in the other values are filled in per message. "
+                 "The messages are not kept in the outbox, one that fails is not sent again"
+        )
+
+    parser.add_argument(
+            '--rate', type=float, action='store', default=10.0,
+            help="With --load-test, messages published per second once the ramp-up is over"
+        )
+
+    parser.add_argument(
+            '--ramp-up', metavar='SECONDS', type=float, action='store', default=0.0,
+            help="With --load-test, how long the rate takes to rise to --rate"
+        )
+
+    parser.add_argument(
+            '--ramp-profile', choices=loadgen.RAMP_PROFILES, action='store', default='linear',
+            help="With --load-test, how the rate rises during --ramp-up"
+        )
+
+    parser.add_argument(
+            '--burst', type=int, action='store', default=None,
+            help="With --load-test, messages published at once after a stall, one second worth of them by default"
+        )
+
+    parser.add_argument(
+            '--report-interval', metavar='SECONDS', type=float, action='store', default=1.0,
+            help="With --load-test, how often the achieved rate and the latencies are printed"
+        )
+
+    parser.add_argument(
+            '--track-replies', action='store_true', default=False,
+            help="Ask the consumer to reply to every message and report the round trip latencies"
+        )
+
+    parser.add_argument(
+            '--reply-timeout', metavar='SECONDS', type=float, action='store', default=replies.DEFAULT_REPLY_TIMEOUT,
+            help="With --track-replies, how long to wait for the replies once everything is published"
+        )
+
     parser.add_argument(
             '-X', '--debug', action='store_true', default=False,
             help="Passing this argument will add a breakpoint in the script"
@@ -101,86 +273,394 @@ def process_parser_args(args):
         else:
             print(f"**Argument {arg} is invalid and was ignored**")
 
+    # every message gets a correlation_id of its own when it is built
+    if data['track_replies']:
+        data['reply_to'] = replies.reply_queue_name()
+
     # these are not the part of actual message but were
     # only used in parser arguements, hence we delete
     del data['silent']
     del data['show']
+    del data['show_rows']
     del data['debug']
+    del data['manifest']
+    del data['force_upload']
+    del data['workers']
+    del data['queues']
+    del data['multipart_threshold']
+    del data['multipart_chunksize']
+    del data['max_concurrency']
+    del data['no_threads']
+    del data['abandoned_upload_hours']
+    del data['sweep_abandoned_uploads']
+    del data['compress']
+    del data['watch']
+    del data['watch_existing']
+    del data['poll']
+    del data['settle_seconds']
+    del data['backlog']
+    del data['load_test']
+    del data['rate']
+    del data['ramp_up']
+    del data['ramp_profile']
+    del data['burst']
+    del data['report_interval']
+    del data['track_replies']
+    del data['reply_timeout']
+    del data['trace']
 
     return data
 
 
 class RabbitMQ:
-    def __init__(self):
-        self.username = config.RABBITMQ_USERNAME
-        self.password = config.RABBITMQ_PASSWORD
-        self.queue_name = RABBITMQ_QUEUE_NAME
+    def __init__(self, queue_name=RABBITMQ_QUEUE_NAME, profile=None, message_outbox=None):
+        # a profile of the kit's config overrides the server and credentials of the pwc config
+        profile = profile or {}
+        credentials = profile.get('credentials') or {}
+        server = profile.get('server') or {}
+
+        self.username = credentials.get('username', config.RABBITMQ_USERNAME)
+        self.password = credentials.get('password', config.RABBITMQ_PASSWORD)
+        self.queue_name = queue_name
 
         self.server_config = dict(
-                host = config.RABBITMQ_HOST,
-                port = config.RABBITMQ_PORT,
-                virtual_host = config.RABBITMQ_VIRTUAL_HOST,
+                host = server.get('host', config.RABBITMQ_HOST),
+                port = server.get('port', config.RABBITMQ_PORT),
+                virtual_host = server.get('virtual_host', config.RABBITMQ_VIRTUAL_HOST),
             )
 
         self.mongo_db = config.MONGO_DB
         self.connection = None
 
-    def get_connection(self):
+        # every message is kept here until the broker confirms it, None keeps none
+        self.outbox = message_outbox
+        self.server_key = outbox.server_key(self.server_config)
+
+    def parameters(self):
+        import pika
+
         credentials = pika.PlainCredentials(username=self.username, password=self.password)
-        parameters = pika.ConnectionParameters(**self.server_config, credentials=credentials)
+        return pika.ConnectionParameters(**self.server_config, credentials=credentials)
+
+    def get_connection(self):
+        import pika
 
-        connection = pika.BlockingConnection(parameters)
-        channel = connection.channel()
-        channel.queue_declare(queue=self.queue_name, durable=True)
+        with tracing.span('amqp_connect'):
+            try:
+                connection = pika.BlockingConnection(self.parameters())
+            except pika.exceptions.AMQPConnectionError as e:
+                server = f"{self.server_config['host']}:{self.server_config['port']}"
+                raise ConnectionError(f"Could not connect to the rabbit server {server}") from e
+            channel = connection.channel()
+            channel.confirm_delivery()
+
+        with tracing.span('queue_declare', queue=self.queue_name):
+            channel.queue_declare(queue=self.queue_name, durable=True)
 
         return channel
 
-    def publish(self, message:dict):
+    def send(self, queue_name, db_name, body):
+        """ Publishes and waits for the broker to confirm, returns False when it nacks """
 
-        if not self.connection:
+        import pika
+
+        if not self.connection or self.connection.is_closed:
             self.connection = self.get_connection()
 
-        self.connection.basic_publish(
-            exchange    =   '',
-            routing_key =   self.queue_name,
-            body        =   json.dumps(message),
+        for attempt in range(2):
+            try:
+                self.connection.basic_publish(
+                    exchange    =   '',
+                    routing_key =   queue_name,
+                    body        =   body,
+
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,  # make message persistent
+                        headers={'db_name': db_name},
+                        **replies.body_reply_properties(body)
+                    ))
+                return True
+            except pika.exceptions.NackError:
+                return False
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                # the broker drops connections left idle between the files of --watch
+                if attempt:
+                    raise
+                self.connection = self.get_connection()
 
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-                headers={'db_name': self.mongo_db}
-            ))
+    def publish(self, message:dict):
+        self.publish_body(json.dumps(message))
+
+    def publish_body(self, body):
+        if self.outbox is None:
+            with tracing.span('publish'):
+                acked = self.send(self.queue_name, self.mongo_db, body)
+        else:
+            message_id = self.outbox.add(self.server_key, self.queue_name, self.mongo_db, body)
+            with tracing.span('publish'):
+                acked = self.send(self.queue_name, self.mongo_db, body)
+            self.outbox.settle([message_id], [acked])
+
+        if not acked:
+            raise ConnectionError("Message was not confirmed by the Rabbit server")
+
+    def flush_outbox(self):
+        """ Publishes what earlier runs left in the outbox, returns (published, still pending) """
+
+        if self.outbox is None:
+            return 0, 0
+
+        def publish(queue_name, db_name, bodies):
+            return [self.send(queue_name, db_name, body) for body in bodies]
+
+        return self.outbox.drain(self.server_key, publish)
 
     def __enter__(self):
-        self.connection = self.get_connection()
+        # the connection is opened by the first publish, a broker that is down
+        # then only fails the publishes and their messages stay in the outbox
         return self
 
     def __exit__(self, *_):
-        self.connection.close()
+        if self.connection and self.connection.is_open:
+            self.connection.close()
+
+
+class FanOut:
+    """ Publishes every message to each queue of `-Q`, the same serialized body over a
+        connection per queue and all at the same time. The time each broker took to
+        confirm is added to the file's trace as 'confirm:<queue>'. With `reply_to`, the
+        replies of the consumers on every server are listened for """
+
+    def __init__(self, queues, profiles, reply_to=None, outboxed=True):
+        # the messages of a load test are not kept, they would go out again
+        # to the real queue with the next run
+        message_outbox = outbox.Outbox(OUTBOX_FILE) if outboxed else None
+
+        self.targets = []
+        for name in dict.fromkeys(queues):
+            queue_name, at, profile_name = name.rpartition('@')
+            if not at:
+                queue_name, profile_name = name, None
+            elif profile_name not in profiles:
+                raise ValueError(f"No rabbit profile named {profile_name!r} in {KIT_CONFIG_FILE} for the queue {name!r}")
+
+            profile = profiles.get(profile_name) if profile_name else None
+            self.targets.append((name, RabbitMQ(queue_name, profile, message_outbox)))
+
+        self.outbox = message_outbox
+        self.pool = None
+
+        self.reply_to = reply_to
+        self.tracker = replies.ReplyTracker()
+        self.listeners = []
+        # why the replies could not be listened for, the messages are published anyway
+        self.replies_error = None
+        # correlation ids of the messages every target confirmed
+        self.tracked = []
+
+    def pending(self):
+        if self.outbox is None:
+            return 0
+        server_keys = dict.fromkeys(rmq.server_key for _, rmq in self.targets)
+        return sum(self.outbox.count(server_key) for server_key in server_keys)
 
+    def publish(self, message:dict):
+        body = json.dumps(message)
+        trace = tracing.current()
+
+        correlation_id = message.get('correlation_id')
+        if correlation_id:
+            self.tracker.published(correlation_id, message['file_name'])
+
+        def publish(target):
+            name, rmq = target
+            started = perf_counter()
+            try:
+                with tracing.activate(trace):
+                    rmq.publish_body(body)
+            except Exception as e:
+                return f"{name}: {e}"
+
+            if trace is not None:
+                trace.add(f'confirm:{name}', perf_counter() - started, started, queue=rmq.queue_name)
+
+        targets = self.pool.map(publish, self.targets) if self.pool else map(publish, self.targets)
+        errors = [error for error in targets if error]
+        if errors:
+            raise ConnectionError('; '.join(errors))
+
+        if correlation_id and self.listeners:
+            self.tracked.append(correlation_id)
+
+    def flush_outbox(self):
+        """ Publishes what earlier runs left in the outbox for every server, returns (published, still pending) """
+
+        flushed = {}
+        for _, rmq in self.targets:
+            if rmq.server_key not in flushed:
+                flushed[rmq.server_key] = rmq.flush_outbox()
+        return tuple(map(sum, zip(*flushed.values())))
 
-class AWS:
+    def __enter__(self):
+        try:
+            for _, rmq in self.targets:
+                rmq.__enter__()
+        except Exception:
+            self.__exit__()
+            raise
+        if len(self.targets) > 1:
+            self.pool = ThreadPoolExecutor(len(self.targets))
+
+        if self.reply_to:
+            servers = {rmq.server_key: rmq for _, rmq in self.targets}
+            try:
+                with tracing.span('replies'):
+                    for rmq in servers.values():
+                        self.listeners.append(
+                                replies.ReplyListener(rmq.parameters(), self.tracker, self.reply_to).start()
+                            )
+            except Exception as e:
+                for listener in self.listeners:
+                    listener.stop()
+                self.listeners = []
+                self.replies_error = e
+        return self
+
+    def wait_for_replies(self, timeout):
+        """ Waits for the replies to the published messages, Ctrl+C stops waiting. Returns their ReplyResults """
+
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            self.tracker.wait(self.tracked, timeout)
+        except KeyboardInterrupt:
+            pass
+        return self.tracker.collect(self.tracked)
+
+    def __exit__(self, *_):
+        for listener in self.listeners:
+            listener.stop()
+        if self.pool:
+            self.pool.shutdown()
+        for _, rmq in self.targets:
+            if rmq.connection:
+                rmq.__exit__()
 
-    def __init__(self, **kwargs):
 
-        self.local_file_path = kwargs.get('file_name')
-        self.bucket_name = kwargs.get('bucket_name')
-        self.folder_name = kwargs.get('folder_name')
+class AWS:
 
-        self.s3_path = os.path.join(
-                self.folder_name,
-                os.path.basename(self.local_file_path)
+    def __init__(self, args):
+        from boto3.s3.transfer import TransferConfig
+
+        MB = 1024 * 1024
+
+        self.force_upload = args.force_upload
+        # every part of every file uploaded at the same time needs a connection
+        self.max_pool_connections = args.max_concurrency * args.workers
+        self.cache = hashcache.UploadCache(UPLOAD_CACHE_FILE)
+        self.checkpoints = multipart.CheckpointStore(MULTIPART_CHECKPOINT_DIR)
+        self.abandoned_upload_hours = args.abandoned_upload_hours
+        self.sweep_abandoned_uploads = args.sweep_abandoned_uploads
+        # --compress, or the per file type rules of the kit's config
+        self.compression_rules = [{'codec': args.compress}] if args.compress \
+                                 else load_kit_config('upload').get('compression')
+        self.cleaned = set()
+        self.lock = threading.Lock()
+
+        self.transfer_config = TransferConfig(
+                multipart_threshold = args.multipart_threshold * MB,
+                multipart_chunksize = args.multipart_chunksize * MB,
+                max_concurrency = args.max_concurrency,
+                use_threads = not args.no_threads
             )
 
     def __enter__(self):
+        import boto3
+        from botocore.config import Config
+
+        with tracing.span('s3_client'):
+            self.client = boto3.client(
+                    's3',
+                    endpoint_url=config.AWS_URL,
+                    aws_access_key_id=config.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
+                    config=Config(max_pool_connections=max(10, self.max_pool_connections))
+                )
+
+        return self
+
+    def abort_abandoned_uploads(self, bucket_name, folder_name):
+        """ Once per run and folder, aborts the multipart uploads nobody came back to resume """
+
+        with self.lock:
+            if (bucket_name, folder_name) in self.cleaned:
+                return
+            self.cleaned.add((bucket_name, folder_name))
 
-        self.client = boto3.client(
-                's3',
-                endpoint_url=config.AWS_URL,
-                aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY
+        try:
+            with tracing.span('multipart_cleanup') as span:
+                prefix = os.path.join(folder_name, '') if folder_name else ''
+                span['aborted'] = multipart.abort_abandoned(
+                        self.client, bucket_name, self.checkpoints, config.AWS_URL,
+                        self.abandoned_upload_hours, prefix=prefix,
+                        sweep=self.sweep_abandoned_uploads and bool(prefix)
+                    )
+        except Exception:
+            # they are tried again on the next run
+            pass
+
+    def encoding_for(self, message, local_file_path):
+        return compression.codec_for(self.compression_rules, message.get('file_type'), local_file_path)
+
+    def upload(self, local_file_path, bucket_name, folder_name, encoding=None):
+        """ Returns False when the object already holds the file's content and the upload was skipped.
+            Files above the multipart threshold resume from the last part an earlier attempt completed.
+            With an `encoding` the file is compressed as it is sent, under the name of compression.object_name """
+
+        s3_path = os.path.join(
+                folder_name,
+                compression.object_name(os.path.basename(local_file_path), encoding)
             )
 
-        return self
+        with tracing.span('hash'):
+            digest = self.cache.digest(local_file_path)
+
+        if not self.force_upload:
+            with tracing.span('dedup_check') as span:
+                span['unchanged'] = hashcache.is_uploaded(self.client, digest, bucket_name, s3_path)
+            if span['unchanged']:
+                return False
+
+        self.abort_abandoned_uploads(bucket_name, folder_name)
+
+        size = os.path.getsize(local_file_path)
+        metadata = {hashcache.METADATA_KEY: digest}
+
+        if size >= self.transfer_config.multipart_threshold:
+            with tracing.span('upload', bytes=size, resumable=True, encoding=encoding):
+                multipart.upload(
+                        self.client, local_file_path, bucket_name, s3_path, digest,
+                        self.checkpoints, config.AWS_URL,
+                        part_size = self.transfer_config.multipart_chunksize,
+                        max_concurrency = self.transfer_config.max_request_concurrency
+                                          if self.transfer_config.use_threads else 1,
+                        metadata = metadata, encoding = encoding
+                    )
+        elif encoding:
+            # small enough to be put at once, compressed while it is sent
+            with tracing.span('upload', bytes=size, encoding=encoding):
+                with compression.CompressedReader(local_file_path, encoding) as body:
+                    self.client.upload_fileobj(
+                            body, bucket_name, s3_path, Config=self.transfer_config,
+                            ExtraArgs={'Metadata': metadata, 'ContentEncoding': encoding}
+                        )
+        else:
+            with tracing.span('upload', bytes=size):
+                self.client.upload_file(
+                        local_file_path, bucket_name, s3_path, Config=self.transfer_config,
+                        ExtraArgs={'Metadata': metadata}
+                    )
+
+        return True
 
     def __exit__(self, *_):
         ...
@@ -197,6 +677,283 @@ def read_file_helper(message):
     return extension, file_data, message, file_name
 
 
+def preview_delimited(file_name, rows):
+    """ The first rows of a CSV/TXT file, streamed so that only those are ever read """
+
+    with open(file_name, newline='', encoding='utf-8', errors='replace') as file:
+        sample = file.read(PREVIEW_SAMPLE_SIZE)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        file.seek(0)
+
+        return list(itertools.islice(csv.reader(file, dialect), rows))
+
+
+def preview_xlsx(file_name, rows):
+    """ The first rows of the first sheet, openpyxl's read only mode loads them lazily """
+
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        return [list(row) for row in sheet.iter_rows(max_row=rows, values_only=True)]
+    finally:
+        workbook.close()
+
+
+def format_rows(rows):
+    cells = [
+            ['' if value is None else str(value)[:PREVIEW_CELL_WIDTH] for value in row]
+            for row in rows
+        ]
+    widths = [max(map(len, column)) for column in itertools.zip_longest(*cells, fillvalue='')]
+
+    return '\n'.join(
+            '  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+            for row in cells
+        )
+
+
+def preview(job, rows):
+    """ A printable preview of the first `rows` rows of the job's file, header included """
+
+    file_name = job['file_name']
+    extension = os.path.splitext(file_name)[1].lower()
+
+    try:
+        if extension in ('.csv', '.txt'):
+            return f"{file_name}\n{format_rows(preview_delimited(file_name, rows + 1))}\n"
+
+        if extension in ('.xlsx', '.xlsm'):
+            try:
+                return f"{file_name}\n{format_rows(preview_xlsx(file_name, rows + 1))}\n"
+            except ImportError:
+                pass
+
+        # any other format goes through the pwc reader, which needs the whole file
+        from api.services.transformation.read_file import ReadFile
+        df = ReadFile(*read_file_helper(job)).get_data()
+        return f"{file_name}\n{df.head(rows)}\n"
+
+    except Exception as e:
+        return f"Error while printing the dataframe of {file_name}: \n{e}"
+
+
+def show_previews(jobs, rows, output):
+    for job in jobs:
+        output(preview(job, rows))
+
+
+def expand_paths(paths):
+    """ Resolves plain paths, directories and glob patterns into a list of files """
+
+    files, invalid = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(
+                    os.path.join(path, name) for name in os.listdir(path)
+                    if not name.startswith('.') and os.path.isfile(os.path.join(path, name))
+                )
+        elif glob.has_magic(path):
+            matches = sorted(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+        else:
+            matches = [path] if os.path.isfile(path) else []
+
+        if not matches:
+            invalid.append(path)
+        files.extend(matches)
+
+    # overlapping patterns must not upload the same file twice
+    return list(dict.fromkeys(files)), invalid
+
+
+def read_manifest(manifest):
+    """ Reads (file_name, overrides) pairs from a JSONL or CSV manifest,
+        raises ValueError for a row it cannot make a message of """
+
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+
+    with open(manifest, 'r', newline='') as file:
+        if os.path.splitext(manifest)[1].lower() == '.csv':
+            rows = [
+                    {key: value for key, value in row.items() if key and value not in (None, '')}
+                    for row in csv.DictReader(file)
+                ]
+        else:
+            rows = [json.loads(line) for line in file if line.strip()]
+
+    entries = []
+    for row in rows:
+        overrides = dict(row)
+        file_name = overrides.pop('file_name', '')
+        if not file_name:
+            print(f"**Manifest entry {row} has no 'file_name' and was ignored**")
+            continue
+
+        if 'load_id' in overrides:
+            try:
+                overrides['load_id'] = int(overrides['load_id'])
+            except (TypeError, ValueError):
+                raise ValueError(f"manifest entry {row} has a load_id that is not a whole number") from None
+
+        entries.append((os.path.join(base_dir, os.path.expanduser(file_name)), overrides))
+
+    return entries
+
+
+def build_jobs(args, message):
+    """ Returns one message per file, the base message updated with the manifest overrides """
+
+    files, invalid = expand_paths(args.file_name)
+    entries = [(file_name, {}) for file_name in files]
+
+    if args.manifest:
+        manifest_entries = read_manifest(args.manifest)
+        invalid.extend(path for path, _ in manifest_entries if not os.path.isfile(path))
+        entries.extend(entry for entry in manifest_entries if os.path.isfile(entry[0]))
+
+    jobs = []
+    for file_name, overrides in entries:
+        job = dict(message, **overrides)
+        job['file_name'] = file_name
+        jobs.append(correlate(job))
+
+    return jobs, invalid
+
+
+def correlate(message):
+    """ The message with a correlation_id of its own when its replies are tracked """
+
+    if message.get('reply_to'):
+        message.update(replies.new_reply_fields(message['reply_to']))
+    return message
+
+
+def load_kit_config(section):
+    """ A section of the kit's config.yaml, empty when there is none """
+
+    if not os.path.isfile(KIT_CONFIG_FILE):
+        return {}
+
+    import yaml
+    with open(KIT_CONFIG_FILE, 'r') as file:
+        return (yaml.safe_load(file) or {}).get(section) or {}
+
+
+def watch_jobs(args, message, stop):
+    """ Yields a PipelineJob for every file written into the watched directory until `stop` is set """
+
+    watch_config = load_kit_config('watch')
+    watch = watcher.Watcher(
+            args.watch,
+            presets = watcher.Presets(watch_config.get('presets')),
+            settle = args.settle_seconds if args.settle_seconds is not None
+                     else float(watch_config.get('settle_seconds', watcher.DEFAULT_SETTLE_SECONDS)),
+            poll_interval = float(watch_config.get('poll_interval', watcher.DEFAULT_POLL_INTERVAL)),
+            use_inotify = not args.poll,
+            existing = args.watch_existing
+        )
+    print(f"👀 Watching {watch.directory} ({watch.mode}, {len(watch.presets.rules)} preset(s)), "
+          f"stop with Ctrl+C or SIGTERM\n")
+
+    for path, preset in watch.files(stop):
+        job = dict(message, **(preset or {}))
+        job['file_name'] = path
+
+        if not job.get('file_type'):
+            print(f"❌ {path} matches no preset setting a file_type and none was given, ignored")
+            continue
+
+        try:
+            pipeline_job = PipelineJob(path, correlate(job))
+        except FileNotFoundError:
+            # moved away again before it could be sent
+            continue
+        yield pipeline_job
+
+
+def load_test_messages(message, count):
+    """ `count` copies of the message, load_id counting up and its templates filled in """
+
+    templates = {key: value for key, value in message.items() if isinstance(value, str) and '{' in value}
+    first_load_id = int(message['load_id'])
+
+    for n in range(count):
+        load_id = first_load_id + n
+        yield correlate(dict(
+                message, load_id=load_id,
+                **{key: template.format(n=n, load_id=load_id) for key, template in templates.items()}
+            ))
+
+
+def run_load_test(args, message, aws, rmq):
+    """ Uploads the file of the message once and publishes --load-test messages for it,
+        at --rate after --ramp-up. Returns the LatencyStats of the run """
+
+    file_name = message['file_name']
+    encoding = aws.encoding_for(message, file_name)
+    uploaded = aws.upload(file_name, message['bucket_name'], message['folder_name'], encoding)
+    message = compression.mark_message(dict(message, file_name=os.path.basename(file_name)), encoding)
+
+    print(f"{'✅ uploaded' if uploaded else '✅ unchanged'} {file_name}, publishing {args.load_test} messages "
+          f"at {args.rate:g}/sec" + (f" after a {args.ramp_profile} ramp-up of {args.ramp_up:g}s" if args.ramp_up else '')
+          + ", stop with Ctrl+C\n")
+
+    bucket = loadgen.TokenBucket(loadgen.ramp(args.ramp_profile, args.rate, args.ramp_up), args.burst)
+    stats = loadgen.LatencyStats()
+    error = None
+
+    stop = threading.Event()
+
+    def interrupt(signum, _):
+        stop.set()
+        signal.signal(signum, signal.SIG_DFL if signum == signal.SIGTERM else signal.default_int_handler)
+
+    signal.signal(signal.SIGTERM, interrupt)
+    signal.signal(signal.SIGINT, interrupt)
+
+    def report():
+        interval = stats.interval()
+        print(f"⏱ {monotonic() - stats.started:6.1f}s  {len(stats.latencies) + stats.errors}/{args.load_test}  "
+              f"target {bucket.rate:.4g}/sec  achieved {loadgen.describe(interval)}  errors {interval['errors']}")
+
+    # the setup trace would otherwise collect the spans of every message
+    with tracing.activate(None):
+        next_report = monotonic() + args.report_interval
+        for load_message in load_test_messages(message, args.load_test):
+            if not bucket.acquire(stop):
+                break
+
+            started = perf_counter()
+            try:
+                rmq.publish(load_message)
+            except Exception as e:
+                stats.failed()
+                error = e
+            else:
+                stats.add(perf_counter() - started)
+
+            if monotonic() >= next_report:
+                report()
+                if error:
+                    print(f"   ❌ {error} (load test messages are not kept in the outbox)")
+                    error = None
+                next_report = monotonic() + args.report_interval
+
+        report()
+
+    return stats
+
+
+def human_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size:.0f} B"
+        size /= 1024
+
 
 if __name__ == "__main__":
 
@@ -205,56 +962,239 @@ if __name__ == "__main__":
             description="Upload Publish and Test"
         )
 
+    # timings of the run's setup, every file gets a trace of its own
+    run_id = tracing.new_run_id()
+    run_log = tracing.RunLog(RUN_LOG_FILE)
+    setup = tracing.Trace('setup')
+
     #step 1 : process message
-    args = setup_parser(parser).parse_args()
-    message = process_parser_args(args)
+    with setup.span('config'):
+        args = setup_parser(parser).parse_args()
+        message = process_parser_args(args)
     print("\n>>>>>>>>>>>>>>>>>>>>>>>> PWC Python Message Kit <<<<<<<<<<<<<<<<<<<<<<<<\n")
 
+    if args.watch:
+        if args.file_name or args.manifest:
+            parser.error("--watch takes no file paths or manifest")
+        if not os.path.isdir(args.watch):
+            print(f"❌ INVALID WATCH DIRECTORY: {args.watch}\n")
+            sys.exit(1)
+    elif not args.file_type:
+        parser.error("the following arguments are required: -T/--file_type")
+
+    if args.manifest and not os.path.isfile(args.manifest):
+        print(f"❌ INVALID MANIFEST PATH: {args.manifest}\n")
+        sys.exit(1)
 
-    if not os.path.exists(args.file_name):
-        print(f"❌ INVALID FILE PATH: {args.file_name}\n")
+    jobs, invalid = [], []
+    if not args.watch:
+        with setup.span('expand_files'):
+            try:
+                jobs, invalid = build_jobs(args, message)
+            except ValueError as e:
+                print(f"❌ INVALID MANIFEST: {e}\n")
+                sys.exit(1)
+
+    for path in invalid:
+        print(f"❌ INVALID FILE PATH: {path}\n")
+
+    if invalid or not (jobs or args.watch):
+        sys.exit(1)
+
+    if args.load_test:
+        if args.watch or len(jobs) != 1:
+            parser.error("--load-test takes exactly one file, uploaded once and named by every message")
+        if args.rate <= 0:
+            parser.error("--rate must be above 0")
+        try:
+            next(load_test_messages(jobs[0], 1))
+        except (KeyError, IndexError, ValueError) as e:
+            parser.error(f"invalid message template, only {{n}} and {{load_id}} can be filled in: {e}")
+
+    queues = args.queues or [RABBITMQ_QUEUE_NAME]
+    try:
+        fan_out = FanOut(
+                queues, load_kit_config('rabbit_profiles') if any('@' in queue for queue in queues) else {},
+                message.get('reply_to'), outboxed=not args.load_test
+            )
+    except ValueError as e:
+        print(f"❌ {e}\n")
         sys.exit(1)
 
     if args.debug:
         __import__('pdb').set_trace()
 
+    # the previews are read and printed while the files upload, even when --silent
+    previews = None
     if args.show:
-        try:
-            from api.services.transformation.read_file import ReadFile
-            df = ReadFile(*read_file_helper(message)).get_data()
-            print(df, '\n\n')
-
-        except Exception as e:
-            print(f"Error while printing the dataframe: \n{e}")
+        previews = threading.Thread(
+                target=show_previews, args=([dict(job) for job in jobs], args.show_rows, print), daemon=True
+            )
+        previews.start()
 
 
     if args.silent:
         print = lambda *_ : None
 
 
-    #step 2: upload file to aws/minio
-    with AWS(**message) as aws:
-        try:
-            aws.client.upload_file(aws.local_file_path, aws.bucket_name, aws.s3_path)
-            print(f'✅ File uploaded to the bucket: {aws.bucket_name}')
+    #step 2: upload the files to aws/minio and send each message to the queue as
+    # soon as its file is uploaded, sharing one s3 client and one rabbitmq channel
+    with tracing.activate(setup), AWS(args) as aws, fan_out as rmq:
+
+        if rmq.replies_error:
+            print(f"❌ Could not listen for the consumer's replies: {rmq.replies_error}\n")
+
+        # messages earlier runs could not get confirmed go out first
+        if rmq.pending():
+            try:
+                with tracing.span('outbox_flush'):
+                    flushed, left = rmq.flush_outbox()
+                print(f"📤 {flushed} message(s) published from the outbox, {left} still pending\n")
+            except Exception as e:
+                print(f"❌ Could not publish the outbox to rabbitmq: {e}\n")
+
+        def upload(job):
+            return aws.upload(
+                    job.local_file_path, job.message['bucket_name'], job.message['folder_name'],
+                    aws.encoding_for(job.message, job.local_file_path)
+                )
+
+        # set once a publish failed, a --watch run tries the outbox again with the next file
+        outbox_pending = threading.Event()
+
+        def publish(job):
+            if outbox_pending.is_set():
+                try:
+                    with tracing.span('outbox_flush'):
+                        _, left = rmq.flush_outbox()
+                    if not left:
+                        outbox_pending.clear()
+                except Exception:
+                    pass
+
+            job.message['file_name'] = os.path.basename(job.local_file_path)
+            compression.mark_message(job.message, aws.encoding_for(job.message, job.local_file_path))
+            rmq.publish(job.message)
+
+        done = itertools.count(1)
+        total = f"/{len(jobs)}" if jobs else ''
+
+        def report(job):
+            run_log.write(job.trace.as_record(
+                    run=run_id, source='publisher_script', ok=job.ok, uploaded=job.uploaded,
+                    stage=job.stage, error=str(job.error) if job.error else None
+                ))
+
+            prefix = f"[{next(done)}{total}] {job.local_file_path} ({human_size(job.size)})"
+            bucket_name = job.message['bucket_name']
+
+            if job.stage == 'upload':
+                print(f"❌ {prefix} Error in Upload: {job.error}")
+            elif job.stage == 'publish':
+                outbox_pending.set()
+                print(f"❌ {prefix} uploaded to {bucket_name}, error in rabbitmq: {job.error} "
+                      f"(kept in the outbox, published on the next run)")
+            else:
+                action = 'uploaded to' if job.uploaded else 'unchanged in'
+                print(f"✅ {prefix} {action} {bucket_name} and published "
+                      f"(upload {job.upload_time:.2f}s, publish {job.publish_time:.2f}s)")
+
+                if len(rmq.targets) > 1:
+                    print("   confirmed by " + ', '.join(
+                            f"{name} in {tracing.format_duration(latency)}"
+                            for name, latency in job.trace.durations('confirm:').items()
+                        ))
+
+                if len(jobs) == 1:
+                    print(json.dumps(job.message, indent=4))
+
+            if args.trace:
+                print(f"   ⏱ {job.trace.breakdown()}")
+
+        if args.load_test:
+            with setup.span('load_test'):
+                # before the replies are waited for, which would lower the rate
+                load_test = run_load_test(args, jobs[0], aws, rmq).total()
+
+        elif args.watch:
+            # the first SIGTERM or Ctrl+C stops watching and lets the files taken so far
+            # finish uploading and publishing, a second one stops right away
+            stop = threading.Event()
+
+            def drain(signum, _):
+                print(f"\n⏳ {signal.Signals(signum).name}: sending the files in progress, then stopping\n")
+                stop.set()
+                signal.signal(signum, signal.SIG_DFL if signum == signal.SIGTERM else signal.default_int_handler)
+
+            signal.signal(signal.SIGTERM, drain)
+            signal.signal(signal.SIGINT, drain)
+
+            watched = []
+
+            def report_watched(job):
+                watched.append(job.ok)
+                report(job)
+
+            pipeline = Pipeline(upload, publish, workers=args.workers, backlog=args.backlog,
+                                on_result=report_watched)
+            with setup.span('watch'):
+                pipeline.stream(watch_jobs(args, message, stop))
 
-        except boto3.exceptions.S3UploadFailedError as e:
-            print(f"❌ Error in Upload: {e}")
-            sys.exit(2)
+        else:
+            pipeline = Pipeline(upload, publish, workers=args.workers, on_result=report)
+            stats = pipeline.run([PipelineJob(job['file_name'], job) for job in jobs])
+
+        if rmq.tracked:
+            print(f"\n📨 Waiting up to {tracing.format_duration(args.reply_timeout)} for the replies "
+                  f"of the consumer, stop with Ctrl+C")
+            # a line per message would drown the histograms of a load test
+            replied = rmq.wait_for_replies(args.reply_timeout)
+            print('\n'.join(replies.report(replied, messages=not args.load_test)))
+
+    if args.load_test:
+        total = load_test
+        run_log.write(setup.as_record(
+                run=run_id, source='publisher_script', ok=not total['errors'], load_test=args.load_test,
+                published=total['messages'], failures=total['errors'], rate=round(total['rate'], 3),
+                **{f"p{percent}_ms": round(seconds * 1000, 3) for percent, seconds in total['percentiles'].items()}
+            ))
+
+        print(f"\n{total['messages']}/{args.load_test} messages published, {total['errors']} failed in "
+              f"{total['seconds']:.1f}s: {loadgen.describe(total)}")
+        print("\n........................................................................\n")
+        sys.exit(2 if total['errors'] or total['messages'] < args.load_test else 0)
 
+    if args.watch:
+        failures = len(watched) - sum(watched)
+        run_log.write(setup.as_record(
+                run=run_id, source='publisher_script', ok=not failures, files=len(watched),
+                failures=failures, watch=args.watch
+            ))
 
-    #step 3: send message to the queue
-    with RabbitMQ() as rmq:
+        print(f"\n{sum(watched)}/{len(watched)} files published, {failures} failed, "
+              f"watched {args.watch} for {setup.duration:.0f}s")
+        print("\n........................................................................\n")
+        sys.exit(2 if failures else 0)
 
-        message['file_name'] = os.path.basename(message['file_name'])
+    if previews:
+        previews.join()
 
-        try:
-            rmq.publish(message)
-            print(f'✅ Message published to rabbitmq\n')
-            print(json.dumps(message, indent=4))
 
-        except Exception as e:
-            print(f'❌ Error in rabbitmq: {e}')
+    run_log.write(setup.as_record(
+            run=run_id, source='publisher_script', ok=not stats.failures, files=len(jobs),
+            failures=stats.failures, wall_ms=round(stats.wall_time * 1000, 3)
+        ))
 
+    published = len(jobs) - stats.failures
+    print(f"\n{published}/{len(jobs)} files published, {stats.failures} failed, uploaded "
+          f"{human_size(stats.uploaded_bytes)} in {stats.wall_time:.2f}s "
+          f"({published / stats.wall_time:.2f} files/sec, {human_size(stats.uploaded_bytes / stats.wall_time)}/sec)")
+    print(stats.summary())
+    if args.trace:
+        print(f"⏱ setup: {setup.breakdown()}")
+        print(f"  timings of every file are logged to {RUN_LOG_FILE}")
 
     print("\n........................................................................\n")
+
+    if stats.failures:
+        sys.exit(2)
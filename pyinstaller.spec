@@ -1,6 +1,12 @@
 # -*- mode: python ; coding: utf-8 -*-
 
 
+import sys
+sys.path.insert(0, SPECPATH)
+
+import forms
+forms.compile_forms()
+
 block_cipher = None
 
 datas=[
@@ -8,8 +14,23 @@ datas=[
    ('resources/main_window.ui', 'resources/'),
    ('resources/about_window.ui', 'resources/'),
    ('resources/conf_window.ui', 'resources/'),
+   ('resources/main_window_ui.py', 'resources/'),
+   ('resources/about_window_ui.py', 'resources/'),
+   ('resources/conf_window_ui.py', 'resources/'),
+   ('forms.py', '.'),
    ('utils.py', '.'),
    ('config.py', '.'),
+   ('hashcache.py', '.'),
+   ('pipeline.py', '.'),
+   ('tracing.py', '.'),
+   ('outbox.py', '.'),
+   ('multipart.py', '.'),
+   ('watcher.py', '.'),
+   ('loadgen.py', '.'),
+   ('replies.py', '.'),
+   ('compression.py', '.'),
+   ('cli.py', '.'),
+   ('console.py', '.'),
 ]
 
 a = Analysis(
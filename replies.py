@@ -0,0 +1,282 @@
+"""
+Round trip latency of published messages, through replies of the consumer.
+
+Messages published with reply tracking on carry a `correlation_id` and a
+`reply_to` queue, in the message and as the AMQP properties of the same
+names. The consumer downstream answers on the `reply_to` queue with the
+same correlation_id property and a JSON body:
+
+    {"status": "consumed"}                      once it picked the message up
+    {"status": "completed"}                     once the file was processed
+    {"status": "failed", "error": "..."}        when it could not be
+
+The kit listens on that queue and times both replies from the moment it
+published the message, on its own clock, so that the two clocks do not
+need to agree.
+
+    tracker = ReplyTracker()
+    listener = ReplyListener(parameters, tracker).start()
+    message.update(new_reply_fields(listener.queue_name))
+    tracker.published(message['correlation_id'], file_name)
+    ...
+    tracker.wait(correlation_ids, timeout)
+    print('\n'.join(report(tracker.collect(correlation_ids))))
+
+Only the listener needs pika, it is imported when it starts.
+"""
+
+import os
+import json
+import math
+import uuid
+import threading
+from time import monotonic
+
+from tracing import format_duration
+
+DEFAULT_REPLY_TIMEOUT = 60.0
+
+# messages a tracker keeps the times of, the oldest go first. Collected ones are dropped
+MAX_TRACKED = 10000
+
+# the reply queue of this process, removed by the broker once it exits
+REPLY_QUEUE_PREFIX = 'pwc-message-kit.replies'
+
+STATUSES = ('consumed', 'completed', 'failed')
+
+HISTOGRAM_WIDTH = 40
+
+
+def reply_queue_name():
+    return f'{REPLY_QUEUE_PREFIX}.{os.getpid()}.{uuid.uuid4().hex[:8]}'
+
+
+def new_reply_fields(reply_to):
+    return dict(correlation_id=uuid.uuid4().hex, reply_to=reply_to)
+
+
+def reply_properties(message):
+    """ The correlation_id and reply_to AMQP properties of a message, none when it is not tracked """
+
+    if not message.get('correlation_id') or not message.get('reply_to'):
+        return {}
+    return dict(correlation_id=message['correlation_id'], reply_to=message['reply_to'])
+
+
+def body_reply_properties(body):
+    """ reply_properties of a serialized message, as the outbox keeps them """
+
+    if 'correlation_id' not in body:
+        return {}
+    try:
+        return reply_properties(json.loads(body))
+    except ValueError:
+        return {}
+
+
+class ReplyResult:
+    __slots__ = ('name', 'published', 'consumed', 'completed', 'status', 'error')
+
+    def __init__(self, name, published):
+        self.name = name
+        self.published = published
+        self.consumed = None
+        self.completed = None
+        self.status = None
+        self.error = None
+
+    @property
+    def consume_latency(self):
+        return None if self.consumed is None or self.published is None else self.consumed - self.published
+
+    @property
+    def completion_latency(self):
+        return None if self.completed is None or self.published is None else self.completed - self.published
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed')
+
+
+class ReplyTracker:
+    """ Publish and reply times by correlation id. A reply may come in before
+        its publish was recorded, the publish is then matched to it later.
+        The results are handed over, and forgotten, by collect """
+
+    def __init__(self, max_tracked=MAX_TRACKED):
+        self.condition = threading.Condition()
+        self.results = {}
+        self.max_tracked = max_tracked
+
+    def result(self, correlation_id):
+        result = self.results.get(correlation_id)
+        if result is None:
+            # a message that is never collected, its publish failed or its reply came
+            # too late, would otherwise stay for as long as the process runs
+            while len(self.results) >= self.max_tracked:
+                del self.results[next(iter(self.results))]
+            result = self.results[correlation_id] = ReplyResult(None, None)
+        return result
+
+    def published(self, correlation_id, name, at=None):
+        with self.condition:
+            result = self.result(correlation_id)
+            result.name = name
+            result.published = monotonic() if at is None else at
+
+    def replied(self, correlation_id, status, error=None, at=None):
+        at = monotonic() if at is None else at
+        with self.condition:
+            result = self.result(correlation_id)
+            if status == 'consumed':
+                result.consumed = result.consumed or at
+            else:
+                # a consumer that skips 'consumed' picked it up at the latest then
+                result.consumed = result.consumed or at
+                result.completed = at
+            if result.status not in ('completed', 'failed'):
+                result.status = status
+            result.error = error or result.error
+            self.condition.notify_all()
+
+    def wait(self, correlation_ids, timeout=DEFAULT_REPLY_TIMEOUT, stop=None):
+        """ Waits until every message was completed or failed, returns whether they all were """
+
+        deadline = monotonic() + timeout
+        with self.condition:
+            while not all(self.result(correlation_id).done for correlation_id in correlation_ids):
+                remaining = deadline - monotonic()
+                if remaining <= 0 or (stop is not None and stop.is_set()):
+                    return False
+                self.condition.wait(min(remaining, 0.5))
+        return True
+
+    def collect(self, correlation_ids):
+        with self.condition:
+            return [
+                    self.results.pop(correlation_id, None) or ReplyResult(None, None)
+                    for correlation_id in correlation_ids
+                ]
+
+
+class ReplyListener:
+    """ Consumes the reply queue on a connection and thread of its own, pika
+        connections are not to be shared between threads """
+
+    def __init__(self, parameters, tracker, queue_name=None):
+        self.parameters = parameters
+        self.tracker = tracker
+        self.queue_name = queue_name or reply_queue_name()
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.error = None
+        self.thread = None
+
+    def start(self, timeout=10):
+        """ Starts consuming, returns once the reply queue exists so that no reply is lost """
+
+        self.thread = threading.Thread(target=self.run, name='reply-listener', daemon=True)
+        self.thread.start()
+        if not self.ready.wait(timeout) or self.error:
+            # pika's connection errors often have no message of their own
+            error = str(self.error) or type(self.error).__name__ if self.error else 'timed out'
+            raise ConnectionError(f"Could not listen on the reply queue {self.queue_name}: {error}")
+        return self
+
+    def run(self):
+        import pika
+
+        try:
+            connection = pika.BlockingConnection(self.parameters)
+            channel = connection.channel()
+            # exclusive: the broker removes it along with this connection
+            channel.queue_declare(queue=self.queue_name, exclusive=True, auto_delete=True)
+            channel.basic_consume(queue=self.queue_name, on_message_callback=self.on_reply, auto_ack=True)
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            return
+
+        self.ready.set()
+        try:
+            while not self.stopping.is_set():
+                connection.process_data_events(time_limit=0.2)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def on_reply(self, channel, method, properties, body):
+        correlation_id = properties.correlation_id
+        try:
+            reply = json.loads(body)
+        except ValueError:
+            return
+        status = reply.get('status') if isinstance(reply, dict) else None
+        if correlation_id and status in STATUSES:
+            self.tracker.replied(correlation_id, status, reply.get('error'))
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+
+def format_latency(seconds):
+    return '-' if seconds is None else format_duration(seconds)
+
+
+def histogram(latencies, width=HISTOGRAM_WIDTH):
+    """ Lines of a text histogram of the latencies, in buckets doubling from 1 ms """
+
+    if not latencies:
+        return []
+
+    buckets = {}
+    for latency in latencies:
+        bucket = max(0, math.ceil(math.log2(max(latency, 1e-3) * 1000)))
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    most = max(buckets.values())
+    lines = []
+    for bucket in range(min(buckets), max(buckets) + 1):
+        count = buckets.get(bucket, 0)
+        bar = '█' * math.ceil(count / most * width) if count else ''
+        lines.append(f"  ≤ {format_latency(2 ** bucket / 1000):>8} {bar} {count}")
+    return lines
+
+
+def report(results, messages=True, histograms=True):
+    """ A line per message with its latencies, then a count of the replies and
+        the histograms of the batch """
+
+    lines = []
+    for result in results if messages else ():
+        if result.status is None:
+            line = f"{result.name}: no reply"
+        elif not result.done:
+            line = f"{result.name}: consumed after {format_latency(result.consume_latency)}, not done yet"
+        else:
+            line = (f"{result.name}: consumed after {format_latency(result.consume_latency)}, "
+                    f"{result.status} after {format_latency(result.completion_latency)}")
+        if result.error:
+            line += f" ({result.error})"
+        lines.append(line)
+
+    if len(results) > 1 or not messages:
+        statuses = [result.status for result in results]
+        lines.append(f"{statuses.count('completed')} completed, {statuses.count('failed')} failed, "
+                     f"{sum(not result.done for result in results)} not done of {len(results)} message(s)")
+
+    if histograms and len(results) > 1:
+        for title, latencies in (
+                ('publish → consume', [r.consume_latency for r in results if r.consume_latency is not None]),
+                ('publish → completion', [r.completion_latency for r in results if r.completion_latency is not None])):
+            if latencies:
+                lines.append(f"{title} ({len(latencies)}/{len(results)} replied):")
+                lines.extend(histogram(latencies))
+
+    return lines
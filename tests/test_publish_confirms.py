@@ -0,0 +1,42 @@
+"""
+Publisher confirms of utils.RabbitConnection against the in-process broker
+of the benchmarks, run from the repository root:
+
+    python -m pytest tests
+"""
+
+import json
+from time import perf_counter
+
+import utils
+from benchmarks.fake_amqp import FakeAMQP
+
+CONFIRM_DELAY = 0.05
+
+
+def test_publishes_do_not_wait_for_their_own_ack():
+    with FakeAMQP(confirm_delay=CONFIRM_DELAY) as amqp:
+        rmq = utils.RabbitMQ(amqp.rabbit_config(), 'db', 'confirms', lane='window')
+        try:
+            started = perf_counter()
+            acked = rmq.connect().publish_many('confirms', [b'message'] * 40, rmq.properties())
+            elapsed = perf_counter() - started
+        finally:
+            utils.close_rabbit_connection(rmq.connection)
+
+    assert acked == [True] * 40
+    # one ack round trip after the other would take 40 confirm delays
+    assert elapsed < 10 * CONFIRM_DELAY
+
+
+def test_nacks_are_mapped_to_their_message():
+    with FakeAMQP(nack=lambda body: json.loads(body)['n'] % 3 == 0) as amqp:
+        rmq = utils.RabbitMQ(amqp.rabbit_config(), 'db', 'confirms', lane='nacks')
+        bodies = [json.dumps({'n': n}).encode() for n in range(10)]
+        try:
+            acked = rmq.connect().publish_many('confirms', bodies, rmq.properties())
+        finally:
+            utils.close_rabbit_connection(rmq.connection)
+
+        assert acked == [n % 3 != 0 for n in range(10)]
+        assert len(amqp.queues['confirms']) == acked.count(True)
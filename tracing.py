@@ -0,0 +1,174 @@
+"""
+Timing spans of every file a run uploads and publishes, and the JSON lines
+run log they are written to.
+
+The upload and publish paths open spans with `tracing.span(name)`, which are
+recorded on the trace active on the calling thread (see `activate`) and cost
+next to nothing when there is none. The pipeline activates the trace of each
+file around its upload and its publish.
+
+    trace = Trace('report.csv')
+    with activate(trace), span('upload', bytes=size):
+        ...
+    print(trace.breakdown())   # upload 1.20s (12.0 MB, 10.0 MB/s)
+"""
+
+import os
+import json
+import uuid
+import threading
+from time import time, perf_counter
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+
+# the run log is rotated to <name>.1 once it grows past this size
+RUN_LOG_MAX_BYTES = 5 * MB
+
+_local = threading.local()
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} ms"
+    return f"{seconds:.2f}s"
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'attributes')
+
+    def __init__(self, name, start, duration, attributes):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.attributes = attributes
+
+    def describe(self):
+        text = f"{self.name} {format_duration(self.duration)}"
+        if 'bytes' in self.attributes:
+            size = self.attributes['bytes']
+            size = f"{size / MB:.1f} MB" if size >= MB else f"{size / 1024:.1f} KB"
+            text += f" ({size}, {self.attributes['mb_per_sec']:.1f} MB/s)"
+        return text
+
+    def as_dict(self):
+        return dict(
+                name = self.name,
+                start_ms = round(self.start * 1000, 3),
+                duration_ms = round(self.duration * 1000, 3),
+                **self.attributes
+            )
+
+
+class Trace:
+    """ The spans of one file, or of the setup of a run, in the order they ended """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time()
+        self.origin = perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Times the block, the attributes yielded can still be added to inside of it """
+
+        started = perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.add(name, perf_counter() - started, started, **attributes)
+
+    def add(self, name, duration, started=None, **attributes):
+        if 'bytes' in attributes:
+            attributes['mb_per_sec'] = round(attributes['bytes'] / MB / max(duration, 1e-9), 2)
+
+        start = (started if started is not None else perf_counter() - duration) - self.origin
+        with self.lock:
+            self.spans.append(Span(name, start, duration, attributes))
+
+    @property
+    def duration(self):
+        with self.lock:
+            return max((span.start + span.duration for span in self.spans), default=0.0)
+
+    def durations(self, prefix):
+        """ {rest of the name: duration} of the spans named `prefix` something """
+
+        with self.lock:
+            return {
+                    span.name[len(prefix):]: span.duration
+                    for span in self.spans if span.name.startswith(prefix)
+                }
+
+    def breakdown(self):
+        with self.lock:
+            return ' | '.join(span.describe() for span in self.spans)
+
+    def as_record(self, **fields):
+        with self.lock:
+            spans = [span.as_dict() for span in self.spans]
+
+        return dict(
+                name = self.name,
+                started = round(self.started, 3),
+                total_ms = round(self.duration * 1000, 3),
+                **fields,
+                spans = spans
+            )
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def activate(trace):
+    """ Makes `trace` the one `span` records on for this thread """
+
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name, **attributes):
+    trace = current()
+    if trace is None:
+        yield attributes
+        return
+
+    with trace.span(name, **attributes) as attributes:
+        yield attributes
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+class RunLog:
+    """ Appends one JSON record per line, safe to share between threads """
+
+    def __init__(self, log_file, max_bytes=RUN_LOG_MAX_BYTES):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+                if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > self.max_bytes:
+                    os.replace(self.log_file, self.log_file + '.1')
+
+                with open(self.log_file, 'a') as file:
+                    file.write(line)
+            except OSError:
+                # timings are not worth failing a run for
+                pass
@@ -1,12 +1,39 @@
 import os
 import json
-import pika
-import boto3
+import socket
+import threading
+from time import sleep, monotonic, perf_counter
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+# pika, boto3 and PyQt5 are imported where they are first used: the GUI
+# window is up before the network libraries load, and the headless paths
+# never pay for Qt
+
+import outbox
+import replies
+import tracing
+import hashcache
+import multipart
+import compression
+from config import CONFIG_DIR
+
+MB = 1024 * 1024
+
+
+def preload():
+    """ Imports the network libraries ahead of the first upload, meant for an idle thread """
+
+    import pika
+    import boto3
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import *
 
 def add_delete_move_functionality(list_widget, buttons):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import (
+            QDialog, QVBoxLayout, QLabel, QLineEdit, QDialogButtonBox, QListWidgetItem
+        )
+
     def add_item():
         dialog = QDialog()
         dialog.setWindowTitle('Add Item')
@@ -66,6 +93,8 @@ def add_delete_move_functionality(list_widget, buttons):
 
 
 def retrive_list_widget_items(listwidget):
+    from PyQt5.QtCore import Qt
+
     items = []
     for index in range(listwidget.count()):
         item = listwidget.item(index)
@@ -75,8 +104,342 @@ def retrive_list_widget_items(listwidget):
     return items
 
 
+def make_multi_select(combo):
+    """ Turns the items of the combo box into check boxes, the first one added is
+        checked. The popup stays open while items are toggled and the box shows
+        the names of the checked ones, see checked_items """
+
+    from PyQt5.QtCore import Qt, QObject, QEvent
+
+    model = combo.model()
+    combo.setEditable(True)
+    combo.lineEdit().setReadOnly(True)
+
+    def show_checked(*_):
+        names = [name for name, _ in checked_items(combo)]
+        combo.lineEdit().setText(', '.join(names) or 'None selected')
+
+    def make_checkable(_, first, last):
+        for row in range(first, last + 1):
+            item = model.item(row)
+            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsUserCheckable)
+            item.setData(Qt.Checked if row == 0 else Qt.Unchecked, Qt.CheckStateRole)
+
+    class ToggleOnClick(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() != QEvent.MouseButtonRelease:
+                return False
+            item = model.itemFromIndex(combo.view().indexAt(event.pos()))
+            if item is not None:
+                checked = item.checkState() == Qt.Checked
+                item.setCheckState(Qt.Unchecked if checked else Qt.Checked)
+            return True
+
+    model.rowsInserted.connect(make_checkable)
+    model.rowsInserted.connect(show_checked)
+    model.rowsRemoved.connect(show_checked)
+    model.dataChanged.connect(show_checked)
+    combo.currentIndexChanged.connect(show_checked)
+
+    combo.toggle_filter = ToggleOnClick(combo)
+    combo.view().viewport().installEventFilter(combo.toggle_filter)
+
+
+def checked_items(combo):
+    from PyQt5.QtCore import Qt
+
+    model = combo.model()
+    return [
+            (model.item(row).text(), model.item(row).data(Qt.UserRole))
+            for row in range(model.rowCount())
+            if model.item(row).checkState() == Qt.Checked
+        ]
+
+
+# heartbeats of idle shared connections are serviced this often, well
+# within the 60 seconds rabbitmq negotiates by default
+HEARTBEAT_INTERVAL = 5
+
+# publisher confirms: unconfirmed messages allowed in flight, how long to wait
+# for the broker to confirm them and the longest a single wait for events takes
+MAX_IN_FLIGHT = 256
+CONFIRM_TIMEOUT = 30
+CONFIRM_POLL = 0.1
+
+_rabbit_connections = {}
+_rabbit_connections_lock = threading.Lock()
+_heartbeat_thread = None
+
+
+class RabbitConnection:
+    """ A long lived connection and channel shared by every RabbitMQ object
+        talking to the same server with the same credentials. The channel
+        is in confirm mode, publishes are tracked until the broker acks them """
+
+    def __init__(self, server_config, username, password):
+        self.server_config = server_config
+        self.username = username
+        self.password = password
+        self.lock = threading.RLock()
+        self.connection = None
+        self.channel = None
+
+        self.declared_queues = set()
+        self.delivery_tag = 0
+        self.pending = {}
+        self.confirmations = {}
+
+    def open_channel(self):
+        import pika
+
+        if not (self.connection and self.connection.is_open and self.channel.is_open):
+            self.close()
+            credentials = pika.PlainCredentials(username=self.username, password=self.password)
+            parameters = pika.ConnectionParameters(**self.server_config, credentials=credentials)
+
+            with tracing.span('amqp_connect'):
+                self.connection = pika.BlockingConnection(parameters)
+                self.channel = self.connection.channel()
+
+                # BlockingChannel.confirm_delivery makes every basic_publish wait for its
+                # own ack and pika has no public callback per delivery tag, so confirm mode
+                # is selected on the channel it wraps and the publishes stay pipelined
+                selected = []
+
+                def on_selected(frame):
+                    selected.append(frame)
+                    self.wake()
+
+                self.channel._impl.confirm_delivery(self.on_delivery_confirmation, callback=on_selected)
+                self.wait(lambda: selected)
+
+        return self.channel
+
+    def wait(self, condition, timeout=CONFIRM_TIMEOUT):
+        deadline = monotonic() + timeout
+        while not condition():
+            if monotonic() > deadline:
+                return False
+            self.connection.process_data_events(time_limit=CONFIRM_POLL)
+        return True
+
+    def declare_queue(self, queue_name):
+        if queue_name not in self.declared_queues:
+            with tracing.span('queue_declare', queue=queue_name):
+                self.channel.queue_declare(queue=queue_name, durable=True)
+            self.declared_queues.add(queue_name)
+
+    def on_delivery_confirmation(self, frame):
+        import pika
+
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+
+        if method.multiple:
+            tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            index = self.pending.pop(tag, None)
+            if index is not None:
+                self.confirmations[index] = acked
+
+        self.wake()
+
+    def wake(self):
+        # the callbacks of the wrapped channel run inside pika's I/O loop, a timer
+        # that is due right away ends the process_data_events call waiting on them
+        self.connection.call_later(0, lambda: None)
+
+    def publish_many(self, queue_name, bodies, properties, max_in_flight=MAX_IN_FLIGHT):
+        """ Publishes every body keeping at most `max_in_flight` unconfirmed, returns whether
+            each one was acked by the broker. `properties` is shared, or a list of one per body """
+
+        import pika
+
+        with self.lock:
+            self.confirmations = {}
+
+            for attempt in range(2):
+                remaining = [index for index in range(len(bodies)) if index not in self.confirmations]
+                try:
+                    channel = self.open_channel()
+                    self.declare_queue(queue_name)
+
+                    with tracing.span('publish', messages=len(remaining)):
+                        for index in remaining:
+                            if not self.wait(lambda: len(self.pending) < max_in_flight):
+                                break
+                            channel.basic_publish(
+                                    exchange='', routing_key=queue_name, body=bodies[index],
+                                    properties=properties[index] if isinstance(properties, list) else properties
+                                )
+                            self.delivery_tag += 1
+                            self.pending[self.delivery_tag] = index
+                            # takes in the confirmations that already arrived, without waiting
+                            self.connection.process_data_events(time_limit=0)
+
+                        self.wait(lambda: not self.pending)
+                    break
+
+                except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                    # whatever was not confirmed yet is published again on a new channel
+                    self.close()
+                    if attempt:
+                        raise
+
+            self.pending = {}
+            return [self.confirmations.get(index, False) for index in range(len(bodies))]
+
+    def run(self, operation):
+        import pika
+
+        # pika connections are not thread safe, every use goes through the lock.
+        # A connection dropped by the broker or the network is reopened once.
+        with self.lock:
+            try:
+                return operation(self.open_channel())
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                self.close()
+                return operation(self.open_channel())
+
+    def process_heartbeats(self):
+        import pika
+
+        # skip the round when a publish is holding the connection anyway
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.process_data_events(time_limit=0)
+        except pika.exceptions.AMQPError:
+            self.close()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        import pika
+
+        with self.lock:
+            try:
+                if self.connection and self.connection.is_open:
+                    self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+            self.connection = self.channel = None
+            self.declared_queues = set()
+            self.delivery_tag = 0
+            self.pending = {}
+
+
+def _service_heartbeats():
+    global _heartbeat_thread
+
+    while True:
+        sleep(HEARTBEAT_INTERVAL)
+        with _rabbit_connections_lock:
+            connections = list(_rabbit_connections.values())
+            if not connections:
+                _heartbeat_thread = None
+                return
+
+        for connection in connections:
+            connection.process_heartbeats()
+
+
+def rabbit_connection(server_config, username, password, lane=None):
+    """ The shared connection to the server, a `lane` other than None gets one of its own.
+        Both stay open for the next publishers until close_rabbit_connections """
+
+    global _heartbeat_thread
+
+    key = (*server_config.values(), username, password, lane)
+
+    with _rabbit_connections_lock:
+        connection = _rabbit_connections.get(key)
+        if connection is None:
+            connection = RabbitConnection(server_config, username, password)
+            _rabbit_connections[key] = connection
+
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_service_heartbeats, daemon=True)
+            _heartbeat_thread.start()
+
+    return connection
+
+
+def close_rabbit_connection(connection):
+    with _rabbit_connections_lock:
+        for key, shared in list(_rabbit_connections.items()):
+            if shared is connection:
+                del _rabbit_connections[key]
+
+    connection.close()
+
+
+def close_rabbit_connections():
+    with _rabbit_connections_lock:
+        connections = list(_rabbit_connections.values())
+        _rabbit_connections.clear()
+
+    for connection in connections:
+        connection.close()
+
+    stop_reply_listeners()
+
+
+# replies of the consumers to the messages asking for them, see replies.py.
+# One reply queue name for the process, listened to on every server published to
+_reply_queue = replies.reply_queue_name()
+_reply_tracker = replies.ReplyTracker()
+_reply_listeners = {}
+_reply_listeners_lock = threading.Lock()
+
+
+def reply_queue():
+    return _reply_queue
+
+
+def reply_tracker():
+    return _reply_tracker
+
+
+def listen_for_replies(rabbit_config):
+    """ Starts listening on the reply queue of the server, once, returns when it listens """
+
+    import pika
+
+    server, credentials = rabbit_config['server'], rabbit_config['credentials']
+    key = (*server.values(), *credentials.values())
+
+    with _reply_listeners_lock:
+        listener = _reply_listeners.get(key)
+        # a listener whose connection dropped lost its queue along with it
+        if listener is None or not listener.thread.is_alive():
+            parameters = pika.ConnectionParameters(
+                    host = server['host'],
+                    port = int(server['port']),
+                    virtual_host = server['virtual_host'],
+                    credentials = pika.PlainCredentials(credentials['username'], credentials['password'])
+                )
+            listener = replies.ReplyListener(parameters, _reply_tracker, _reply_queue).start()
+            _reply_listeners[key] = listener
+
+    return listener
+
+
+def stop_reply_listeners():
+    with _reply_listeners_lock:
+        listeners = list(_reply_listeners.values())
+        _reply_listeners.clear()
+
+    for listener in listeners:
+        listener.stop()
+
+
 class RabbitMQ:
-    def __init__(self, config, db_name, queue_name):
+    def __init__(self, config, db_name, queue_name, lane=None):
         self.username = config['credentials']['username']
         self.password = config['credentials']['password']
 
@@ -88,9 +451,23 @@ class RabbitMQ:
 
         self.queue_name = queue_name
         self.mongo_db = db_name
+        self.lane = lane
+        # taken on the first publish or connection test, see connect
         self.connection = None
+        self.server_key = outbox.server_key(self.server_config)
+
+    def connect(self):
+        """ The shared connection to the server, its socket only opens once it publishes """
+
+        if self.connection is None:
+            self.connection = rabbit_connection(self.server_config, self.username, self.password, self.lane)
+        return self.connection
 
     def get_connection(self):
+        """ A dedicated channel outside of the shared connection, the caller closes it """
+
+        import pika
+
         credentials = pika.PlainCredentials(username=self.username, password=self.password)
         parameters = pika.ConnectionParameters(**self.server_config, credentials=credentials)
 
@@ -99,36 +476,277 @@ class RabbitMQ:
 
         return channel
 
+    def properties(self, db_name=None, body=None):
+        import pika
+
+        return pika.BasicProperties(
+                delivery_mode=2,  # make message persistent
+                headers={'db_name': self.mongo_db if db_name is None else db_name},
+                # the correlation_id and reply_to of a message asking for replies
+                **(replies.body_reply_properties(body) if body else {})
+            )
+
     def publish(self, message:dict):
+        acked, = self.publish_many([message])
+        if not acked:
+            raise ConnectionError("Message was not confirmed by the Rabbit server")
 
-        if not self.connection:
-            self.connection = self.get_connection()
+    def publish_many(self, messages):
+        """ Publishes with publisher confirms, returns one ack/nack boolean per message.
+            The messages are kept in the outbox until the broker acks them """
 
-        self.connection.queue_declare(queue=self.queue_name, durable=True)
-        self.connection.basic_publish(
-            exchange    =   '',
-            routing_key =   self.queue_name,
-            body        =   json.dumps(message),
+        return self.publish_bodies([json.dumps(message) for message in messages])
 
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-                headers={'db_name': self.mongo_db}
-            ))
+    def publish_bodies(self, bodies):
+        box = message_outbox()
+
+        ids = box.add_many(self.server_key, self.queue_name, self.mongo_db, bodies)
+        properties = [self.properties(body=body) for body in bodies]
+        acked = self.connect().publish_many(self.queue_name, bodies, properties)
+        box.settle(ids, acked)
+
+        return acked
+
+    def flush_outbox(self, batch_size=outbox.DRAIN_BATCH_SIZE):
+        """ Publishes what earlier runs left in the outbox for this server, returns (published, still pending) """
+
+        def publish(queue_name, db_name, bodies):
+            properties = [self.properties(db_name, body) for body in bodies]
+            return self.connect().publish_many(queue_name, bodies, properties)
+
+        return message_outbox().drain(self.server_key, publish, batch_size)
 
     def __enter__(self):
         try:
-            self.connection = self.get_connection()
+            self.connect().run(lambda channel: channel)
             return self
         except:
             raise ConnectionError("Error connecting to Rabbit server")
 
     def __exit__(self, *_):
-        self.connection.close()
+        # the shared connection outlives this object, see close_rabbit_connections
+        ...
+
+
+def rabbit_target(rabbit_config, profiles, queue_value):
+    """ (rabbit config, queue name) of a queue preset. A `queue@profile` value is the
+        queue on the broker of that profile, whose server and credentials are merged
+        over the ones of `rabbit_config` """
+
+    queue_name, at, profile_name = queue_value.rpartition('@')
+    if not at:
+        return rabbit_config, queue_value
+
+    profile = profiles.get(profile_name)
+    if profile is None:
+        raise ValueError(f"No rabbit profile named {profile_name!r} for the queue {queue_value!r}")
+
+    config = dict(
+            server = dict(rabbit_config['server'], **(profile.get('server') or {})),
+            credentials = dict(rabbit_config['credentials'], **(profile.get('credentials') or {}))
+        )
+    return config, queue_name
+
+
+class FanOut:
+    """
+    Publishes every message to several targets, (name, rabbit config, queue name)
+    each, at the same time. The message is serialized once and every target
+    publishes over a connection of its own and keeps its own outbox entry, so
+    that a broker which is down only holds back its own copy.
+    """
+
+    def __init__(self, targets, db_name):
+        if not targets:
+            raise ValueError("No rabbit queue selected")
+
+        # targets on the same server would otherwise take turns on its shared connection.
+        # A lane is kept in the registry of rabbit_connection under its server and queue
+        lanes = len(targets) > 1
+        self.targets = [
+                (name, RabbitMQ(config, db_name, queue_name, lane=queue_name if lanes else None))
+                for name, config, queue_name in targets
+            ]
+        self.pool = ThreadPoolExecutor(len(self.targets)) if lanes else None
+
+    @property
+    def server_keys(self):
+        return list(dict.fromkeys(rmq.server_key for _, rmq in self.targets))
+
+    def pending(self):
+        box = message_outbox()
+        return sum(box.count(server_key) for server_key in self.server_keys)
+
+    def publish(self, message:dict):
+        """ Publishes to every target, returns the seconds each one took to confirm.
+            Raises once all are done if any of them did not confirm """
+
+        body = json.dumps(message)
+        trace = tracing.current()
+
+        def publish(target):
+            name, rmq = target
+            started = perf_counter()
+            try:
+                with tracing.activate(trace):
+                    acked, = rmq.publish_bodies([body])
+            except Exception as e:
+                return name, None, e
+            latency = perf_counter() - started
+            if trace is not None:
+                trace.add(f'confirm:{name}', latency, queue=rmq.queue_name)
+            return name, latency, None if acked else ConnectionError("Message was not confirmed by the Rabbit server")
+
+        results = self.pool.map(publish, self.targets) if self.pool else map(publish, self.targets)
+
+        latencies, errors = {}, []
+        for name, latency, error in results:
+            if error is None:
+                latencies[name] = latency
+            else:
+                errors.append(f"{name}: {error}")
+
+        if errors:
+            raise ConnectionError('; '.join(errors))
+        return latencies
+
+    def flush_outbox(self):
+        """ Publishes what earlier runs left in the outbox for every server, returns (published, still pending) """
+
+        flushed = {}
+        for _, rmq in self.targets:
+            if rmq.server_key not in flushed:
+                flushed[rmq.server_key] = rmq.flush_outbox()
+        return tuple(map(sum, zip(*flushed.values())))
+
+    def close(self):
+        # the lane connections stay open for the next job publishing to the
+        # same targets, close_rabbit_connections closes them with the others
+        if self.pool:
+            self.pool.shutdown()
+
+
+class UploadProgress:
+    """ boto3 transfer callback turning transferred bytes into a percentage,
+        one instance can follow several uploads of `size` bytes in total """
+
+    def __init__(self, size, on_progress):
+        self.size = size or 1
+        self.on_progress = on_progress
+        self.transferred = 0
+        self.percent = -1
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        # boto3 calls this from its transfer threads
+        with self.lock:
+            self.transferred += bytes_amount
+            percent = min(100, self.transferred * 100 // self.size)
+            if percent == self.percent:
+                return
+            self.percent = percent
+
+        self.on_progress(percent)
+
+
+# boto3 clients are expensive to build (botocore loads the service model and
+# opens a fresh connection pool) but are thread safe once built, so a single
+# client is shared per endpoint and credentials for the whole process
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def s3_client(endpoint_url, access, secret, max_pool_connections=10):
+    import boto3
+    from botocore.config import Config
+
+    key = (endpoint_url, access, secret, max_pool_connections)
+
+    with _s3_clients_lock:
+        client = _s3_clients.get(key)
+        if client is None:
+            with tracing.span('s3_client'):
+                client = boto3.client(
+                        's3',
+                        endpoint_url=endpoint_url,
+                        aws_access_key_id=access,
+                        aws_secret_access_key=secret,
+                        config=Config(max_pool_connections=max_pool_connections)
+                    )
+            _s3_clients[key] = client
+
+    return client
+
+
+def invalidate_s3_clients():
+    with _s3_clients_lock:
+        _s3_clients.clear()
+
+
+_upload_cache = None
+_run_log = None
+_outbox = None
+_multipart_checkpoints = multipart.CheckpointStore(os.path.join(CONFIG_DIR, 'multipart'))
+# (endpoint, bucket, prefix) whose abandoned multipart uploads were aborted by this process
+_abandoned_cleaned = set()
+_abandoned_cleaned_lock = threading.Lock()
+
+
+def upload_cache():
+    global _upload_cache
+
+    if _upload_cache is None:
+        _upload_cache = hashcache.UploadCache(os.path.join(CONFIG_DIR, 'upload_cache.json'))
+    return _upload_cache
+
+
+def run_log():
+    """ The JSON lines log every job's timings are written to """
+
+    global _run_log
+
+    if _run_log is None:
+        _run_log = tracing.RunLog(os.path.join(CONFIG_DIR, 'runs.jsonl'))
+    return _run_log
+
+
+def message_outbox():
+    global _outbox
+
+    if _outbox is None:
+        _outbox = outbox.Outbox(os.path.join(CONFIG_DIR, 'outbox.sqlite3'))
+    return _outbox
+
+
+def transfer_config(upload_config):
+    """ Builds the boto3 transfer settings from the `upload` config section, sizes are in MB """
+
+    from boto3.s3.transfer import TransferConfig
+
+    if not upload_config:
+        return TransferConfig()
+
+    return TransferConfig(
+            multipart_threshold = int(upload_config['multipart_threshold']) * MB,
+            multipart_chunksize = int(upload_config['multipart_chunksize']) * MB,
+            max_concurrency = int(upload_config['max_concurrency']),
+            use_threads = bool(upload_config['use_threads'])
+        )
+
+
+def replica_config(aws_config, replica):
+    """ An entry of the 'replicas' of the aws section merged over the section itself,
+        a replica only names what differs, its bucket or endpoint for one """
+
+    config = {key: value for key, value in aws_config.items() if key != 'replicas'}
+    config.update((key, value) for key, value in replica.items() if key != 'credentials')
+    config['credentials'] = dict(aws_config['credentials'], **(replica.get('credentials') or {}))
+    return config
 
 
 class AWS:
 
-    def __init__(self, aws_config, folder_name):
+    def __init__(self, aws_config, folder_name, upload_config=None):
 
         self.bucket_name = aws_config['bucket_name']
         self.endpoint_url = aws_config['endpoint_url']
@@ -136,32 +754,343 @@ class AWS:
         self.secret = aws_config['credentials']['aws_secret_access_key']
 
         self.folder_name = folder_name
+        self.upload_config = upload_config or {}
+        self.transfer_config = None
+
+        # every concurrent part upload needs its own keep-alive connection
+        self.max_pool_connections = max(
+                int(self.upload_config.get('max_pool_connections', 10)),
+                int(self.upload_config.get('max_concurrency', 10))
+            )
+
+        # copies of every upload on other buckets or endpoints. The message is only
+        # published once the required ones hold the file, the others may fail
+        self.name = aws_config.get('name') or f"{self.bucket_name}@{urlsplit(self.endpoint_url).netloc}"
+        self.required = bool(aws_config.get('required', True))
+        self.replicas = [
+                AWS(replica_config(aws_config, replica), folder_name, upload_config)
+                for replica in aws_config.get('replicas') or ()
+            ]
+
+    @property
+    def targets(self):
+        return [self, *self.replicas]
 
     def get_connection(self):
-        if not all([self.endpoint_url, self.access, self.secret, self.bucket_name]):
-            raise ValueError("Incomplete aws configuration")
+        for target in self.targets:
+            if not all([target.endpoint_url, target.access, target.secret, target.bucket_name]):
+                raise ValueError("Incomplete aws configuration")
 
-        try:
-            self.client = boto3.client(
-                    's3',
-                    endpoint_url=self.endpoint_url,
-                    aws_access_key_id=self.access,
-                    aws_secret_access_key=self.secret
-                )
-        except:
-            raise ConnectionError("Invalid AWS configuration")
+            try:
+                target.client = s3_client(
+                        target.endpoint_url, target.access, target.secret, target.max_pool_connections
+                    )
+            except:
+                raise ConnectionError("Invalid AWS configuration")
+
+            if target.transfer_config is None:
+                target.transfer_config = transfer_config(target.upload_config)
 
     def list_buckets(self):
         self.get_connection()
         return self.client.list_buckets()
 
-    def upload(self, local_file_path):
+    def abort_abandoned_uploads(self):
+        """ Once per process and folder, aborts the multipart uploads nobody came back to resume """
+
+        self.get_connection()
+        hours = float(self.upload_config.get('abandoned_upload_hours', multipart.ABANDONED_AFTER_HOURS))
+        prefix = os.path.join(self.folder_name, '') if self.folder_name else ''
+        # other clients' uploads are only aborted when asked to, and never bucket wide
+        sweep = bool(self.upload_config.get('sweep_abandoned_uploads')) and bool(prefix)
+
+        with _abandoned_cleaned_lock:
+            targets = [
+                    target for target in self.targets
+                    if (target.endpoint_url, target.bucket_name, prefix) not in _abandoned_cleaned
+                ]
+            _abandoned_cleaned.update((target.endpoint_url, target.bucket_name, prefix) for target in targets)
+
+        with tracing.span('multipart_cleanup') as span:
+            span['aborted'] = sum(
+                    multipart.abort_abandoned(
+                        target.client, target.bucket_name, _multipart_checkpoints, target.endpoint_url,
+                        hours, prefix=prefix, sweep=sweep
+                    )
+                    for target in targets
+                )
+        return span['aborted']
+
+    def encoding_for(self, message, local_file_path):
+        """ Codec the file of the message is compressed with on upload, None when it is not """
+
+        return compression.codec_for(self.upload_config.get('compression'), message.get('file_type'), local_file_path)
+
+    def upload(self, local_file_path, callback=None, force=False, encoding=None):
+        """ Returns True once the file is on every required target, it raises when one failed.
+            Returns False when every target already held the file's content and the upload was skipped.
+            Files above the multipart threshold resume from the last part an earlier attempt completed.
+            With an `encoding` the file is compressed as it is sent, under the name of compression.object_name """
 
         self.get_connection()
         s3_file_path = os.path.join(
                 self.folder_name,
-                os.path.basename(local_file_path)
+                compression.object_name(os.path.basename(local_file_path), encoding)
+            )
+
+        with tracing.span('hash'):
+            digest = upload_cache().digest(local_file_path)
+
+        targets = self.targets
+        if not force:
+            with tracing.span('dedup_check') as span:
+                targets = [
+                        target for target in targets
+                        if not target.holds(digest, s3_file_path, replica=target is not self)
+                    ]
+                span['unchanged'] = not targets
+            if span['unchanged']:
+                if callback:
+                    callback(os.path.getsize(local_file_path))
+                return False
+
+        size = os.path.getsize(local_file_path)
+        metadata = {hashcache.METADATA_KEY: digest}
+
+        if size >= self.transfer_config.multipart_threshold:
+            with tracing.span('upload', bytes=size, resumable=True, targets=len(targets), encoding=encoding):
+                results = multipart.upload_many(
+                        [(target.client, target.bucket_name, s3_file_path, target.endpoint_url) for target in targets],
+                        local_file_path, digest, _multipart_checkpoints,
+                        part_size = self.transfer_config.multipart_chunksize,
+                        max_concurrency = self.transfer_config.max_request_concurrency
+                                          if self.transfer_config.use_threads else 1,
+                        metadata = metadata, callback = callback, encoding = encoding
+                    )
+        elif len(targets) == 1 and not encoding:
+            target, = targets
+            with tracing.span('upload', bytes=size):
+                try:
+                    target.client.upload_file(
+                            local_file_path, target.bucket_name, s3_file_path,
+                            Callback=callback, Config=self.transfer_config,
+                            ExtraArgs={'Metadata': metadata}
+                        )
+                    results = [None]
+                except Exception as e:
+                    results = [e]
+        else:
+            with tracing.span('upload', bytes=size, targets=len(targets), encoding=encoding):
+                results = self.put_many(targets, local_file_path, s3_file_path, metadata, callback, encoding)
+
+        failed = [(target, result) for target, result in zip(targets, results) if isinstance(result, Exception)]
+
+        trace = tracing.current()
+        if trace is not None:
+            for target, error in failed:
+                trace.add(f'upload_failed:{target.name}', 0.0, required=target.required, error=str(error))
+
+        # a file no target holds is never published, required or not
+        required = [
+                (target, error) for target, error in failed
+                if target.required or len(failed) == len(self.targets)
+            ]
+        if required and len(self.targets) == 1:
+            raise required[0][1]
+        if required:
+            raise ConnectionError('; '.join(f"{target.name}: {error}" for target, error in required))
+
+        # the file is on every required target, the optional replicas that failed
+        # are left in the trace for replica_failures
+        return True
+
+    def holds(self, digest, s3_file_path, replica=False):
+        try:
+            return hashcache.is_uploaded(self.client, digest, self.bucket_name, s3_file_path)
+        except Exception:
+            # a replica that cannot be reached fails its upload instead, and only
+            # holds back the message when it is required
+            if not replica:
+                raise
+            return False
+
+    def put_many(self, targets, local_file_path, s3_file_path, metadata, callback=None, encoding=None):
+        """ Puts a file below the multipart threshold on every target at once, streamed from
+            the file and compressed while it is sent. Returns None, or the exception, of every target """
+
+        size = os.path.getsize(local_file_path)
+        extra_args = {'Metadata': metadata}
+        if encoding:
+            extra_args['ContentEncoding'] = encoding
+
+        def put(target):
+            try:
+                # every target reads the file on its own
+                with (compression.CompressedReader(local_file_path, encoding) if encoding
+                      else open(local_file_path, 'rb')) as body:
+                    target.client.upload_fileobj(
+                            body, target.bucket_name, s3_file_path,
+                            Config=self.transfer_config, ExtraArgs=extra_args
+                        )
+            except Exception as e:
+                return e
+            if callback:
+                callback(size / len(targets))
+
+        with ThreadPoolExecutor(len(targets)) as pool:
+            return list(pool.map(put, targets))
+
+
+def replica_failures(trace):
+    """ {target name: error} of the optional replicas an upload of the trace failed on """
+
+    with trace.lock:
+        return {
+                span.name.split(':', 1)[1]: span.attributes.get('error')
+                for span in trace.spans
+                if span.name.startswith('upload_failed:') and not span.attributes.get('required')
+            }
+
+
+# connection tests of the configuration window. A successful result is reused for this
+# long so that clicking Test again does not handshake with the server again
+PROBE_CACHE_SECONDS = 10
+PROBE_CONNECT_TIMEOUT = 5
+PROBE_READ_TIMEOUT = 10
+
+_probe_results = {}
+_probe_results_lock = threading.Lock()
+
+
+class ProbeResult:
+    __slots__ = ('ok', 'latencies', 'error', 'checked_at')
+
+    def __init__(self, ok, latencies, error=None):
+        self.ok = ok
+        self.latencies = latencies
+        self.error = error
+        self.checked_at = monotonic()
+
+    @property
+    def total(self):
+        return sum(self.latencies.values())
+
+    def describe(self):
+        return ', '.join(
+                f"{stage.replace('_', ' ')} {seconds * 1000:.0f} ms"
+                for stage, seconds in self.latencies.items()
             )
 
-        self.client.upload_file(local_file_path, self.bucket_name, s3_file_path)
 
+def cached_probe(key, probe):
+    """ The result of `probe()`, or the successful one it returned for `key` less than
+        PROBE_CACHE_SECONDS ago. Returns the result and whether it came from the cache """
+
+    with _probe_results_lock:
+        result = _probe_results.get(key)
+    if result is not None and monotonic() - result.checked_at < PROBE_CACHE_SECONDS:
+        return result, True
+
+    result = probe()
+    with _probe_results_lock:
+        # a failure is probed again right away, the server may have been fixed since
+        if result.ok:
+            _probe_results[key] = result
+        else:
+            _probe_results.pop(key, None)
+    return result, False
+
+
+def timed_probe(stages):
+    """ Runs the (name, callable) stages in order, timing each, until one raises """
+
+    latencies = {}
+    try:
+        for name, stage in stages:
+            started = perf_counter()
+            stage()
+            latencies[name] = perf_counter() - started
+    except Exception as e:
+        return ProbeResult(False, latencies, e)
+    return ProbeResult(True, latencies)
+
+
+def probe_rabbit(rabbit_config, connect_timeout=PROBE_CONNECT_TIMEOUT, read_timeout=PROBE_READ_TIMEOUT):
+    """ Times the TCP connect, the AMQP handshake and login, and opening a channel """
+
+    import pika
+
+    server, credentials = rabbit_config['server'], rabbit_config['credentials']
+    key = ('rabbit', *server.values(), *credentials.values(), connect_timeout, read_timeout)
+    state = {}
+
+    def connect():
+        socket.create_connection((server['host'], int(server['port'])), timeout=connect_timeout).close()
+
+    def auth():
+        state['connection'] = pika.BlockingConnection(pika.ConnectionParameters(
+                host = server['host'],
+                port = int(server['port']),
+                virtual_host = server['virtual_host'],
+                credentials = pika.PlainCredentials(credentials['username'], credentials['password']),
+                connection_attempts = 1,
+                socket_timeout = connect_timeout,
+                stack_timeout = connect_timeout + read_timeout,
+                blocked_connection_timeout = read_timeout
+            ))
+
+    def first_call():
+        state['connection'].channel().close()
+
+    def probe():
+        try:
+            return timed_probe((('connect', connect), ('auth', auth), ('first_call', first_call)))
+        finally:
+            if 'connection' in state:
+                try:
+                    state['connection'].close()
+                except Exception:
+                    pass
+
+    return cached_probe(key, probe)
+
+
+def probe_s3(aws_config, folder_name='', connect_timeout=PROBE_CONNECT_TIMEOUT, read_timeout=PROBE_READ_TIMEOUT):
+    """ Times the TCP connect, a signed request on the bucket and listing the folder """
+
+    import boto3
+    from botocore.config import Config
+
+    bucket_name, endpoint_url = aws_config['bucket_name'], aws_config['endpoint_url']
+    credentials = aws_config['credentials']
+    key = ('s3', bucket_name, endpoint_url, *credentials.values(), folder_name, connect_timeout, read_timeout)
+
+    if not all([endpoint_url, bucket_name, *credentials.values()]):
+        return ProbeResult(False, {}, ValueError("Incomplete aws configuration")), False
+
+    def probe():
+        url = urlsplit(endpoint_url)
+        port = url.port or (443 if url.scheme == 'https' else 80)
+
+        try:
+            # a client of its own, the shared ones retry and wait far longer
+            client = boto3.client(
+                    's3',
+                    endpoint_url=endpoint_url,
+                    aws_access_key_id=credentials['aws_access_key_id'],
+                    aws_secret_access_key=credentials['aws_secret_access_key'],
+                    config=Config(
+                        connect_timeout=connect_timeout, read_timeout=read_timeout,
+                        retries={'total_max_attempts': 1}
+                    )
+                )
+        except Exception as e:
+            return ProbeResult(False, {}, e)
+
+        return timed_probe((
+                ('connect', lambda: socket.create_connection((url.hostname, port), timeout=connect_timeout).close()),
+                ('auth', lambda: client.head_bucket(Bucket=bucket_name)),
+                ('first_call', lambda: client.list_objects_v2(Bucket=bucket_name, Prefix=folder_name, MaxKeys=1))
+            ))
+
+    return cached_probe(key, probe)
@@ -0,0 +1,266 @@
+"""
+Watches a directory tree for new files and hands them out once they are
+fully written, for the `--watch` mode of publisher_script.py.
+
+Changes are picked up with inotify (through ctypes, Linux only) and with a
+periodic scan of the tree where it is not available. Either way a file is
+only ready once its size and mtime stayed the same for `settle` seconds, so
+that files still being copied or written are not uploaded half way.
+
+    watcher = Watcher(directory, presets=Presets(config['presets']))
+    for path, preset in watcher.files(stop_event):
+        ...
+"""
+
+import os
+import errno
+import fnmatch
+import select
+import struct
+import ctypes
+import ctypes.util
+from time import monotonic
+
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# files being written by editors, browsers and copy tools under a temporary name
+IGNORED_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.swp', '~')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+# wd, mask, cookie and length of the name following every event
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def is_ignored(name):
+    return name.startswith('.') or name.endswith(IGNORED_SUFFIXES)
+
+
+class Inotify:
+    """ The inotify instance of the tree, with a watch on every directory in it """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.directories = {}
+
+    def add(self, directory):
+        wd = self.add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), directory)
+        self.directories[wd] = directory
+
+    def read(self, timeout):
+        """ (path, mask) of the events of the next `timeout` seconds """
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            directory = self.directories.get(wd)
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+            elif directory is not None or mask & IN_Q_OVERFLOW:
+                events.append((os.path.join(directory, name) if directory and name else directory, mask))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Presets:
+    """
+    Message fields by sub-directory or file name pattern, the first rule that
+    matches a file wins:
+
+        - directory: invoices          # relative to the watched one, sub-directories included
+          file_type: invoice
+          company_name: tml
+        - pattern: '*_sales_*.csv'
+          data_type: sales
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        for rule in rules or ():
+            rule = dict(rule)
+            directory, pattern = rule.pop('directory', None), rule.pop('pattern', None)
+            if directory is None and pattern is None:
+                raise ValueError(f"Watch preset {rule} has neither a 'directory' nor a 'pattern'")
+            self.rules.append((directory and os.path.normpath(directory), pattern, rule))
+
+    def match(self, relative_path):
+        """ The fields of the first rule matching the path relative to the watched directory, None when none does """
+
+        directory, name = os.path.split(relative_path)
+
+        for rule_directory, pattern, fields in self.rules:
+            if rule_directory is not None and directory != rule_directory \
+                    and not directory.startswith(rule_directory + os.sep):
+                continue
+            if pattern is not None and not fnmatch.fnmatch(name, pattern):
+                continue
+            return fields
+
+        return None
+
+
+class Watcher:
+
+    def __init__(self, directory, presets=None, settle=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True, existing=False):
+        self.directory = os.path.abspath(directory)
+        self.presets = presets or Presets()
+        self.settle = settle
+        self.poll_interval = poll_interval
+
+        # (size, mtime) of every file last seen and of every file waiting to settle
+        self.seen = {}
+        self.candidates = {}
+
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                # not linux, or out of inotify instances
+                self.inotify = None
+
+        for path, signature in self.scan():
+            if existing:
+                self.candidates[path] = (signature, monotonic())
+            else:
+                self.seen[path] = signature
+
+    @property
+    def mode(self):
+        return 'inotify' if self.inotify else 'polling'
+
+    def scan(self, directory=None):
+        """ (path, signature) of every file in the tree, watching every directory on the way """
+
+        for root, directories, names in os.walk(directory or self.directory):
+            directories[:] = [name for name in directories if not name.startswith('.')]
+            if self.inotify:
+                try:
+                    self.inotify.add(root)
+                except OSError as e:
+                    # out of watches, the tree is scanned from now on. Directories
+                    # removed or unreadable in the meantime are only skipped
+                    if e.errno == errno.ENOSPC:
+                        self.inotify.close()
+                        self.inotify = None
+
+            for name in names:
+                if not is_ignored(name):
+                    path = os.path.join(root, name)
+                    signature = self.signature(path)
+                    if signature:
+                        yield path, signature
+
+    @staticmethod
+    def signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def changed(self, timeout):
+        """ Paths that may have been created or written to in the next `timeout` seconds """
+
+        if self.inotify is None:
+            # the next scan is due either way, waiting is up to the caller
+            return [
+                    path for path, signature in self.scan()
+                    if self.seen.get(path) != signature and path not in self.candidates
+                ]
+
+        paths = []
+        for path, mask in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, a scan catches up on them
+                paths.extend(path for path, signature in self.scan() if self.seen.get(path) != signature)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith('.'):
+                    # files could already be in it before its watch was added
+                    paths.extend(path for path, _ in self.scan(path))
+            elif mask & IN_DELETE_SELF and path == self.directory:
+                raise FileNotFoundError(errno.ENOENT, "The watched directory was removed", path)
+            elif not is_ignored(os.path.basename(path)):
+                paths.append(path)
+
+        return paths
+
+    def ready(self):
+        """ Paths of the candidates whose size and mtime did not change for `settle` seconds """
+
+        now, ready = monotonic(), []
+        for path, (signature, since) in list(self.candidates.items()):
+            current = self.signature(path)
+            if current is None:
+                del self.candidates[path]
+            elif current != signature:
+                self.candidates[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.candidates[path]
+                self.seen[path] = current
+                ready.append(path)
+
+        return ready
+
+    def files(self, stop):
+        """ Yields (path, preset fields) of every new file once it settled, until `stop` is set """
+
+        try:
+            while not stop.is_set():
+                for path in self.ready():
+                    yield path, self.presets.match(os.path.relpath(path, self.directory))
+
+                # wake up in time for the next candidate to settle
+                timeout = self.poll_interval
+                if self.candidates:
+                    timeout = min(timeout, self.settle / 2)
+
+                if self.inotify is None:
+                    stop.wait(timeout)
+
+                now = monotonic()
+                for path in self.changed(timeout):
+                    signature = self.signature(path)
+                    if signature and path not in self.candidates and self.seen.get(path) != signature:
+                        self.candidates[path] = (signature, now)
+        finally:
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None